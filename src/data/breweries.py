@@ -1,11 +1,13 @@
 import pandas as pd
+from src.data.time_buckets import time_bucket
 
 def breweries_first_date(reviews_df, brew_df):
-    rev = reviews_df.loc[:, ('brewery_id', 'date')].sort_values('date').drop_duplicates(subset=['brewery_id'])
+    # first review day of each brewery, as an integer day ordinal
+    first_day = time_bucket(reviews_df, 'day').groupby(reviews_df['brewery_id'].to_numpy()).min()
 
-    brew_df['first_rev']=brew_df['brewery_id'].map(dict(zip(rev.brewery_id,rev.date)))
+    brew_df['first_rev'] = pd.to_datetime(brew_df['brewery_id'].map(first_day), unit='D')
     brew_df = brew_df.dropna(subset=['first_rev'])
-    brew_df['year_month'] = pd.to_datetime(brew_df['first_rev']).dt.to_period('M')
+    brew_df['year_month'] = brew_df['first_rev'].dt.to_period('M')
     first_review = brew_df['year_month'].min()
     last_review = brew_df['year_month'].max()
 
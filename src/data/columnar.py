@@ -0,0 +1,229 @@
+import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+import pyarrow as pa
+import pyarrow.parquet as pq
+from src.data.schemas import apply_schema, column_dtype
+
+COMPRESSION = "zstd"
+
+
+def table_base_path(path):
+    """
+    Removes the .csv/.parquet extension of a table path so both formats can be looked up.
+    """
+    for extension in (".csv", ".parquet"):
+        if path.endswith(extension):
+            return path[:-len(extension)]
+    return path
+
+
+def parquet_path(path):
+    return table_base_path(path) + ".parquet"
+
+
+def csv_path(path):
+    return table_base_path(path) + ".csv"
+
+
+def table_exists(path):
+    """
+    Returns True if the table exists on disk either as .parquet or as .csv
+    """
+    return os.path.exists(parquet_path(path)) or os.path.exists(csv_path(path))
+
+
+def save_table(df, path, schema=None, index=False):
+    """
+    Saves a dataframe as a compressed .parquet file, the column types are stored in the file schema.
+
+    Args:
+        - df (pd.DataFrame): the table to save
+        - path (str): path of the table, with or without extension
+        - schema (str, optional): name of the table in SCHEMAS, its compact dtypes are applied before saving
+        - index (bool, optional): if the index is saved too (load_table restores it). Defaults to False.
+    """
+    if schema is not None:
+        df = apply_schema(df, schema)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=index)
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # object columns mixing python types (e.g. after pd.to_numeric(errors='ignore')) are stored as strings
+        mixed = df.columns[df.dtypes == "object"]
+        df = df.assign(**{column: df[column].where(df[column].isna(), df[column].astype(str)) for column in mixed})
+        table = pa.Table.from_pandas(df, preserve_index=index)
+    pq.write_table(table, parquet_path(path), compression=COMPRESSION)
+
+
+def load_table(path, columns=None, schema=None, filters=None, **read_csv_kwargs):
+    """
+    Loads a table from its .parquet file, only reading the requested columns.
+    If only the .csv exists (or the .csv is newer) it is parsed once and converted to .parquet for the next calls.
+
+    Args:
+        - path (str): path of the table, with or without extension
+        - columns (list, optional): columns to load. Defaults to None (all columns).
+        - schema (str, optional): name of the table in SCHEMAS, its compact dtypes are applied to the loaded columns
+        - filters (list, optional): row filters pushed down to the .parquet reader, e.g. [("date", ">", timestamp)],
+                                    only the row groups that can match are read. Defaults to None (all rows).
+        - read_csv_kwargs: passed to pd.read_csv when the .csv has to be parsed
+
+    Returns:
+        pd.DataFrame: the loaded table
+    """
+    parquet_file = parquet_path(path)
+    csv_file = csv_path(path)
+    csv_is_newer = os.path.exists(csv_file) and (
+        not os.path.exists(parquet_file) or os.path.getmtime(csv_file) > os.path.getmtime(parquet_file)
+    )
+    if csv_is_newer:
+        df = pd.read_csv(csv_file, low_memory=False, **read_csv_kwargs)
+        if schema is not None:
+            df = apply_schema(df, schema)
+        save_table(df, parquet_file)
+        if filters is None:
+            return df if columns is None else df[columns]
+    df = pd.read_parquet(parquet_file, columns=columns, filters=filters)
+    return df if schema is None else apply_schema(df, schema)
+
+
+
+def table_columns(path):
+    """
+    Returns the column names of a table without loading it
+    """
+    if os.path.exists(parquet_path(path)):
+        return pq.read_schema(parquet_path(path)).names
+    return list(pd.read_csv(csv_path(path), nrows=0).columns)
+
+
+def iter_table_chunks(path, chunksize, columns=None):
+    """
+    Reads a table in chunks of at most chunksize rows, only the requested columns are read.
+
+    Args:
+        - path (str): path of the table, with or without extension
+        - chunksize (int): number of rows per chunk
+        - columns (list, optional): columns to load. Defaults to None (all columns).
+
+    Returns:
+        generator of pd.DataFrame: the chunks, in file order
+    """
+    if os.path.exists(parquet_path(path)):
+        for batch in pq.ParquetFile(parquet_path(path)).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(csv_path(path), chunksize=chunksize, usecols=columns, low_memory=False)
+
+
+def _smallest_integer_dtype(low, high):
+    """
+    Integer type pd.to_numeric(downcast="integer") gives to a column whose values are between low and high
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class ChunkedTableWriter:
+    """
+    Appends dataframes one after the other to a single .parquet table, to write tables that do not fit in memory.
+    Every chunk is cast to the column types of the first non-empty chunk.
+
+    With a schema, the table gets the same dtypes as save_table(df, path, schema) on all the rows: the chunks are
+    written with wide types (int64, strings) and, when the writer is closed, the file is rewritten batch by batch
+    with the integer columns downcast to the range of all the rows and the categorical columns sharing the sorted
+    categories of all the rows.
+
+    Args:
+        - path (str): path of the table, with or without extension
+        - schema (str, optional): name of the table in SCHEMAS. Defaults to None (dtypes of the chunks).
+    """
+
+    def __init__(self, path, schema=None):
+        self.path = parquet_path(path)
+        self.schema = schema
+        self._writer = None
+        self._empty = None
+        self._ranges = {}
+        self._categories = {}
+
+    @property
+    def _chunks_path(self):
+        return self.path + ".chunks" if self.schema is not None else self.path
+
+    def _widen(self, df):
+        """
+        Applies the schema to a chunk, keeps the range of its integer columns and the values of its categorical
+        columns, and returns it with int64 and string columns so every chunk has the same types
+        """
+        df = apply_schema(df, self.schema)
+        widened = {}
+        for column in df.columns:
+            values = df[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                self._categories.setdefault(column, set()).update(values.cat.categories)
+                widened[column] = values.astype(object)
+            elif column_dtype(self.schema, column) == "integer" and is_integer_dtype(values.dtype):
+                low, high = self._ranges.get(column, (values.min(), values.max()))
+                self._ranges[column] = (min(low, values.min()), max(high, values.max()))
+                widened[column] = values.astype(np.int64)
+        return df.assign(**widened)
+
+    def _final_dtypes(self, df):
+        converted = {
+            column: pd.Categorical(df[column], categories=sorted(self._categories[column]))
+            for column in self._categories if column in df.columns
+        }
+        converted.update({
+            column: df[column].astype(_smallest_integer_dtype(*self._ranges[column]))
+            for column in self._ranges if column in df.columns and is_integer_dtype(df[column].dtype)
+        })
+        return df.assign(**converted)
+
+    def write(self, df):
+        if len(df) == 0:
+            self._empty = df
+            return
+        if self.schema is not None:
+            df = self._widen(df)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            # a column with only missing values in the first chunk has no type yet, strings are the only option
+            schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema
+            ], metadata=table.schema.metadata)
+            self._writer = pq.ParquetWriter(self._chunks_path, schema, compression=COMPRESSION)
+        self._writer.write_table(table.select(self._writer.schema.names).cast(self._writer.schema))
+
+    def _rewrite(self):
+        chunks = pq.ParquetFile(self._chunks_path)
+        schema = None
+        writer = None
+        try:
+            for row_group in range(chunks.num_row_groups):
+                df = self._final_dtypes(chunks.read_row_group(row_group).to_pandas())
+                if schema is None:
+                    schema = pa.Schema.from_pandas(df, preserve_index=False)
+                    writer = pq.ParquetWriter(self.path, schema, compression=COMPRESSION)
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        finally:
+            if writer is not None:
+                writer.close()
+            os.remove(self._chunks_path)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            if self.schema is not None:
+                self._rewrite()
+        elif self._empty is not None:
+            save_table(self._empty, self.path, schema=self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,28 @@
+import os
+
+# Folders of the datasets, the same under the extracted and the clean data paths (see tar_gz_to_csv and clean_data)
+BEER_ADVOCATE = "BeerAdvocate"
+RATE_BEER = "RateBeer"
+MATCHED = "MatchedBeerData"
+DATASETS = [BEER_ADVOCATE, RATE_BEER, MATCHED]
+
+# the extracted tables are prefixed with the name of their archive, e.g. MatchedBeerData/matched_beer_data_ratings
+ARCHIVE_NAMES = {BEER_ADVOCATE: "BeerAdvocate", RATE_BEER: "RateBeer", MATCHED: "matched_beer_data"}
+
+
+def dataset_folder(archive_name):
+    """
+    Returns the dataset folder of an archive or of a table extracted from it (e.g. "RateBeer_ratings.csv"), None if
+    it is not one of the datasets
+    """
+    for dataset_name, name in ARCHIVE_NAMES.items():
+        if archive_name.startswith(name):
+            return dataset_name
+    return None
+
+
+def raw_table_path(data_path, dataset_name, table):
+    """
+    Path (without extension) of an extracted table of a dataset, e.g. raw_table_path("data/clean", RATE_BEER, "users")
+    """
+    return os.path.join(data_path, dataset_name, ARCHIVE_NAMES[dataset_name] + "_" + table)
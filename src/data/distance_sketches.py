@@ -0,0 +1,208 @@
+import os
+import numpy as np
+import pandas as pd
+from src.data.time_buckets import time_bucket, to_ordinal, to_periods
+
+# Histogram of the distances of the reviews with fixed bins, so the histograms of two sets of reviews are merged
+# by adding them: a first bin [0, MIN_DISTANCE) for local reviews, then log-spaced bins up to MAX_DISTANCE
+# (each about 5% wide, the precision of the quantiles), the last bin also holds larger distances.
+MIN_DISTANCE = 1.0
+MAX_DISTANCE = 40000.0
+N_LOG_BINS = 200
+BIN_EDGES = np.concatenate([[0.0], np.geomspace(MIN_DISTANCE, MAX_DISTANCE, N_LOG_BINS + 1)])
+N_BINS = len(BIN_EDGES) - 1
+# representative distance of each bin, for the trimmed means
+BIN_CENTERS = np.concatenate([[MIN_DISTANCE / 2], np.sqrt(BIN_EDGES[1:-1] * BIN_EDGES[2:])])
+
+SKETCHES_FILE = "distance_sketches.npz"
+
+
+def distance_bins(distances):
+    """
+    Returns the bin of each distance (nan distances must be removed before)
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    log_bins = np.floor(np.log(np.maximum(distances, MIN_DISTANCE) / MIN_DISTANCE)
+                        / np.log(MAX_DISTANCE / MIN_DISTANCE) * N_LOG_BINS).astype(np.int64)
+    return np.where(distances < MIN_DISTANCE, 0, 1 + np.minimum(log_bins, N_LOG_BINS - 1))
+
+
+def _interpolate(bins, fractions):
+    """
+    Distance at a fraction of the reviews of bins, linear in the first bin and logarithmic in the other ones
+    """
+    lower, upper = BIN_EDGES[bins], BIN_EDGES[bins + 1]
+    return np.where(bins == 0, fractions * MIN_DISTANCE, lower * (upper / np.where(lower > 0, lower, 1)) ** fractions)
+
+
+def _group_codes(keys):
+    """
+    Returns the group of each row of keys and the distinct rows (sorted), group i is row i of the distinct rows
+    """
+    columns = list(keys.columns)
+    codes = keys.groupby(columns, sort=True).ngroup().to_numpy()
+    return codes, keys.drop_duplicates().sort_values(columns).reset_index(drop=True)
+
+
+class DistanceSketches:
+    """
+    Distance histograms of the reviews of each (month, user_state), see BIN_EDGES.
+    The sketches of two sets of reviews are merged by adding them, and medians, quantiles and trimmed means
+    are computed from the histograms without the reviews.
+
+    Args:
+        - keys (pd.DataFrame): columns month (month ordinal, see time_buckets) and user_state, one row per histogram
+        - counts (np.ndarray): number of reviews in each bin, shape (len(keys), N_BINS)
+        - sums (np.ndarray): sum of the distances of the reviews of each histogram (for exact means)
+    """
+
+    def __init__(self, keys, counts, sums):
+        self.keys = keys.reset_index(drop=True)
+        self.counts = np.asarray(counts, dtype=np.int64).reshape(len(self.keys), N_BINS)
+        self.sums = np.asarray(sums, dtype=np.float64)
+
+    @classmethod
+    def from_reviews(cls, ratings_breweries_merged, distance_column="distance"):
+        """
+        Builds the sketches in one pass over reviews with a distance column (see attach_distances),
+        reviews without distance, month or user state are ignored
+        """
+        distances = ratings_breweries_merged[distance_column].to_numpy(dtype=np.float64)
+        months = time_bucket(ratings_breweries_merged, "month")
+        user_states = ratings_breweries_merged["user_state"]
+        # rows with a missing key would get no group
+        known = ~np.isnan(distances) & months.notna().to_numpy() & user_states.notna().to_numpy()
+        months = months.to_numpy()[known]
+        user_states = user_states.astype(object).to_numpy()[known]
+        distances = distances[known]
+
+        codes, keys = _group_codes(pd.DataFrame({"month": months.astype(np.int64), "user_state": user_states}))
+        counts = np.bincount(codes * N_BINS + distance_bins(distances), minlength=len(keys) * N_BINS)
+        sums = np.bincount(codes, weights=distances, minlength=len(keys))
+        return cls(keys, counts, sums)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def merge(self, other):
+        """
+        Returns the sketches of the reviews of both sketches
+        """
+        return DistanceSketches(pd.concat([self.keys, other.keys], ignore_index=True),
+                                np.concatenate([self.counts, other.counts]),
+                                np.concatenate([self.sums, other.sums])).group(["month", "user_state"])
+
+    def select(self, user_states=None, start_month=None, end_month=None):
+        """
+        Keeps the sketches of some user states and months (anything pd.Period accepts, both included)
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if user_states is not None:
+            keep &= self.keys["user_state"].isin(list(user_states)).to_numpy()
+        if start_month is not None:
+            keep &= self.keys["month"].to_numpy() >= to_ordinal(start_month, "month")
+        if end_month is not None:
+            keep &= self.keys["month"].to_numpy() <= to_ordinal(end_month, "month")
+        return DistanceSketches(self.keys[keep], self.counts[keep], self.sums[keep])
+
+    def group(self, by=None):
+        """
+        Merges the sketches of each group.
+
+        Args:
+            - by (str or list, optional): "month", "year", "user_state" or a list of them. Defaults to None (all reviews).
+
+        Returns:
+            DistanceSketches: keys are the columns of by
+        """
+        by = [] if by is None else [by] if isinstance(by, str) else list(by)
+        keys = pd.DataFrame({column: (1970 + self.keys["month"] // 12) if column == "year" else self.keys[column]
+                             for column in by})
+        if by:
+            codes, uniques = _group_codes(keys)
+        else:
+            codes, uniques = np.zeros(len(self), dtype=np.int64), pd.DataFrame(index=range(1 if len(self) else 0))
+        counts = np.zeros((len(uniques), N_BINS), dtype=np.int64)
+        np.add.at(counts, codes, self.counts)
+        sums = np.bincount(codes, weights=self.sums, minlength=len(uniques))
+        return DistanceSketches(uniques, counts, sums)
+
+    def _index(self):
+        columns = list(self.keys.columns)
+        keys = self.keys.copy()
+        if "month" in columns:
+            keys["month"] = to_periods(keys["month"])
+        if not columns:
+            return None
+        if len(columns) == 1:
+            return pd.Index(keys[columns[0]])
+        return pd.MultiIndex.from_frame(keys)
+
+    def _series(self, values, name, by):
+        grouped = self.group(by)
+        values = values(grouped)
+        index = grouped._index()
+        if index is None:
+            return float(values[0]) if len(values) else np.nan
+        return pd.Series(values, index=index, name=name)
+
+    def count(self, by=None):
+        """
+        Number of reviews of each group, by as in group (a number if by is None)
+        """
+        return self._series(lambda sketches: sketches.counts.sum(axis=1), "count", by)
+
+    def mean(self, by=None):
+        """
+        Exact average distance of each group (see group), a float if by is None
+        """
+        return self._series(lambda sketches: sketches.sums / np.maximum(sketches.counts.sum(axis=1), 1), "mean", by)
+
+    def quantile(self, q, by=None):
+        """
+        Approximate q-quantile of the distances of each group (about 5% relative error), nan for empty groups
+        """
+        def quantiles(sketches):
+            cumulative = np.cumsum(sketches.counts, axis=1)
+            target = q * cumulative[:, -1]
+            # first bin whose cumulative count reaches the target
+            bins = np.minimum((cumulative < target[:, None]).sum(axis=1), N_BINS - 1)
+            rows = np.arange(len(bins))
+            before = cumulative[rows, bins] - sketches.counts[rows, bins]
+            fractions = np.clip((target - before) / np.maximum(sketches.counts[rows, bins], 1), 0, 1)
+            return np.where(cumulative[:, -1] > 0, _interpolate(bins, fractions), np.nan)
+
+        return self._series(quantiles, f"quantile_{q}", by)
+
+    def median(self, by=None):
+        median = self.quantile(0.5, by)
+        return median.rename("median") if isinstance(median, pd.Series) else median
+
+    def trimmed_mean(self, proportion=0.1, by=None):
+        """
+        Approximate average distance of each group without the proportion smallest and largest distances
+        """
+        def trimmed_means(sketches):
+            cumulative = np.cumsum(sketches.counts, axis=1)
+            before = cumulative - sketches.counts
+            total = cumulative[:, -1:]
+            # part of each bin between the two cuts
+            kept = np.clip(np.minimum(cumulative, (1 - proportion) * total) - np.maximum(before, proportion * total), 0, None)
+            return np.where(kept.sum(axis=1) > 0, (kept * BIN_CENTERS).sum(axis=1) / np.maximum(kept.sum(axis=1), 1e-12), np.nan)
+
+        return self._series(trimmed_means, "trimmed_mean", by)
+
+    def save(self, path):
+        np.savez_compressed(path, months=self.keys["month"].to_numpy(dtype=np.int64),
+                            user_states=self.keys["user_state"].to_numpy(dtype=str), counts=self.counts, sums=self.sums)
+
+
+def load_distance_sketches(path):
+    """
+    Loads sketches saved with DistanceSketches.save, or returns None if there is no file
+    """
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        keys = pd.DataFrame({"month": data["months"], "user_state": data["user_states"].astype(object)})
+        return DistanceSketches(keys, data["counts"], data["sums"])
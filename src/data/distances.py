@@ -1,10 +1,12 @@
-from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
+import os
+import warnings
+import numpy as np
 import pandas as pd
 import ast
-
-
-geolocator = Nominatim(user_agent="FanDeMondADA")
+from src.data.columnar import load_table
+from src.data.datasets import BEER_ADVOCATE, RATE_BEER
+from src.data.gazetteer import load_gazetteer
 
 
 def compute_distance(first_place, second_place):
@@ -17,48 +19,46 @@ def compute_distance(first_place, second_place):
     return distance 
 
 
-def get_raw_locations():
+def get_raw_locations(clean_folder_path="data/clean"):
     """ Get all dataframes containing useful locations
+    Input:
+        - clean_folder_path: the path of the foler where all clean files are
     Output:
         - list_df_with_locations: list of dataframes containing all possible useful locations 
     """
-    ba_usa_users = pd.read_csv("data/clean/BeerAdvocate/usa_users.csv")
-    rb_usa_users = pd.read_csv("data/clean/Ratebeer/usa_users.csv")
-    ba_breweries = pd.read_csv("data/clean/BeerAdvocate/breweries.csv")
-    rb_breweries = pd.read_csv("data/clean/Ratebeer/breweries.csv")
+    ba_usa_users = load_table(os.path.join(clean_folder_path, BEER_ADVOCATE, "usa_users"), columns=["location"], schema="users")
+    rb_usa_users = load_table(os.path.join(clean_folder_path, RATE_BEER, "usa_users"), columns=["location"], schema="users")
+    ba_breweries = load_table(os.path.join(clean_folder_path, BEER_ADVOCATE, "breweries"), columns=["location"], schema="breweries")
+    rb_breweries = load_table(os.path.join(clean_folder_path, RATE_BEER, "breweries"), columns=["location"], schema="breweries")
 
     list_df_with_locations = [ba_usa_users, rb_usa_users, ba_breweries, rb_breweries]
     return list_df_with_locations
 
 
-def get_locations_coordinates(list_df_with_locations):
-    """ Get the location's coordinates for all relevant locations
+def get_locations_coordinates(list_df_with_locations, gazetteer=None, geocoder=None):
+    """ Get the location's coordinates for all relevant locations from the offline gazetteer (no network access)
     Input:
         - list_df_with_locations: list of dataframes containing all possible useful locations
+        - gazetteer: the Gazetteer to use, defaults to the bundled one
+        - geocoder: a Geocoder (see geocoding.py) used for the locations missing from the gazetteer, defaults to None (not used)
     Output:
-        - dict_coordinates: a dictionnary with key a locations and value its address and coordinates
+        - dict_coordinates: a dictionnary with key a locations and value its place (name, latitude and longitude)
     """
-    dict_coordinates = {}
-
-    # get the coordinates of all locations
-    for df in list_df_with_locations:
-        for index, column in df.iterrows():
-
-            if dict_coordinates.get(column["location"]) == None:
-                try: 
-                    dict_coordinates[column["location"]] = geolocator.geocode(column["location"])
-                except:
-                    print(column["location"])
+    gazetteer = gazetteer or load_gazetteer()
+    locations = pd.concat([df["location"].astype(object) for df in list_df_with_locations])
 
-    # to correct state of Washington interpreted as Washington DC
-    dict_coordinates["United States, Washington"] = geolocator.geocode("Seattle")
+    # get the coordinates of all locations, each distinct location is matched once
+    dict_coordinates = gazetteer.coordinates(locations)
+    missing = sorted(set(locations.dropna()) - set(dict_coordinates))
+    if missing and geocoder is not None:
+        dict_coordinates.update(geocoder.geocode(missing))
+        missing = [location for location in missing if location not in dict_coordinates]
+    if missing:
+        warnings.warn(f"No coordinates found for {len(missing)} locations: {missing[:10]}")
 
-    # Canada and UK sometimes statewise in raw files but sometimes handled as countries
-    dict_coordinates["Canada"] = geolocator.geocode("Canada")
-    dict_coordinates["United Kingdom"] = geolocator.geocode("United Kingdom")
-
-    # USA sometimes as a country
-    dict_coordinates["United States"] = geolocator.geocode("United States")
+    # Canada and UK sometimes statewise in raw files but sometimes handled as countries, USA sometimes as a country
+    for country in ["Canada", "United Kingdom", "United States"]:
+        dict_coordinates[country] = gazetteer.find(country, ["country"])
 
     # correct the template of the locations to match the ones of the other parts
     for key in list(dict_coordinates):
@@ -75,6 +75,126 @@ def get_locations_coordinates(list_df_with_locations):
     return dict_coordinates
 
 
+# mean Earth radius and WGS84 ellipsoid, in km
+EARTH_RADIUS = 6371.0088
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+
+DISTANCE_MATRIX_FILE = "distances.npz"
+
+
+def _central_angle(lat, lon):
+    """ Pairwise central angles (haversine) between points given in radians """
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat[:, None]) * np.cos(lat[None, :]) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+def great_circle_matrix(latitudes, longitudes):
+    """ Compute the great-circle distance between all pairs of points on a sphere (haversine formula)
+    Input:
+        - latitudes, longitudes: arrays of coordinates in degrees
+    Output:
+        - matrix: array of shape (n, n) with the distances in km
+    """
+    return EARTH_RADIUS * _central_angle(np.radians(latitudes), np.radians(longitudes))
+
+
+def ellipsoidal_matrix(latitudes, longitudes):
+    """ Compute the distance between all pairs of points on the WGS84 ellipsoid with Lambert's formula
+    (within about 300 m of geopy's geodesic)
+    Input:
+        - latitudes, longitudes: arrays of coordinates in degrees
+    Output:
+        - matrix: array of shape (n, n) with the distances in km
+    """
+    reduced_lat = np.arctan((1 - WGS84_F) * np.tan(np.radians(latitudes)))
+    sigma = _central_angle(reduced_lat, np.radians(longitudes))
+    p = (reduced_lat[:, None] + reduced_lat[None, :]) / 2
+    q = (reduced_lat[None, :] - reduced_lat[:, None]) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2 / np.cos(sigma / 2) ** 2
+        y = (sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2 / np.sin(sigma / 2) ** 2
+        matrix = WGS84_A * (sigma - WGS84_F / 2 * (x + y))
+    # the correction is 0/0 for identical points
+    return np.where(sigma > 0, matrix, 0.0)
+
+
+def distance_matrix(dict_coordinates, ellipsoidal=False):
+    """ Compute the distances between all pairs of locations in one vectorized pass
+    Input:
+        - dict_coordinates: a dictionnary with key a location and value its place (with latitude and longitude)
+        - ellipsoidal: if True use the WGS84 ellipsoid instead of a sphere
+    Output:
+        - locations: the locations, the code of a location is its position in this list
+        - matrix: float32 array of shape (n, n) with the distances in km
+    """
+    locations = list(dict_coordinates)
+    latitudes = np.array([dict_coordinates[location].latitude for location in locations], dtype=np.float64)
+    longitudes = np.array([dict_coordinates[location].longitude for location in locations], dtype=np.float64)
+    compute = ellipsoidal_matrix if ellipsoidal else great_circle_matrix
+    return locations, compute(latitudes, longitudes).astype(np.float32)
+
+
+class DistanceMatrix:
+    """ Distances between all pairs of locations: a square float32 matrix and the index of its locations,
+    the code of a location is its position in the index.
+    Input:
+        - locations: the locations (unique)
+        - matrix: array of shape (n, n) with the distances in km
+    """
+
+    def __init__(self, locations, matrix):
+        self.locations = pd.Index(locations)
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        # extra nan row and column so the code -1 of unknown locations gathers nan
+        self._padded = np.pad(self.matrix, ((0, 1), (0, 1)), constant_values=np.nan)
+
+    def codes(self, locations):
+        """ Codes of a column of locations, -1 for unknown locations (categorical columns are coded once per category) """
+        if isinstance(getattr(locations, "dtype", None), pd.CategoricalDtype):
+            category_codes = np.append(self.locations.get_indexer(locations.cat.categories), -1)
+            return category_codes[locations.cat.codes.to_numpy()]
+        return self.locations.get_indexer(locations)
+
+    def distances(self, first_locations, second_locations):
+        """ Distances between the locations of two columns, row by row (nan if a location is unknown) """
+        return self._padded[self.codes(first_locations), self.codes(second_locations)]
+
+    def __getitem__(self, location):
+        """ Distances from a location to every location as a series, so distances[first][second] works like a nested dict """
+        return pd.Series(self.matrix[self.locations.get_loc(location)], index=self.locations, name=location)
+
+    def __contains__(self, location):
+        return location in self.locations
+
+    def to_table(self):
+        """ The matrix as a dataframe indexed by location (same layout as convert_dict_to_table) """
+        return pd.DataFrame(self.matrix, index=self.locations, columns=self.locations)
+
+    def save(self, path):
+        np.savez_compressed(path, locations=np.array(self.locations, dtype=str), matrix=self.matrix)
+
+
+def load_distance_matrix(path):
+    """ Load a DistanceMatrix saved in a .npz file """
+    with np.load(path) as data:
+        return DistanceMatrix(data["locations"].tolist(), data["matrix"])
+
+
+def attach_distances(ratings_breweries_merged, distances, user_column="user_state", brewery_column="brewery_state"):
+    """ Add the distance between the user and the brewery of every review with a single gather in the distance matrix
+    Input:
+        - ratings_breweries_merged: dataframe with the user_state and brewery_state columns
+        - distances: the DistanceMatrix (see load_distances)
+    Output:
+        - the dataframe with a float32 distance column (nan when a location has no coordinates)
+    """
+    return ratings_breweries_merged.assign(
+        distance=distances.distances(ratings_breweries_merged[user_column], ratings_breweries_merged[brewery_column]))
+
+
 def get_distances(dict_coordinates, statewise_dict):
     """ Compute all distances between locations' pairs in the input dict
     Input:
@@ -83,62 +203,58 @@ def get_distances(dict_coordinates, statewise_dict):
     Output:
         - dict_distances: a dict with key a pair of locations and value the distance between them
     """
-    dict_distances = {}
+    locations, matrix = distance_matrix(dict_coordinates, ellipsoidal=True)
+    codes = pd.Index(locations)
+
+    # distinct pairs of all dataframes
+    pairs = pd.concat([df[["user_state", "brewery_state"]].astype(object) for df in statewise_dict.values()]).drop_duplicates()
+    user_codes = codes.get_indexer(pairs["user_state"])
+    brewery_codes = codes.get_indexer(pairs["brewery_state"])
+    found = (user_codes >= 0) & (brewery_codes >= 0)
+    if not found.all():
+        missing = set(pairs["user_state"][user_codes < 0]) | set(pairs["brewery_state"][brewery_codes < 0])
+        warnings.warn(f"No coordinates for {sorted(map(str, missing))}, their distances are left out")
 
-    for key in statewise_dict.keys():
-        for index, column in statewise_dict[key].iterrows():
-
-            if dict_distances.get((column["user_state"], column["brewery_state"])) == None:
-                try:
-                    distance = compute_distance(dict_coordinates[column["user_state"]], dict_coordinates[column["brewery_state"]])
-                    dict_distances[column["user_state"], column["brewery_state"]] = distance
-                    dict_distances[column["brewery_state"], column["user_state"]] = distance
-                except:
-                    print(column["user_state"])
-                    print(column["brewery_state"])
-                    print(index)
+    dict_distances = {}
+    distances = matrix[user_codes[found], brewery_codes[found]].astype(float).tolist()
+    for user_state, brewery_state, distance in zip(pairs["user_state"][found], pairs["brewery_state"][found], distances):
+        dict_distances[user_state, brewery_state] = distance
+        dict_distances[brewery_state, user_state] = distance
     
     return dict_distances
 
 
-def compute_distances(statewise_dict):
-    """ Generate a .csv with all distances between locations' pairs in the input dict
+def compute_distances(clean_folder_path="data/clean"):
+    """ Generate distances.npz with the distances between all pairs of locations of the users and breweries
     Input:
-        - statewise_dict: a dictionnary of dataframes
+        - clean_folder_path: the path of the foler where all clean files are
     """
-    list_df_with_locations = get_raw_locations()
+    list_df_with_locations = get_raw_locations(clean_folder_path)
     dict_coordinates = get_locations_coordinates(list_df_with_locations)
-    dict_distances = get_distances(dict_coordinates, statewise_dict)
-
-    df_distance = pd.DataFrame()
-    df_distance = df_distance.from_dict(dict_distances, orient="index")
-    df_distance = df_distance.rename(columns={0: "distance"})
-    df_distance = df_distance.reset_index()
-
-    with open("data/clean/distances.csv", "w") as f:
-        df_distance.to_csv(f, index=False)
+    DistanceMatrix(*distance_matrix(dict_coordinates, ellipsoidal=True)).save(os.path.join(clean_folder_path, DISTANCE_MATRIX_FILE))
 
 
 def load_distances(clean_folder_path):
-    """ Load the distances from a .csv file into a dict
+    """ Load the distances saved by compute_distances
     Input:
         - clean_folder_path: the path of the foler where all clean files are
     Output:
-        - dict_distances: a dict with key a pair of locations and value the distance between them
+        - distances: a DistanceMatrix, distances[first][second] is the distance between two locations
+          (see attach_distances to add the distance to the reviews)
     """
-    df_distance = pd.read_csv(clean_folder_path + "/distances.csv")
-    df_distance = df_distance.set_index("index")
-    dict_distances = df_distance.to_dict("index")
+    return load_distance_matrix(os.path.join(clean_folder_path, DISTANCE_MATRIX_FILE))
 
-    return dict_distances
 
 def convert_dict_to_table(dict):
     """ Convert the distance dictionnary to a table
     Input:
-        - dict: a dict with key a pair of locations and value the distance between them
+        - dict: a DistanceMatrix, or a dict with key a pair of locations and value the distance between them
+          (as loaded from the former distances.csv)
     Output:
         - distance_table: a table containing distance between locations
     """
+    if isinstance(dict, DistanceMatrix):
+        return dict.to_table()
 
     # use ast to interpret the weird string as a tuple
     new_data = [(*ast.literal_eval(k), v['distance']) for k, v in dict.items()]
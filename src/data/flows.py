@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from src.data.gazetteer import load_gazetteer
+from src.data.locations import canonical_location
+from src.data.state_counts import encode_states
+from src.data.time_buckets import filter_time_range, time_bucket, to_periods
+
+# Review flows from the user states (rows) to every brewery location (columns): the states first, then every other
+# location on its own (countries, Canadian provinces, UK countries, ...) instead of a single World column.
+# Most of these columns are empty for a given state and month, so the counts are stored in a sparse matrix.
+
+
+class FlowMatrix:
+    """
+    Sparse matrix of the number (or ratio) of reviews from each user state to each brewery location.
+
+    Args:
+        - index (pd.Index): the rows, user_state or (date, user_state) for monthly flows
+        - states (list): the states, they are the first columns in sorted order
+        - locations (list): all the columns, the states then the other locations
+        - matrix (scipy.sparse matrix): the counts, shape (len(index), len(locations))
+    """
+
+    def __init__(self, index, states, locations, matrix):
+        self.index = index
+        self.states = sorted(states)
+        self.locations = pd.Index(locations, name="brewery_state")
+        self.matrix = sp.csr_matrix(matrix)
+
+    def __repr__(self):
+        return f"FlowMatrix({len(self.index)} rows, {len(self.locations)} locations, {self.matrix.nnz} non zero)"
+
+    def _user_states(self):
+        return self.index.get_level_values("user_state") if isinstance(self.index, pd.MultiIndex) else self.index
+
+    def _with(self, matrix):
+        return FlowMatrix(self.index, self.states, self.locations, matrix)
+
+    def as_ratio(self):
+        """
+        Rows normalized to sum to 1 (empty rows stay 0)
+        """
+        row_sums = np.asarray(self.matrix.sum(axis=1)).ravel()
+        scale = np.divide(1.0, row_sums, out=np.zeros(len(row_sums)), where=row_sums > 0)
+        return self._with(sp.diags(scale) @ self.matrix)
+
+    def cumulative(self):
+        """
+        For monthly flows, the total number of reviews of each user state up to each month
+        """
+        months = self.index.get_level_values("date")
+        n_months, n_states = months.nunique(), len(self.states)
+        # rows are ordered by month then state, the sum over the previous months is a block lower triangular product
+        prefix = sp.kron(sp.csr_matrix(np.tril(np.ones((n_months, n_months), dtype=np.int64))),
+                         sp.identity(n_states, dtype=np.int64, format="csr"))
+        return self._with(prefix @ self.matrix)
+
+    def summary(self, as_ratio=False):
+        """
+        Same columns as get_counts_for_state_matrix for every row: reviews of breweries of the user state (local_count),
+        of the other states (national_count) and of the other locations (foreign_count)
+        """
+        n_states = len(self.states)
+        local_columns = pd.Index(self.states).get_indexer(self._user_states())
+        local_count = np.asarray(self.matrix[np.arange(len(self.index)), local_columns]).ravel()
+        state_count = np.asarray(self.matrix[:, :n_states].sum(axis=1)).ravel()
+        foreign_count = np.asarray(self.matrix[:, n_states:].sum(axis=1)).ravel()
+        counts = pd.DataFrame({
+            'local_count': local_count,
+            'national_count': state_count - local_count,
+            'foreign_count': foreign_count
+        }, index=self.index)
+        if as_ratio:
+            counts = counts.div(counts.sum(axis=1), axis=0).fillna(0)
+        return counts
+
+    def totals_by_date(self, as_ratio=True):
+        """
+        For monthly flows, the local, national and foreign counts of all the states per month (as get_monthly_counts_usa)
+        """
+        counts = self.summary().groupby(level="date").sum()
+        if as_ratio:
+            return counts.div(counts.sum(axis=1), axis=0).fillna(0)
+        return counts
+
+    def foreign_by_country(self, gazetteer=None):
+        """
+        The flows to the locations outside the states summed per country: the subdivisions and cities found in the
+        gazetteer (Canadian provinces, UK countries, ...) are summed into the country of their place
+        """
+        gazetteer = gazetteer or load_gazetteer()
+        foreign = self.locations[len(self.states):]
+        country_codes, countries = pd.factorize(pd.Series([_country(location, gazetteer) for location in foreign],
+                                                          dtype=object), sort=True)
+        grouping = sp.csr_matrix((np.ones(len(foreign)), (np.arange(len(foreign)), country_codes)),
+                                 shape=(len(foreign), len(countries)))
+        return FlowMatrix(self.index, [], list(countries), self.matrix[:, len(self.states):] @ grouping)
+
+    def to_frame(self, world=False):
+        """
+        Dense dataframe of the flows, for display. If world, the locations outside the states are summed into
+        a World column, as get_state_adjacency_matrix with drop_world=False
+        """
+        n_states = len(self.states)
+        if world:
+            values = np.column_stack([self.matrix[:, :n_states].toarray(), np.asarray(self.matrix[:, n_states:].sum(axis=1))])
+            columns = pd.Index(list(self.locations[:n_states]) + ["World"], name="brewery_state")
+            return pd.DataFrame(values, index=self.index, columns=columns)
+        return pd.DataFrame(self.matrix.toarray(), index=self.index, columns=self.locations)
+
+
+def _country(location, gazetteer):
+    place = gazetteer.locate(location)
+    if place is not None and place.kind != "country":
+        return place.country
+    return canonical_location(location)["country"]
+
+
+def _flow_columns(brewery_locations, states):
+    """
+    Codes of the brewery locations in the columns of the flows (-1 for missing locations) and the columns
+    """
+    states = sorted(states)
+    if isinstance(getattr(brewery_locations, "dtype", None), pd.CategoricalDtype):
+        codes, uniques = brewery_locations.cat.codes.to_numpy(), brewery_locations.cat.categories
+    else:
+        codes, uniques = pd.factorize(pd.Series(brewery_locations, dtype=object))
+    # only the locations with reviews become columns (categories may be unused)
+    present = uniques[np.unique(codes[codes >= 0])]
+    locations = pd.Index(states + sorted(set(present) - set(states)))
+    unique_codes = np.append(locations.get_indexer(uniques), -1)
+    return unique_codes[codes], locations
+
+
+def flow_matrix(ratings_breweries_merged, states, as_ratio=False):
+    """
+    Sparse counts of reviews from each state (rows) to each brewery location (columns), the states then every other location.
+
+    Args:
+        - ratings_breweries_merged (pd.DataFrame): DataFrame containing merged ratings and breweries data.
+        - states (list): List of state names, the rows and first columns of the matrix.
+        - as_ratio (bool, optional): If True, converts counts to ratios. Defaults to False.
+
+    Returns:
+        FlowMatrix: indexed by user_state
+    """
+    columns, locations = _flow_columns(ratings_breweries_merged["brewery_state"], states)
+    rows = encode_states(ratings_breweries_merged["user_state"], states)
+    keep = (rows >= 0) & (rows < len(states)) & (columns >= 0)
+    # duplicated (row, column) pairs are summed when converting to csr
+    counts = sp.coo_matrix((np.ones(keep.sum(), dtype=np.int64), (rows[keep], columns[keep])),
+                           shape=(len(states), len(locations)))
+    flows = FlowMatrix(pd.Index(sorted(states), name="user_state"), states, locations, counts)
+    return flows.as_ratio() if as_ratio else flows
+
+
+def monthly_flow_matrix(ratings_breweries_merged, states, start_month=None, end_month=None, cumulative=False):
+    """
+    Sparse counts of reviews from each state to each brewery location per month, one row per (date, user_state)
+    like get_state_matrix_per_month but with every location as a column.
+
+    Args:
+        - ratings_breweries_merged (pd.DataFrame): DataFrame containing merged ratings and breweries data.
+        - states (list): List of state names.
+        - start_month, end_month (optional): first and last months kept, as in get_monthly_counts_usa. Defaults to None.
+        - cumulative (bool, optional): If True, the counts are the totals up to each month. Defaults to False.
+
+    Returns:
+        FlowMatrix: indexed by date and user_state
+    """
+    ratings_breweries_merged = filter_time_range(ratings_breweries_merged, start_month or None, end_month or None, bucket="month")
+    month_codes, months = pd.factorize(time_bucket(ratings_breweries_merged, "month").to_numpy(), sort=True)
+    columns, locations = _flow_columns(ratings_breweries_merged["brewery_state"], states)
+    users = encode_states(ratings_breweries_merged["user_state"], states)
+    keep = (users >= 0) & (users < len(states)) & (columns >= 0)
+    rows = month_codes[keep] * len(states) + users[keep]
+    counts = sp.coo_matrix((np.ones(keep.sum(), dtype=np.int64), (rows, columns[keep])),
+                           shape=(len(months) * len(states), len(locations)))
+    index = pd.MultiIndex.from_product([to_periods(months), sorted(states)], names=["date", "user_state"])
+    flows = FlowMatrix(index, states, locations, counts)
+    return flows.cumulative() if cumulative else flows
@@ -0,0 +1,113 @@
+import difflib
+import os
+import re
+import unicodedata
+from collections import namedtuple
+from functools import lru_cache
+import pandas as pd
+from src.data.locations import canonical_location
+
+# bundled table of US states, Canadian provinces, UK countries, countries and major cities with their centroid
+GAZETTEER_FILE = os.path.join(os.path.dirname(__file__), "gazetteer.csv")
+
+# minimum similarity (difflib ratio) for a misspelled name to match a place
+FUZZY_CUTOFF = 0.85
+
+# has latitude and longitude like the geopy locations it replaces, region is the state, province or UK country of a city
+Place = namedtuple("Place", ["name", "kind", "country", "latitude", "longitude", "region"], defaults=(None,))
+
+# kinds of places searched for the subdivision of a location of each country, and for a location without country
+SUBDIVISION_KINDS = {
+    "United States": ["us_state", "city"],
+    "Canada": ["ca_province", "city"],
+    "United Kingdom": ["uk_country", "city"],
+}
+ANY_KIND = ["country", "us_state", "ca_province", "uk_country", "city"]
+
+
+def normalize_name(name):
+    """
+    Lowercase name without accents, punctuation and repeated spaces, e.g. "Côte d'Ivoire" -> "cote d ivoire"
+    """
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    name = name.lower().replace("&", " and ")
+    name = re.sub(r"[^a-z0-9]+", " ", name)
+    return name.strip()
+
+
+class Gazetteer:
+    """
+    Offline geocoder: matches location strings to the places of a gazetteer table by name or alias,
+    and by fuzzy matching (difflib) for misspellings.
+
+    Args:
+        - places (pd.DataFrame): table with the columns name, kind, country, latitude, longitude, aliases ("|" separated)
+                                 and optionally region (empty for places that are not in a subdivision)
+    """
+
+    def __init__(self, places):
+        self._names = {}
+        for row in places.itertuples(index=False):
+            region = getattr(row, "region", None) or None
+            place = Place(row.name, row.kind, row.country, float(row.latitude), float(row.longitude), region)
+            aliases = row.aliases.split("|") if isinstance(row.aliases, str) and row.aliases else []
+            for name in [row.name] + aliases:
+                self._names.setdefault(row.kind, {}).setdefault(normalize_name(name), place)
+        self._cache = {}
+
+    def find(self, name, kinds=ANY_KIND):
+        """
+        Returns the place with the given name or alias, looking in kinds in order, or None.
+        If no name matches exactly, the closest name of the first kind with a close enough name is used.
+        """
+        key = normalize_name(name)
+        for kind in kinds:
+            place = self._names.get(kind, {}).get(key)
+            if place is not None:
+                return place
+        for kind in kinds:
+            names = self._names.get(kind, {})
+            matches = difflib.get_close_matches(key, names.keys(), n=1, cutoff=FUZZY_CUTOFF)
+            if matches:
+                return names[matches[0]]
+        return None
+
+    def locate(self, location):
+        """
+        Returns the place of a raw location string of the datasets ("United States, Washington", "Canada, Ontario",
+        "England", "Germany<a href=...>", ...), or None if no place matches.
+        """
+        if location not in self._cache:
+            self._cache[location] = self._locate(location)
+        return self._cache[location]
+
+    def _locate(self, location):
+        record = canonical_location(location)
+        clean = record["clean"]
+        # names containing a comma, e.g. "Korea, South"
+        place = self.find(clean, ["country"]) if ", " in clean else None
+        if place is not None:
+            return place
+        if ", " not in clean:
+            return self.find(clean)
+        country = record["country"]
+        place = self.find(record["state"], SUBDIVISION_KINDS.get(country, ["city"]))
+        if place is None:
+            # subdivisions of other countries are not in the gazetteer, the country is used
+            place = self.find(country, ["country"])
+        return place
+
+    def coordinates(self, locations):
+        """
+        Returns a dict location -> Place for the distinct locations of a column, unmatched locations are left out
+        """
+        places = {location: self.locate(location) for location in pd.unique(pd.Series(locations, dtype=object).dropna())}
+        return {location: place for location, place in places.items() if place is not None}
+
+
+@lru_cache(maxsize=None)
+def load_gazetteer(path=GAZETTEER_FILE):
+    """
+    Loads the gazetteer table (the bundled one by default), it is only read once per process
+    """
+    return Gazetteer(pd.read_csv(path, keep_default_na=False, encoding="utf-8"))
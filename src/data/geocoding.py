@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import urllib.parse
+import urllib.request
+import pandas as pd
+from src.data.gazetteer import Place
+from src.data.locations import canonical_location
+
+GEOCODING_CACHE_PATH = "data/cache/geocoding.sqlite"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+
+# status of the cached locations, failures are cached too so they are not queried again on every run
+FOUND = "found"
+NOT_FOUND = "not_found"
+ERROR = "error"
+
+
+def geocoding_query(location):
+    """
+    Query sent to the geocoder for a raw location string, e.g. "United States, Washington" -> "Washington, United States"
+    """
+    return ", ".join(reversed(canonical_location(location)["clean"].split(", ")))
+
+
+class NominatimBackend:
+    """
+    Geocoding backend for a Nominatim compatible search API (the public one by default, or a local server).
+    Any object with a geocode(query) method (sync or async) returning (name, latitude, longitude) or None can be used instead.
+
+    Args:
+        - base_url (str, optional): url of the search endpoint. Defaults to NOMINATIM_URL.
+        - user_agent (str, optional): sent with every request, as required by the Nominatim usage policy
+        - timeout (float, optional): timeout of a request in seconds. Defaults to 10.
+    """
+
+    def __init__(self, base_url=NOMINATIM_URL, user_agent="beer-reviews-geocoding", timeout=10):
+        self.base_url = base_url
+        self.user_agent = user_agent
+        self.timeout = timeout
+
+    def geocode(self, query):
+        params = urllib.parse.urlencode({"q": query, "format": "json", "limit": 1})
+        request = urllib.request.Request(f"{self.base_url}?{params}", headers={"User-Agent": self.user_agent})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            results = json.load(response)
+        if not results:
+            return None
+        return results[0].get("display_name", query), float(results[0]["lat"]), float(results[0]["lon"])
+
+
+class GeocodingCache:
+    """
+    SQLite table location -> geocoding result (found place, not found or error)
+    """
+
+    def __init__(self, path=GEOCODING_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        with sqlite3.connect(path) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS geocodes (location TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                               "name TEXT, latitude REAL, longitude REAL, error TEXT, updated REAL)")
+
+    def get(self, locations):
+        """
+        Returns a dict location -> (status, place or None) of the cached locations
+        """
+        locations = list(locations)
+        cached = {}
+        with sqlite3.connect(self.path) as connection:
+            # sqlite limits the number of parameters of a query
+            for start in range(0, len(locations), 500):
+                batch = locations[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT location, status, name, latitude, longitude FROM geocodes WHERE location IN ({','.join('?' * len(batch))})",
+                    batch)
+                for location, status, name, latitude, longitude in rows:
+                    place = Place(name, "geocoded", None, latitude, longitude) if status == FOUND else None
+                    cached[location] = (status, place)
+        return cached
+
+    def put(self, results):
+        """
+        Saves a dict location -> (status, place or None, error message or None)
+        """
+        now = time.time()
+        rows = [(location, status, *((place.name, place.latitude, place.longitude) if place else (None, None, None)), error, now)
+                for location, (status, place, error) in results.items()]
+        with sqlite3.connect(self.path) as connection:
+            connection.executemany("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+class _RateLimiter:
+    """
+    Spaces the starts of the requests by at least 1 / rate seconds
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        await asyncio.sleep(start - now)
+
+
+class Geocoder:
+    """
+    Geocodes the distinct locations of one or more columns through a backend, with at most concurrency requests
+    in flight and at most rate requests per second. Results, including locations that were not found and failed
+    requests, are stored in a SQLite cache so a rerun only reads the cache.
+
+    Args:
+        - backend (optional): object with a geocode(query) method, see NominatimBackend. Defaults to NominatimBackend().
+        - cache_path (str, optional): path of the SQLite cache. Defaults to GEOCODING_CACHE_PATH.
+        - concurrency (int, optional): maximum number of requests in flight. Defaults to 4.
+        - rate (float, optional): maximum number of requests per second, None for no limit. Defaults to 1 (Nominatim usage policy).
+        - retry_errors (bool, optional): query again the locations whose request failed (network error, ...).
+                                         Defaults to False, locations not found are never queried again.
+    """
+
+    def __init__(self, backend=None, cache_path=GEOCODING_CACHE_PATH, concurrency=4, rate=1, retry_errors=False):
+        self.backend = backend or NominatimBackend()
+        self.cache = GeocodingCache(cache_path)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.retry_errors = retry_errors
+
+    async def _geocode_one(self, location, semaphore, limiter):
+        async with semaphore:
+            await limiter.wait()
+            try:
+                if asyncio.iscoroutinefunction(self.backend.geocode):
+                    result = await self.backend.geocode(geocoding_query(location))
+                else:
+                    result = await asyncio.to_thread(self.backend.geocode, geocoding_query(location))
+                if result is None:
+                    outcome = (NOT_FOUND, None, None)
+                else:
+                    name, latitude, longitude = result
+                    outcome = (FOUND, Place(name, "geocoded", None, float(latitude), float(longitude)), None)
+            except Exception as e:
+                outcome = (ERROR, None, repr(e))
+        # cached right away, so a run that is interrupted or fails keeps the locations already geocoded
+        self.cache.put({location: outcome})
+        return location, outcome
+
+    async def geocode_async(self, locations):
+        """
+        Same as geocode, to be awaited when an event loop is already running (e.g. in a notebook)
+        """
+        locations = pd.unique(pd.Series(locations, dtype=object).dropna())
+        cached = self.cache.get(locations)
+        todo = [location for location in locations
+                if location not in cached or (self.retry_errors and cached[location][0] == ERROR)]
+
+        if todo:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            limiter = _RateLimiter(self.rate)
+            results = await asyncio.gather(*[self._geocode_one(location, semaphore, limiter) for location in todo],
+                                           return_exceptions=True)
+            failures = [result for result in results if isinstance(result, BaseException)]
+            if failures:
+                # the other locations are already cached, only the failed ones are queried again on the next run
+                raise failures[0]
+            cached.update({location: (status, place) for location, (status, place, _) in results})
+
+        return {location: place for location, (status, place) in cached.items() if status == FOUND}
+
+    def geocode(self, locations):
+        """
+        Returns a dict location -> Place for the distinct locations found by the backend (or in the cache),
+        locations that were not found are left out
+        """
+        return asyncio.run(self.geocode_async(locations))
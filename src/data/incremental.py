@@ -0,0 +1,250 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from src.data.datasets import BEER_ADVOCATE, MATCHED, RATE_BEER, raw_table_path
+from src.data.columnar import load_table, save_table, table_columns, table_exists
+from src.data.distance_sketches import SKETCHES_FILE, DistanceSketches, load_distance_sketches
+from src.data.distances import attach_distances
+from src.data.load_data import add_user_states, merge_ratings_breweries
+from src.data.state_counts import get_total_counts_from_monthly_data
+from src.data.time_buckets import time_bucket, to_ordinal, to_periods
+from src.data.wrangling import clean_new_users, clean_ratings, filter_by_users
+from src.utils.data_utils import factorize_together, merge_reviews, not_in_mask, pack_keys
+
+AGGREGATES_PATH = "data/clean/aggregates"
+HIGH_WATER_MARKS_FILE = "high_water_marks.json"
+
+# persisted aggregates, months are month ordinals (see time_buckets): counts of reviews per (month, user_state, brewery_state),
+# first review of each brewery, sum / count of the distances per (month, user_state) and their distance sketches
+MONTHLY_COUNTS = "monthly_state_counts"
+FIRST_REVIEWS = "breweries_first_review"
+MONTHLY_DISTANCES = "monthly_distances"
+# raw ratings at the high-water mark of each dataset, a rating at the mark is only ingested once
+LAST_RATINGS = "last_ratings"
+
+
+def load_high_water_marks(aggregates_path=AGGREGATES_PATH):
+    """
+    Returns the timestamp of the most recent raw rating already ingested for each dataset
+    """
+    marks_file = os.path.join(aggregates_path, HIGH_WATER_MARKS_FILE)
+    if not os.path.exists(marks_file):
+        return {}
+    with open(marks_file) as f:
+        return json.load(f)
+
+
+def load_last_ratings(dataset_name, aggregates_path=AGGREGATES_PATH):
+    """
+    Returns the (user_id, beer_id, date) of the raw ratings of a dataset at its high-water mark that were already
+    ingested, or None if there are none
+    """
+    path = os.path.join(aggregates_path, f"{LAST_RATINGS}_{dataset_name}")
+    return load_table(path) if table_exists(path) else None
+
+
+def save_high_water_marks(marks, aggregates_path=AGGREGATES_PATH, last_ratings=None):
+    """
+    Saves the high-water marks and, for each dataset of last_ratings, the ratings ingested at its mark (see clean_new_ratings)
+    """
+    os.makedirs(aggregates_path, exist_ok=True)
+    for dataset_name, ratings in (last_ratings or {}).items():
+        save_table(ratings, os.path.join(aggregates_path, f"{LAST_RATINGS}_{dataset_name}"))
+    with open(os.path.join(aggregates_path, HIGH_WATER_MARKS_FILE), "w") as f:
+        json.dump(marks, f)
+
+
+def drop_ingested(ratings, ingested):
+    """
+    Removes the ratings already ingested: they are all at the high-water mark, so only the ratings at that date
+    are compared with them on packed (user_id, beer_id) keys
+    """
+    if ingested is None or not len(ingested) or not len(ratings):
+        return ratings
+    at_mark = (ratings["date"] == ingested["date"].iloc[0]).to_numpy()
+    users, ingested_users, n_users = factorize_together(ratings["user_id"][at_mark], ingested["user_id"])
+    beers, ingested_beers, _ = factorize_together(ratings["beer_id"][at_mark], ingested["beer_id"])
+    keep = np.ones(len(ratings), dtype=bool)
+    keep[at_mark] = not_in_mask(pack_keys(beers, users, n_users), pack_keys(ingested_beers, ingested_users, n_users))
+    return ratings[keep]
+
+
+def clean_new_ratings(data_path, dataset_name, since=None, ingested=None):
+    """
+    Reads the raw ratings of a dataset from since on and cleans them like clean_ratings_table,
+    only the row groups of the raw table that can contain them are read. Ratings at since are read again (several
+    ratings can share a timestamp and some may have been added after the last run), the ones in ingested are dropped.
+    Only the users of the new ratings that are not in the US users table are cleaned (see clean_new_users).
+
+    Args:
+        - data_path (str): root folder of the datasets (see clean_data)
+        - dataset_name (str): e.g. "BeerAdvocate"
+        - since (int, optional): timestamp of the last ingested rating. Defaults to None (all ratings).
+        - ingested (pd.DataFrame, optional): user_id, beer_id and date of the raw ratings at since already ingested
+
+    Returns:
+        tuple: the cleaned US ratings with the user states (see add_user_states), the timestamp of the most recent
+               raw rating (None if there is none) and the user_id, beer_id and date of the raw ratings at that timestamp
+    """
+    ratings_path = raw_table_path(data_path, dataset_name, "ratings")
+    columns = [column for column in table_columns(ratings_path) if column not in ("text", "review")]
+    ratings = load_table(ratings_path, columns=columns, filters=None if since is None else [("date", ">=", since)])
+    ratings = drop_ingested(ratings, ingested).reset_index(drop=True)
+
+    last_date, last_ratings = since, ingested
+    if len(ratings):
+        last_date = int(ratings["date"].max())
+        last_ratings = ratings.loc[ratings["date"] == last_date, ["user_id", "beer_id", "date"]]
+        if last_date == since and ingested is not None:
+            last_ratings = pd.concat([ingested, last_ratings], ignore_index=True)
+
+    us_users = clean_new_users(data_path, dataset_name, ratings["user_id"])[["user_id", "location"]]
+    ratings = filter_by_users(ratings, us_users).dropna(subset=["user_id", "beer_id"])
+    ratings, _ = clean_ratings(ratings)
+    return add_user_states(ratings, us_users), last_date, last_ratings
+
+
+def _add_aggregate(aggregates_path, name, delta, keys, how="sum"):
+    """
+    Combines the aggregate of the new ratings with the persisted one and saves it
+    """
+    path = os.path.join(aggregates_path, name)
+    if table_exists(path):
+        delta = pd.concat([load_table(path), delta], ignore_index=True)
+    combined = delta.groupby(keys, as_index=False).agg(how)
+    save_table(combined, path)
+    return combined
+
+
+def update_aggregates(merged, aggregates_path=AGGREGATES_PATH, distances=None):
+    """
+    Adds new reviews (output of merge_ratings_breweries) to the persisted aggregates.
+
+    Args:
+        - merged (pd.DataFrame): the new reviews with date, user_state, brewery_state and brewery_id
+        - aggregates_path (str, optional): folder of the aggregates. Defaults to AGGREGATES_PATH.
+        - distances (DistanceMatrix, optional): distances between the locations, see load_distances.
+                                                Defaults to None (distances are not updated).
+    """
+    os.makedirs(aggregates_path, exist_ok=True)
+    reviews = pd.DataFrame({
+        "month": time_bucket(merged, "month").to_numpy(),
+        "user_state": merged["user_state"].astype(object),
+        "brewery_state": merged["brewery_state"].astype(object),
+        "brewery_id": merged["brewery_id"].to_numpy(),
+        "date": merged["date"].to_numpy(),
+    })
+
+    counts = reviews.groupby(["month", "user_state", "brewery_state"]).size().rename("count").reset_index()
+    _add_aggregate(aggregates_path, MONTHLY_COUNTS, counts, ["month", "user_state", "brewery_state"])
+
+    first_reviews = reviews.groupby("brewery_id", as_index=False)["date"].min().rename(columns={"date": "first_rev"})
+    _add_aggregate(aggregates_path, FIRST_REVIEWS, first_reviews, ["brewery_id"], how="min")
+
+    if distances is not None:
+        reviews = attach_distances(reviews, distances)
+        monthly_distances = reviews.groupby(["month", "user_state"]).agg(distance_sum=("distance", "sum"), count=("distance", "count")).reset_index()
+        _add_aggregate(aggregates_path, MONTHLY_DISTANCES, monthly_distances, ["month", "user_state"])
+
+        sketches = DistanceSketches.from_reviews(reviews)
+        stored = load_distance_sketches(os.path.join(aggregates_path, SKETCHES_FILE))
+        (sketches if stored is None else stored.merge(sketches)).save(os.path.join(aggregates_path, SKETCHES_FILE))
+
+
+def append_new_ratings(data_path, breweries, aggregates_path=AGGREGATES_PATH, datasets=(BEER_ADVOCATE, RATE_BEER),
+                       matched_dataset=MATCHED, distances=None):
+    """
+    Ingests the ratings newer than the stored high-water mark of each dataset and updates the persisted aggregates,
+    instead of cleaning and counting all the ratings again after a new scrape.
+    The first call (without high-water marks) ingests every rating and builds the aggregates.
+
+    Args:
+        - data_path (str): root folder of the datasets (see clean_data)
+        - breweries (pd.DataFrame): merged breweries (see merge_breweries)
+        - aggregates_path (str, optional): folder of the aggregates and high-water marks. Defaults to AGGREGATES_PATH.
+        - datasets (tuple, optional): the BeerAdvocate and RateBeer datasets, in this order
+        - matched_dataset (str, optional): dataset whose cleaned ratings are used to drop RateBeer reviews also in BeerAdvocate
+        - distances (DistanceMatrix, optional): see update_aggregates
+
+    Returns:
+        pd.DataFrame: the new reviews that were added (output of merge_ratings_breweries)
+    """
+    marks = load_high_water_marks(aggregates_path)
+    new_ratings, last_ratings = [], {}
+    for dataset_name in datasets:
+        ingested = load_last_ratings(dataset_name, aggregates_path) if dataset_name in marks else None
+        ratings, last_date, ratings_at_mark = clean_new_ratings(data_path, dataset_name, marks.get(dataset_name), ingested)
+        new_ratings.append(ratings)
+        if last_date is not None:
+            marks[dataset_name] = last_date
+            last_ratings[dataset_name] = ratings_at_mark
+
+    matched = load_table(os.path.join(data_path, matched_dataset, "usa_ratings"), columns=["rb_beer_id", "rb_user_id"])
+    merged = merge_ratings_breweries(merge_reviews(*new_ratings, matched), breweries)
+    update_aggregates(merged, aggregates_path, distances=distances)
+    # the marks are only moved once the aggregates are saved, so a failed update is ingested again
+    save_high_water_marks(marks, aggregates_path, last_ratings)
+    return merged
+
+
+def monthly_state_matrices(states, aggregates_path=AGGREGATES_PATH, cumulative=False):
+    """
+    Same table as get_state_matrix_per_month (indexed by date and user_state, one column per state and World),
+    read from the persisted monthly counts.
+    """
+    states = sorted(states)
+    counts = load_table(os.path.join(aggregates_path, MONTHLY_COUNTS))
+    counts["brewery_state"] = counts["brewery_state"].where(counts["brewery_state"].isin(states), "World")
+    matrices = counts.pivot_table(index=["month", "user_state"], columns="brewery_state", values="count",
+                                  aggfunc="sum", fill_value=0)
+    # every month has a row for each state, like get_state_adjacency_matrix
+    months = np.sort(counts["month"].unique())
+    index = pd.MultiIndex.from_product([months, states], names=["date", "user_state"])
+    matrices = matrices.reindex(index=index, columns=states + ["World"], fill_value=0)
+    matrices.index = matrices.index.set_levels(to_periods(months), level="date")
+    matrices.columns.name = "brewery_state"
+    if cumulative:
+        matrices = matrices.groupby(level="user_state").cumsum()
+    return matrices
+
+
+def get_monthly_counts_usa_incremental(states, aggregates_path=AGGREGATES_PATH, start_month=None, end_month=None,
+                                       cumulative=False, as_ratio=True):
+    """
+    Same output as get_monthly_counts_usa computed from the persisted monthly counts,
+    start_month and end_month are months (anything pd.Period accepts, e.g. "2010-01"), both included.
+    """
+    matrices = monthly_state_matrices(states, aggregates_path)
+    months = matrices.index.get_level_values("date").asi8
+    keep = np.ones(len(matrices), dtype=bool)
+    if start_month:
+        keep &= months >= to_ordinal(start_month, "month")
+    if end_month:
+        keep &= months <= to_ordinal(end_month, "month")
+    matrices = matrices[keep]
+    if cumulative:
+        matrices = matrices.groupby(level="user_state").cumsum()
+    return get_total_counts_from_monthly_data(matrices, as_ratio=as_ratio)
+
+
+def breweries_first_review(brew_df, aggregates_path=AGGREGATES_PATH):
+    """
+    Same output as breweries_first_date, read from the persisted first review dates
+    """
+    first_reviews = load_table(os.path.join(aggregates_path, FIRST_REVIEWS))
+    brew_df = brew_df.copy()
+    brew_df['first_rev'] = brew_df['brewery_id'].map(first_reviews.set_index('brewery_id')['first_rev'])
+    brew_df = brew_df.dropna(subset=['first_rev'])
+    brew_df['year_month'] = brew_df['first_rev'].dt.to_period('M')
+    return brew_df, (brew_df['year_month'].min(), brew_df['year_month'].max())
+
+
+def monthly_average_distance(aggregates_path=AGGREGATES_PATH):
+    """
+    Returns the average distance of the reviews of each user_state per month, indexed by month and user_state
+    """
+    distances = load_table(os.path.join(aggregates_path, MONTHLY_DISTANCES))
+    distances["distance"] = distances["distance_sum"] / distances["count"]
+    distances["month"] = to_periods(distances["month"])
+    return distances.set_index(["month", "user_state"])["distance"]
@@ -0,0 +1,96 @@
+import threading
+from collections.abc import MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class LazyTables(MutableMapping):
+    """
+    Dictionary of tables that are only loaded the first time they are accessed.
+    Tables can also be prefetched concurrently on a thread pool (pandas readers release the GIL while parsing).
+
+    Args:
+        - loaders (dict[str, callable]): for each table name, a function without arguments returning the table
+    """
+
+    def __init__(self, loaders=None):
+        self._loaders = dict(loaders or {})
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, loader):
+        """
+        Registers a table that will be loaded with loader() on first access
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._futures.pop(name, None)
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._loaders:
+                raise KeyError(name)
+            future = self._futures.get(name)
+            is_owner = future is None
+            if is_owner:
+                future = self._futures[name] = Future()
+        if is_owner:
+            try:
+                future.set_result(self._loaders[name]())
+            except BaseException as e:
+                # do not keep the failure so the next access retries
+                with self._lock:
+                    self._futures.pop(name, None)
+                future.set_exception(e)
+        return future.result()
+
+    def __setitem__(self, name, table):
+        future = Future()
+        future.set_result(table)
+        with self._lock:
+            self._loaders[name] = lambda: table
+            self._futures[name] = future
+
+    def __delitem__(self, name):
+        with self._lock:
+            del self._loaders[name]
+            self._futures.pop(name, None)
+
+    def __contains__(self, name):
+        # the default Mapping implementation would load the table
+        return name in self._loaders
+
+    def __iter__(self):
+        return iter(list(self._loaders))
+
+    def __len__(self):
+        return len(self._loaders)
+
+    def is_loaded(self, name):
+        future = self._futures.get(name)
+        return future is not None and future.done() and future.exception() is None
+
+    def prefetch(self, names=None, max_workers=None, wait=True):
+        """
+        Loads the given tables concurrently on a thread pool.
+
+        Args:
+            - names (list, optional): tables to load, names that are not in the mapping are ignored. Defaults to all tables.
+            - max_workers (int, optional): number of threads. Defaults to ThreadPoolExecutor's default.
+            - wait (bool, optional): if False, returns immediately and the tables keep loading in the background.
+                                     Accessing a table that is still loading waits for it. Defaults to True.
+
+        Returns:
+            LazyTables: self, to allow chaining
+        """
+        names = [name for name in (self._loaders if names is None else names) if name in self._loaders]
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        futures = [pool.submit(self.__getitem__, name) for name in names]
+        pool.shutdown(wait=wait)
+        if wait:
+            for future in futures:
+                future.result()
+        return self
+
+    def __repr__(self):
+        loaded = [name for name in self._loaders if self.is_loaded(name)]
+        return f"LazyTables({list(self._loaders)}, loaded={loaded})"
@@ -1,12 +1,16 @@
 import os
+import numpy as np
 import pandas as pd
 import tarfile
-import tqdm
-import csv
-import gzip
-import shutil
-from datetime import datetime
-from ..utils.data_utils import merge_reviews, merge_breweries
+from functools import partial
+from src.data.txt_reviews import txt_to_csv, txt_to_dataframe
+from src.data.columnar import csv_path, load_table
+from src.data.datasets import BEER_ADVOCATE, MATCHED, RATE_BEER
+from src.data.lazy_tables import LazyTables
+from src.data.schemas import apply_schema, schema_for_file
+from src.data.locations import LOCATIONS
+from src.data.time_buckets import add_time_buckets
+from ..utils.data_utils import dense_lookup, merge_reviews, merge_breweries
 
 def load_data(path, bool_load_txt = False):
     """
@@ -29,124 +33,125 @@ def load_data(path, bool_load_txt = False):
                     data[folder[:-7] + "_" + file.name] = pd.read_csv(f)
                 
                 if file.name.endswith(".txt.gz") and bool_load_txt:
-                    newpath = "temp/" 
-                    if not os.path.exists(newpath):
-                        os.makedirs(newpath)
-                    list_tar_files.extract(file, path=newpath)
-                    load_txt(newpath + "/" + file.name)
-                    data[folder[:-7] + "_" + file.name[:-7] + ".csv"] = pd.read_csv(newpath + "/" + file.name[:-7] + ".csv")
-            
-            if bool_load_txt:
-                shutil.rmtree(newpath)
+                    # decompressed and parsed straight from the archive, nothing is written to disk
+                    f = list_tar_files.extractfile(file)
+                    data[folder[:-7] + "_" + file.name[:-7] + ".csv"] = txt_to_dataframe(f)
     return data
 
 def load_txt(file_path):
     """
-    
+    Converts a ratings/reviews .txt.gz file to a .csv file next to it without holding all the reviews in memory.
     """
-    with gzip.open(file_path,'rb') as f:
-        reviews = []
-        review = {}
-        
-        for line in tqdm.tqdm(f):
-            line = str(line)
-           
-            if len(line.strip()) <= 5:
-                reviews.append(review)
-                review = {}
-            else:
-                field_name, field_value = line.split(':', 1)
-                review[field_name.strip()[2:]] = field_value.strip()[:-3]
-
-        file = csv.writer(open(file_path[:-7] + ".csv", 'w'))
-        file.writerow(reviews[0].keys())
-        for review in tqdm.tqdm(reviews):
-            file.writerow(review.values())
+    txt_to_csv(file_path, file_path[:-7] + ".csv")
 
-def load_data_from_csv(path):
+def load_data_from_csv(path, prefetch=None, max_workers=None):
     """
-    Load data from .csv files
-    Inputs: path to the data files
-    Outputs: dictionaries containing the dataframes BeerAdvocate, RateBeer and Matched
+    Load data from .parquet (or .csv) files, each table is only read the first time it is accessed
+    Inputs:
+        - path: path to the data files
+        - prefetch: optional list of table names (e.g. ["usa_ratings.csv", "breweries.csv"]) to load right away, concurrently
+        - max_workers: number of threads used for prefetching
+    Outputs: lazy dictionaries containing the dataframes BeerAdvocate, RateBeer and Matched, keyed by .csv file name
     """
-    data_ba = {}
-    data_rb = {}
-    data_matched = {}
+    data_ba = LazyTables()
+    data_rb = LazyTables()
+    data_matched = LazyTables()
     for folder in os.listdir(path):
-        if 'BeerAdvocate' in folder:
-            for file in os.listdir(path + folder):
-                if file.endswith(".csv"):
-                    data_ba[file] = pd.read_csv(path + folder + "/" + file)
-        if 'RateBeer' in folder:
-            for file in os.listdir(path + folder):
-                if file.endswith(".csv"):
-                    data_rb[file] = pd.read_csv(path + folder + "/" + file)
-        if 'Matched' in folder:
-            for file in os.listdir(path + folder):
-                if file.endswith(".csv"):
-                    data_matched[file] = pd.read_csv(path + folder + "/" + file)
-                    
+        if folder == BEER_ADVOCATE:
+            data = data_ba
+        elif folder == RATE_BEER:
+            data = data_rb
+        elif folder == MATCHED:
+            data = data_matched
+        else:
+            continue
+        for file in os.listdir(path + folder):
+            if file.endswith(".csv") or file.endswith(".parquet"):
+                name = csv_path(file)
+                if name not in data:
+                    data.add(name, partial(load_table, path + folder + "/" + file, schema=schema_for_file(name)))
+
+    if prefetch:
+        for data in (data_ba, data_rb, data_matched):
+            data.prefetch(prefetch, max_workers=max_workers)
     return data_ba, data_rb, data_matched
 
 def load_breweries(data_path):
-    breweries = pd.read_csv(os.path.join(data_path, "breweries.csv"))
-    if "Matched" not in data_path:
+    breweries = load_table(os.path.join(data_path, "breweries"), schema="breweries")
+    if os.path.basename(os.path.normpath(data_path)) != MATCHED:
         breweries = breweries[~breweries["location"].str.contains("<a href")]
-        breweries['location'] = breweries['location'].apply(lambda x: x.replace('United States, ', ''))
-        breweries['state'] = breweries['location'].apply(lambda x: x.split(', ')[-1])
-        breweries.loc[breweries['location'].str.contains('Canada, '), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Ontario'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Quebec'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Nova Scotia'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Manitoba'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('British Columbia'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Alberta'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('Newfoundland and Labrador'), 'location'] = 'Canada'
-        breweries.loc[breweries['location'].str.contains('United Kingdom, '), 'location'] = 'United Kingdom'
+        # "United States, " removed, Canadian provinces and UK countries collapsed, state is the last part of the location
+        codes = LOCATIONS.encode(breweries['location'])
+        breweries = breweries.assign(location=LOCATIONS.lookup(codes, 'location'), state=LOCATIONS.lookup(codes, 'state'))
         breweries = breweries.rename(columns={'id': 'brewery_id'})
-        if 'BeerAdvocate' in data_path:
-            breweries = breweries[~breweries['state'].str.contains("<a href")]
+        breweries = apply_schema(breweries, "breweries")
     return breweries
 
 def get_beer_merged(data_path):
-    usa_ratings = pd.read_csv(os.path.join(data_path, "usa_ratings.csv"))
-    usa_users = pd.read_csv(os.path.join(data_path, "usa_users.csv"))
+    usa_ratings = load_table(os.path.join(data_path, "usa_ratings"), schema="ratings")
+    usa_users = load_table(os.path.join(data_path, "usa_users"), columns=['user_id', 'location'], schema="users")
+    return add_user_states(usa_ratings, usa_users)
 
-    usa_ratings = usa_ratings.merge(usa_users[['user_id', 'location']], on='user_id', how='left')
-    usa_ratings['state'] = usa_ratings['location'].apply(lambda x: x.split(', ')[-1])
-    usa_ratings['date'] = usa_ratings['date'].apply(lambda timestamp: datetime.fromtimestamp(timestamp).date())
-    # datetime.fromtimestamp(timestamp) 
-    return usa_ratings
+def add_user_states(usa_ratings, usa_users):
+    """
+    Adds the location and state of the users to their ratings, converts the timestamps to dates and adds the
+    day / month / year ordinals used to filter and group by time (see time_buckets)
+    """
+    # the state is computed once per user instead of once per rating
+    usa_users = usa_users[['user_id', 'location']].copy()
+    usa_users['state'] = LOCATIONS.normalize(usa_users['location'], 'state')
+    usa_ratings = usa_ratings.merge(usa_users, on='user_id', how='left')
+    return add_time_buckets(usa_ratings)
 
 def get_states_from_df(df):
     """
     Get the unique state names from a df with the United States, prefix
     """
-    states = df[df["location"].str.contains("United States,")]["location"].map(lambda x: x.replace("United States, ", "")).unique()
+    codes = LOCATIONS.encode(df["location"])
+    us_codes = pd.unique(codes[LOCATIONS.is_us(codes)])
+    states = np.asarray(LOCATIONS.lookup(us_codes, 'location'))
     return states
 
 def merge_ratings_breweries(ratings_df, breweries_df):
     """
     Merge the ratings and breweries with new columns: brewery_state and user_state
+    The brewery state is looked up in a dense brewery_id -> state code array instead of a merge.
     """
-    merged_df = ratings_df.merge(breweries_df[['brewery_id', 'state']], on='brewery_id', how='left')
-    merged_df = merged_df.dropna(subset=['state_y'])
-    merged_df = merged_df.rename(columns={'state_x': 'user_state', 'state_y': 'brewery_state'})
+    brewery_ids = breweries_df['brewery_id']
+    if brewery_ids.isna().any() or (brewery_ids < 0).any() or brewery_ids.duplicated().any():
+        # a brewery id matching several breweries duplicates its ratings, only a real merge does that
+        merged_df = ratings_df.merge(breweries_df[['brewery_id', 'state']], on='brewery_id', how='left')
+        merged_df = merged_df.dropna(subset=['state_y'])
+        merged_df = merged_df.rename(columns={'state_x': 'user_state', 'state_y': 'brewery_state'})
+    else:
+        state_codes, states = pd.factorize(breweries_df['state'])
+        brewery_state = dense_lookup(brewery_ids.to_numpy(), state_codes, ratings_df['brewery_id'].to_numpy())
+        has_state = brewery_state >= 0
+        merged_df = ratings_df[has_state].rename(columns={'state': 'user_state'}).reset_index(drop=True)
+        merged_df['brewery_state'] = pd.Categorical.from_codes(brewery_state[has_state], categories=states)
     columns_to_keep = [col for col in merged_df.columns if 'nan' not in col]
     merged_df = merged_df[columns_to_keep]
-    merged_df = merged_df.drop(columns='_merge')
     return merged_df
 
-def load_all_usa_data():
-
-    ba_usa_ratings = get_beer_merged('data/clean/BeerAdvocate')
-    rb_usa_ratings = get_beer_merged('data/clean/RateBeer')
-    matched_usa_ratings = pd.read_csv("data/clean/MatchedBeerData/ratings.csv")
-    breweries_ba = load_breweries('data/clean/BeerAdvocate')
-    breweries_rb = load_breweries('data/clean/RateBeer')
-    breweries_matched = load_breweries('data/clean/MatchedBeerData')
+def load_all_usa_data(max_workers=None):
+    """
+    Loads and merges the usa ratings and the breweries of all datasets, the six input tables are read concurrently
+    Inputs:
+        - max_workers: number of threads used to read the tables
+    Outputs:
+        - usa_ratings: merged ratings of BeerAdvocate and RateBeer without the reviews appearing in both
+        - breweries: merged breweries
+    """
+    tables = LazyTables({
+        "ba_usa_ratings": partial(get_beer_merged, os.path.join('data/clean', BEER_ADVOCATE)),
+        "rb_usa_ratings": partial(get_beer_merged, os.path.join('data/clean', RATE_BEER)),
+        "matched_usa_ratings": partial(load_table, os.path.join('data/clean', MATCHED, "usa_ratings"), schema="ratings"),
+        "breweries_ba": partial(load_breweries, os.path.join('data/clean', BEER_ADVOCATE)),
+        "breweries_rb": partial(load_breweries, os.path.join('data/clean', RATE_BEER)),
+        "breweries_matched": partial(load_breweries, os.path.join('data/clean', MATCHED)),
+    }).prefetch(max_workers=max_workers)
 
-    usa_ratings = merge_reviews(ba_usa_ratings, rb_usa_ratings, matched_usa_ratings)
-    breweries = merge_breweries(breweries_ba, breweries_rb, breweries_matched)
+    usa_ratings = merge_reviews(tables["ba_usa_ratings"], tables["rb_usa_ratings"], tables["matched_usa_ratings"])
+    breweries = merge_breweries(tables["breweries_ba"], tables["breweries_rb"], tables["breweries_matched"])
 
-    return usa_ratings, breweries
\ No newline at end of file
+    return usa_ratings, breweries
@@ -1,15 +1,19 @@
 import os
 import pandas as pd
 import tarfile
-import tqdm
-import csv
-import gzip
 import shutil
 import datetime
+from functools import partial
+from src.data.txt_reviews import txt_to_csv
+from src.data.columnar import load_table, save_table, table_base_path, table_exists
+from src.data.datasets import BEER_ADVOCATE, DATASETS, MATCHED, RATE_BEER, dataset_folder
+from src.data.lazy_tables import LazyTables
+from src.data.schemas import schema_for_file
+from src.data import load_data
 
 def load(load_path, save_path, clean_load=False):
     """
-    Load Extracts tar.gz archives in the given folder and saves them as .csv files.
+    Load Extracts tar.gz archives in the given folder and saves them as .parquet files.
 
     Args:
         load_path (str): Path where the .tar.gz files are located.
@@ -17,15 +21,10 @@ def load(load_path, save_path, clean_load=False):
         clean_load (bool, optional): If True, overwrites existing files. Defaults to False.
 
     Returns:
-        dict[str, pd.DataFrame]: Dictionary with all the extracted dataframes.
+        LazyTables: Dictionary with all the extracted dataframes, tables already on disk are only read on first access.
     """
-    data = {}
-    subfolders = {
-        "BeerAdvocate": os.path.join(save_path, "BeerAdvocate"),
-        "RateBeer": os.path.join(save_path, "RateBeer"),
-        "MatchedBeerData": os.path.join(save_path, "MatchedBeerData"),
-        "Other": os.path.join(save_path, "Other")
-    }
+    data = LazyTables()
+    subfolders = {name: os.path.join(save_path, name) for name in DATASETS + ["Other"]}
     complete = not clean_load
     
     # Ensure subfolders exist
@@ -38,17 +37,17 @@ def load(load_path, save_path, clean_load=False):
                     os.unlink(file_path)
                 elif os.path.isdir(file_path):
                     shutil.rmtree(file_path)
-        elif "BeerAdvocate" in folder and len(os.listdir(folder)) < 5:
+        elif folder in (subfolders[BEER_ADVOCATE], subfolders[RATE_BEER]) and len(os.listdir(folder)) < 5:
             complete = False
-        elif "RateBeer" in folder and len(os.listdir(folder)) < 5:
-            complete = False
-        elif "matched_beer_data" in folder and len(os.listdir(folder)) < 9:
+        elif folder == subfolders[MATCHED] and len(os.listdir(folder)) < 9:
             complete = False
     
     if complete:
-        for file in subfolders.values():
-            if file.endswith('.csv') and not file.contains('usa'):
-                data[file.name[:-4]] = pd.read_csv(csv_path, low_memory=False)
+        for folder in subfolders.values():
+            for file in os.listdir(folder):
+                name = table_base_path(file)
+                if (file.endswith('.csv') or file.endswith('.parquet')) and 'usa' not in file and name not in data:
+                    data.add(name, partial(load_table, os.path.join(folder, file), schema=schema_for_file(name)))
         return data
 
     for folder in os.listdir(load_path):
@@ -57,69 +56,39 @@ def load(load_path, save_path, clean_load=False):
 
             for file in tar_files:
                 if file.name.endswith(".csv"):
-                    subfolder_path = (
-                        subfolders["BeerAdvocate"] if "BeerAdvocate" in folder
-                        else subfolders["RateBeer"] if "RateBeer" in folder
-                        else subfolders["MatchedBeerData"] if "matched_beer_data" in folder
-                        else subfolders["Other"]
-                    )
-                    csv_path = os.path.join(subfolder_path, folder[:-7] + '_' + file.name)
-
-                    if not os.path.exists(csv_path):
+                    subfolder_path = subfolders[dataset_folder(folder) or "Other"]
+                    table_path = os.path.join(subfolder_path, folder[:-7] + '_' + file.name)
+
+                    if not table_exists(table_path):
                         extracted_file = tar_files.extractfile(file)
                         df = pd.read_csv(extracted_file, low_memory=False)
                         data[file.name] = df
-                        df.to_csv(csv_path, index=False)
+                        save_table(df, table_path)
                     else:
-                        data[file.name] = pd.read_csv(csv_path, low_memory=False)
+                        data.add(file.name, partial(load_table, table_path))
 
 
                 elif file.name.endswith(".txt.gz"):
 
-                    subfolder_path = (
-                        subfolders["BeerAdvocate"] if "BeerAdvocate" in folder
-                        else subfolders["RateBeer"] if "RateBeer" in folder
-                        else subfolders["MatchedBeerData"] if "matched_beer_data" in folder
-                        else subfolders["Other"]
-                    )
+                    subfolder_path = subfolders[dataset_folder(folder) or "Other"]
 
                     csv_path = os.path.join(subfolder_path, folder[:-7] + '_' + file.name[:-7] + ".csv")
                 
 
-                    if not os.path.exists(csv_path):
-                        temp_dir = "temp"
-                        os.makedirs(temp_dir, exist_ok=True)
-                        tar_files.extract(file, path=temp_dir)
-                        load_txt(os.path.join(temp_dir, file.name), csv_path)
-                        shutil.rmtree(temp_dir)
+                    if not table_exists(csv_path):
+                        # decompressed and parsed straight from the archive, no temporary copy
+                        load_txt(tar_files.extractfile(file), csv_path)
                         
-                    data[file.name] = pd.read_csv(csv_path, low_memory=False)
+                    data.add(file.name, partial(load_table, csv_path))
                     
 
     return data
 
-def load_txt(file_path, csv_path):
+def load_txt(source, csv_path):
     """
-    
+    Converts a ratings/reviews .txt.gz file (path or binary file object) to a .csv file without holding all the reviews in memory.
     """
-    with gzip.open(file_path,'rb') as f:
-        reviews = []
-        review = {}
-        
-        for line in tqdm.tqdm(f):
-            line = str(line)
-           
-            if len(line.strip()) <= 5:
-                reviews.append(review)
-                review = {}
-            else:
-                field_name, field_value = line.split(':', 1)
-                review[field_name.strip()[2:]] = field_value.strip()[:-3]
-
-        file = csv.writer(open(csv_path, 'w'))
-        file.writerow(reviews[0].keys())
-        for review in tqdm.tqdm(reviews):
-            file.writerow(review.values())
+    txt_to_csv(source, csv_path)
     
 
 def load_icpsr(path):
@@ -251,41 +220,17 @@ def loadBEA(path, filename, income_name={}):
 
 
 def load_breweries():
-    breweries = pd.read_csv("data/clean/BeerAdvocate/breweries.csv")
-    breweries = breweries[~breweries["location"].str.contains("<a href")]
-    breweries['location'] = breweries['location'].apply(lambda x: x.replace('United States, ', ''))
-    breweries['state'] = breweries['location'].apply(lambda x: x.split(', ')[-1])
-    breweries.loc[breweries['location'].str.contains('Canada, '), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Ontario'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Quebec'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Nova Scotia'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Manitoba'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('British Columbia'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Alberta'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('Newfoundland and Labrador'), 'location'] = 'Canada'
-    breweries.loc[breweries['location'].str.contains('United Kingdom, '), 'location'] = 'United Kingdom'
-    breweries = breweries.rename(columns={'id': 'brewery_id'})
-    
-    
-    return breweries
+    return load_data.load_breweries("data/clean/BeerAdvocate")
 
 
 def get_ba_beer_merged():
-    ba_usa_ratings = pd.read_csv("data/clean/BeerAdvocate/usa_ratings.csv")
-    ba_usa_users = pd.read_csv("data/clean/BeerAdvocate/usa_users.csv")
-
-    ba_usa_ratings = ba_usa_ratings.merge(ba_usa_users[['user_id', 'location']], on='user_id', how='left')
-    ba_usa_ratings['state'] = ba_usa_ratings['location'].apply(lambda x: x.split(', ')[-1])
-    ba_usa_ratings['date'] = ba_usa_ratings['date'].apply(lambda timestamp: datetime.fromtimestamp(timestamp).date())
-    # datetime.fromtimestamp(timestamp) 
-    return ba_usa_ratings
+    return load_data.get_beer_merged("data/clean/BeerAdvocate")
 
 def get_states_from_df(df):
     """
     Get the unique state names from a df with the United States, prefix
     """
-    states = df[df["location"].str.contains("United States,")]["location"].map(lambda x: x.replace("United States, ", "")).unique()
-    return states
+    return load_data.get_states_from_df(df)
 
 def merge_ratings_breweries(ratings_df, breweries_df):
     """
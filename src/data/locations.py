@@ -0,0 +1,131 @@
+import threading
+import numpy as np
+import pandas as pd
+
+US_STATE_CODES = {
+    'Alabama': 'AL', 'Alaska': 'AK', 'Arizona': 'AZ', 'Arkansas': 'AR', 'California': 'CA',
+    'Colorado': 'CO', 'Connecticut': 'CT', 'Delaware': 'DE', 'District of Columbia': 'DC', 'Florida': 'FL',
+    'Georgia': 'GA', 'Hawaii': 'HI', 'Idaho': 'ID', 'Illinois': 'IL', 'Indiana': 'IN',
+    'Iowa': 'IA', 'Kansas': 'KS', 'Kentucky': 'KY', 'Louisiana': 'LA', 'Maine': 'ME',
+    'Maryland': 'MD', 'Massachusetts': 'MA', 'Michigan': 'MI', 'Minnesota': 'MN', 'Mississippi': 'MS',
+    'Missouri': 'MO', 'Montana': 'MT', 'Nebraska': 'NE', 'Nevada': 'NV', 'New Hampshire': 'NH',
+    'New Jersey': 'NJ', 'New Mexico': 'NM', 'New York': 'NY', 'North Carolina': 'NC', 'North Dakota': 'ND',
+    'Ohio': 'OH', 'Oklahoma': 'OK', 'Oregon': 'OR', 'Pennsylvania': 'PA', 'Rhode Island': 'RI',
+    'South Carolina': 'SC', 'South Dakota': 'SD', 'Tennessee': 'TN', 'Texas': 'TX', 'Utah': 'UT',
+    'Vermont': 'VT', 'Virginia': 'VA', 'Washington': 'WA', 'West Virginia': 'WV', 'Wisconsin': 'WI',
+    'Wyoming': 'WY',
+}
+
+CANADIAN_PROVINCE_CODES = {
+    'Alberta': 'AB', 'British Columbia': 'BC', 'Manitoba': 'MB', 'New Brunswick': 'NB',
+    'Newfoundland and Labrador': 'NL', 'Northwest Territories': 'NT', 'Nova Scotia': 'NS', 'Nunavut': 'NU',
+    'Ontario': 'ON', 'Prince Edward Island': 'PE', 'Quebec': 'QC', 'Saskatchewan': 'SK', 'Yukon': 'YT',
+}
+
+# countries whose subdivisions are collapsed into the country for the location column (as done for breweries)
+COLLAPSED_COUNTRIES = ['Canada', 'United Kingdom']
+
+LOCATION_FIELDS = ['raw', 'clean', 'location', 'country', 'state', 'is_us', 'code']
+
+
+def canonical_location(raw):
+    """
+    Computes the canonical record of a raw location string such as "United States, California",
+    "Canada, Ontario", "Germany" or "Germany<a href=...>".
+
+    Returns:
+        dict: with the fields
+            - raw: the raw string
+            - clean: the raw string without html link
+            - location: "United States, " removed and Canada / United Kingdom subdivisions collapsed to the country
+            - country: the country
+            - state: the last part of the location (US state, province, UK country or the country itself)
+            - is_us: True if the location is a state of the United States (not for a bare "United States" without state)
+            - code: USPS code of US states, postal code of Canadian provinces, None otherwise
+    """
+    clean = raw.split("<")[0].strip()
+    parts = clean.split(", ")
+    state = parts[-1]
+    country = parts[0]
+    if len(parts) == 1 and state in CANADIAN_PROVINCE_CODES:
+        country = 'Canada'
+
+    if country == 'United States':
+        location = clean[len('United States, '):] if len(parts) > 1 else clean
+        code = US_STATE_CODES.get(state)
+    elif country in COLLAPSED_COUNTRIES:
+        location = country
+        code = CANADIAN_PROVINCE_CODES.get(state) if country == 'Canada' else None
+    else:
+        location = clean
+        code = None
+
+    return {'raw': raw, 'clean': clean, 'location': location, 'country': country, 'state': state,
+            'is_us': country == 'United States' and len(parts) > 1, 'code': code}
+
+
+class LocationIndex:
+    """
+    Table of canonical location records shared by all loaders.
+    Each distinct raw location string gets an integer code once, so normalizing a column of millions of rows
+    is a single factorization plus array lookups instead of string operations on every row.
+    """
+
+    def __init__(self):
+        self._codes = {}
+        self._records = []
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def encode(self, locations):
+        """
+        Returns the integer codes of a column of raw location strings, nans get the code -1.
+        Unseen locations are added to the table.
+        """
+        value_codes, uniques = pd.factorize(locations)
+        with self._lock:
+            for raw in uniques:
+                if raw not in self._codes:
+                    self._codes[raw] = len(self._records)
+                    self._records.append(canonical_location(raw))
+                    self._columns = {}
+            unique_codes = np.array([self._codes[raw] for raw in uniques] + [-1], dtype=np.int32)
+        # nans have the value code -1, which takes the -1 appended at the end
+        return unique_codes.take(value_codes)
+
+    @property
+    def table(self):
+        """
+        The canonical records as a dataframe indexed by location code
+        """
+        return pd.DataFrame(self._records, columns=LOCATION_FIELDS)
+
+    def lookup(self, codes, field):
+        """
+        Returns the given field of the canonical records for an array of codes, as a categorical (nan for the code -1).
+        """
+        with self._lock:
+            if field not in self._columns:
+                self._columns[field] = pd.factorize(pd.Series([record[field] for record in self._records], dtype=object))
+            field_codes, field_values = self._columns[field]
+        field_codes = np.append(field_codes, -1)
+        return pd.Categorical.from_codes(field_codes.take(codes), categories=field_values)
+
+    def is_us(self, codes):
+        """
+        Returns a boolean mask of the codes that are states of the United States (False for the code -1 and for
+        locations that are only "United States", as they have no state)
+        """
+        with self._lock:
+            is_us = np.array([record['is_us'] for record in self._records] + [False], dtype=bool)
+        return is_us.take(codes)
+
+    def normalize(self, locations, field):
+        """
+        Maps a column of raw location strings to a field of their canonical records, keeping the index
+        """
+        return pd.Series(self.lookup(self.encode(locations), field), index=locations.index, name=locations.name)
+
+
+# the location index shared by all the loaders
+LOCATIONS = LocationIndex()
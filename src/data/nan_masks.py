@@ -0,0 +1,166 @@
+import os
+import numpy as np
+import pandas as pd
+from src.data.columnar import load_table, table_base_path
+
+MASK_EXTENSION = ".nan_mask.npz"
+
+
+def nan_mask_path(path):
+    """
+    Path of the nan mask stored next to a table (e.g. "usa_ratings.parquet" -> "usa_ratings.nan_mask.npz")
+    """
+    return table_base_path(path) + MASK_EXTENSION
+
+
+class NanMask:
+    """
+    Positions of the missing values of some columns of a table, stored as one bit per row and column
+    (np.packbits) instead of one int64 '<column>_nan' column per column.
+    Rows are in the same order as the rows of the saved table.
+
+    Args:
+        - columns (list[str]): the columns of the table described by the mask
+        - bits (np.ndarray): packed bits of shape (len(columns), ceil(length / 8)), row i of the table is bit i
+        - length (int): number of rows of the table
+    """
+
+    def __init__(self, columns, bits, length):
+        self.columns = list(columns)
+        self.bits = bits.reshape(len(self.columns), (int(length) + 7) // 8)
+        self.length = int(length)
+
+    @classmethod
+    def from_columns(cls, is_nan, length, keep_empty=False):
+        """
+        Packs a dict column -> boolean array of length rows, columns without nans are dropped unless keep_empty is True
+        """
+        columns = [column for column, values in is_nan.items() if keep_empty or values.any()]
+        block = np.array([np.asarray(is_nan[column], dtype=bool) for column in columns], dtype=bool).reshape(len(columns), length)
+        return cls(columns, np.packbits(block, axis=1), length)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, column):
+        """
+        Returns the boolean array of the rows where column is nan
+        """
+        i = self.columns.index(column)
+        return np.unpackbits(self.bits[i], count=self.length).astype(bool)
+
+    def counts(self):
+        """
+        Returns the number of nans of each column
+        """
+        return pd.Series({column: int(self[column].sum()) for column in self.columns}, dtype="int64")
+
+    def to_frame(self, columns=None, index=None, dtype=bool):
+        """
+        Expands the mask into '<column>_nan' indicator columns.
+
+        Args:
+            - columns (list, optional): columns to expand, columns without nans are ignored. Defaults to all columns.
+            - index (pd.Index, optional): index of the returned dataframe. Defaults to a RangeIndex.
+            - dtype (optional): type of the indicator columns, e.g. int for the old 0/1 columns. Defaults to bool.
+
+        Returns:
+            pd.DataFrame: one indicator column per expanded column
+        """
+        columns = self.columns if columns is None else [column for column in columns if column in self.columns]
+        rows = [self.columns.index(column) for column in columns]
+        values = np.unpackbits(self.bits[rows], axis=1, count=self.length).astype(dtype)
+        return pd.DataFrame(values.T, index=index, columns=[f"{column}_nan" for column in columns])
+
+    def save(self, path):
+        """
+        Saves the mask next to the table at path
+        """
+        np.savez_compressed(nan_mask_path(path), columns=np.array(self.columns, dtype=str), bits=self.bits,
+                            length=np.array(self.length))
+
+
+class NanMaskBuilder:
+    """
+    Builds the nan mask of a table written in chunks, only the packed bits (and fewer than 8 pending rows) are kept.
+    A column missing from a chunk has no nans in that chunk.
+    """
+
+    def __init__(self):
+        self.columns = []
+        self.length = 0
+        self._packed = []
+        self._pending = np.zeros((0, 0), dtype=bool)
+
+    def append(self, is_nan, length):
+        """
+        Adds the rows of a chunk, is_nan is a dict column -> boolean array of length rows
+        """
+        new_columns = [column for column in is_nan if column not in self.columns]
+        if new_columns:
+            # the rows of the previous chunks have no nans in the new columns
+            self._packed = [np.vstack([packed, np.zeros((len(new_columns), packed.shape[1]), dtype=np.uint8)])
+                            for packed in self._packed]
+            self._pending = np.vstack([self._pending, np.zeros((len(new_columns), self._pending.shape[1]), dtype=bool)])
+            self.columns += new_columns
+        no_nan = np.zeros(length, dtype=bool)
+        block = np.array([np.asarray(is_nan.get(column, no_nan), dtype=bool) for column in self.columns],
+                         dtype=bool).reshape(len(self.columns), length)
+        block = np.concatenate([self._pending, block], axis=1)
+        # only whole bytes are packed so the packed chunks can be concatenated
+        full = block.shape[1] - block.shape[1] % 8
+        self._packed.append(np.packbits(block[:, :full], axis=1))
+        self._pending = block[:, full:]
+        self.length += length
+
+    def finish(self, keep_empty=False):
+        """
+        Returns the NanMask of all the appended rows, columns without nans are dropped unless keep_empty is True
+        """
+        bits = np.concatenate(self._packed + [np.packbits(self._pending, axis=1)], axis=1)
+        mask = NanMask(self.columns, bits, self.length)
+        if keep_empty:
+            return mask
+        keep = [i for i in range(len(self.columns)) if bits[i].any()]
+        return NanMask([self.columns[i] for i in keep], bits[keep], self.length)
+
+
+def load_nan_mask(path):
+    """
+    Loads the nan mask saved next to the table at path, or returns None if the table has none
+    """
+    mask_file = nan_mask_path(path)
+    if not os.path.exists(mask_file):
+        return None
+    with np.load(mask_file) as data:
+        return NanMask(data["columns"].tolist(), data["bits"], data["length"])
+
+
+def add_nan_columns(df, mask, columns=None, dtype=bool):
+    """
+    Adds the '<column>_nan' indicator columns of a mask to the dataframe it was saved with (rows are matched by position).
+
+    Args:
+        - df (pd.DataFrame): the table, with all its rows in file order
+        - mask (NanMask): the mask of the table
+        - columns (list, optional): columns whose indicators are added. Defaults to the columns of df.
+        - dtype (optional): type of the indicator columns. Defaults to bool.
+
+    Returns:
+        pd.DataFrame: df with the indicator columns
+    """
+    if len(mask) != len(df):
+        raise ValueError(f"The nan mask has {len(mask)} rows but the table has {len(df)}")
+    indicators = mask.to_frame(df.columns if columns is None else columns, index=df.index, dtype=dtype)
+    return pd.concat([df, indicators], axis=1)
+
+
+def load_table_with_nans(path, columns=None, schema=None, dtype=bool):
+    """
+    Loads a table like load_table and expands its nan mask into '<column>_nan' indicator columns (e.g. for modelling).
+    """
+    df = load_table(path, columns=columns, schema=schema)
+    mask = load_nan_mask(path)
+    if mask is None:
+        return df
+    return add_nan_columns(df, mask, dtype=dtype)
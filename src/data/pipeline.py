@@ -0,0 +1,316 @@
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import types
+import pandas as pd
+from collections import namedtuple
+from functools import partial
+from src.data.columnar import csv_path, load_table, parquet_path, save_table
+from src.data.datasets import BEER_ADVOCATE, DATASETS, MATCHED, RATE_BEER, raw_table_path
+from src.data.distances import compute_distances
+from src.data.load_data import get_beer_merged, get_states_from_df, load_breweries, merge_ratings_breweries
+from src.data.save_tar_gz import tar_gz_to_csv
+from src.data.state_counts import get_monthly_counts_usa, get_state_adjacency_matrix
+from src.data.task_graph import Task, check_task_graph
+from src.data.wrangling import CLEAN_TABLES, RAW_TABLES, clean_data
+from src.utils.data_utils import merge_breweries, merge_reviews
+
+CACHE_PATH = "data/cache"
+
+logger = logging.getLogger(__name__)
+
+# func(*[artifact of each dep], **params) computes the artifact of the stage.
+# after lists stages that only have to run before (e.g. stages writing the files read by this one),
+# inputs are files or folders read by the stage and outputs files or folders it writes (the stage reruns if one is missing).
+Stage = namedtuple("Stage", ["func", "params", "deps", "after", "inputs", "outputs"],
+                   defaults=({}, (), (), (), ()))
+
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _referenced_names(const)
+    return names
+
+
+def _is_project_object(obj):
+    return getattr(obj, "__module__", None) is not None and obj.__module__.startswith("src.")
+
+
+def code_fingerprint(func, seen=None):
+    """
+    Returns the source of func followed by the source of every function or class of the project it uses
+    (directly or through other project functions), so editing e.g. load_breweries changes the fingerprint
+    of every stage calling it.
+    """
+    seen = set() if seen is None else seen
+    if isinstance(func, partial):
+        return repr((func.args, sorted(func.keywords.items()))) + code_fingerprint(func.func, seen)
+    if not (inspect.isfunction(func) or inspect.isclass(func)) and _is_project_object(type(func)):
+        # shared instances such as LOCATIONS
+        return code_fingerprint(type(func), seen)
+    if id(func) in seen or not (inspect.isfunction(func) or inspect.isclass(func)):
+        return ""
+    seen.add(id(func))
+    try:
+        parts = [inspect.getsource(func)]
+    except (OSError, TypeError):
+        parts = [func.__qualname__]
+
+    functions = [func] if inspect.isfunction(func) else [
+        member for member in vars(func).values() if inspect.isfunction(member)
+    ]
+    for function in functions:
+        names = _referenced_names(function.__code__)
+        for name in sorted(names):
+            obj = function.__globals__.get(name)
+            if isinstance(obj, types.ModuleType) and obj.__name__.startswith("src."):
+                # functions used as module.function
+                parts += [code_fingerprint(getattr(obj, attr), seen) for attr in sorted(names) if hasattr(obj, attr)]
+            elif _is_project_object(obj):
+                parts.append(code_fingerprint(obj, seen))
+    return "\n".join(parts)
+
+
+def path_fingerprint(path):
+    """
+    Returns the size and modification time of a file, or of every file of a folder
+    """
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [(path, stat.st_size, stat.st_mtime_ns)]
+    if os.path.isdir(path):
+        files = []
+        for root, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                files += path_fingerprint(os.path.join(root, name))
+        return files
+    return [(path, None)]
+
+
+def stage_hash(name, stage, dep_hashes):
+    """
+    Hash of everything the artifact of a stage depends on: its code, parameters, input files and upstream stages
+    """
+    digest = hashlib.sha256()
+    for part in [name, code_fingerprint(stage.func), repr(sorted(stage.params.items())),
+                 repr([path_fingerprint(path) for path in stage.inputs]), repr(dep_hashes)]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def check_pipeline(stages):
+    """
+    Raises a ValueError if a stage depends on an unknown stage or if the dependencies have a cycle
+    """
+    check_task_graph({name: Task(stage.func, (), tuple(stage.deps) + tuple(stage.after)) for name, stage in stages.items()})
+
+
+def _upstream(stages, targets):
+    needed = []
+
+    def visit(name):
+        if name in needed:
+            return
+        for dep in tuple(stages[name].deps) + tuple(stages[name].after):
+            visit(dep)
+        needed.append(name)
+
+    for target in targets:
+        visit(target)
+    return needed
+
+
+def _artifact_path(cache_path, name, hash_):
+    """
+    Path of the artifact of a stage without extension, dataframes are saved as .parquet and anything else as .pkl
+    """
+    return os.path.join(cache_path, f"{name.replace('/', '_')}.{hash_[:16]}")
+
+
+def _artifact_exists(path):
+    return os.path.exists(parquet_path(path)) or os.path.exists(path + ".pkl")
+
+
+def _save_artifact(artifact, path):
+    """
+    Saves an artifact next to path, each file is written to a temporary file first so a stage interrupted while
+    saving never leaves a truncated artifact behind
+    """
+    if isinstance(artifact, pd.DataFrame):
+        save_table(artifact, path + ".tmp", index=True)
+        os.replace(parquet_path(path + ".tmp"), parquet_path(path))
+        return
+    with open(path + ".pkl.tmp", "wb") as f:
+        pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".pkl.tmp", path + ".pkl")
+
+
+def _load_artifact(path):
+    if os.path.exists(parquet_path(path)):
+        return load_table(path)
+    with open(path + ".pkl", "rb") as f:
+        return pickle.load(f)
+
+
+def pipeline_hashes(stages, targets=None):
+    """
+    Returns the hash of each stage needed by the targets (all stages by default), upstream stages first
+    """
+    check_pipeline(stages)
+    hashes = {}
+    for name in _upstream(stages, list(stages) if targets is None else targets):
+        stage = stages[name]
+        hashes[name] = stage_hash(name, stage, [hashes[dep] for dep in tuple(stage.deps) + tuple(stage.after)])
+    return hashes
+
+
+def stale_stages(stages, targets=None, cache_path=CACHE_PATH):
+    """
+    Returns the stages that would be rerun to get the targets, in run order
+    """
+    hashes = pipeline_hashes(stages, targets)
+    return [name for name, hash_ in hashes.items() if not _is_fresh(stages[name], _artifact_path(cache_path, name, hash_))]
+
+
+def _is_fresh(stage, artifact_path):
+    return _artifact_exists(artifact_path) and all(os.path.exists(path) for path in stage.outputs)
+
+
+def run_pipeline(stages, targets=None, cache_path=CACHE_PATH, force=()):
+    """
+    Runs the stages needed by the targets, reusing the cached artifact of every stage whose hash did not change.
+    A stage reruns if its code (or the project code it calls), its parameters, its input files or an upstream stage changed.
+    The hash of a stage is computed once the stages before it have run, so it sees the input files they rewrote.
+
+    Args:
+        - stages (dict[str, Stage]): the stages by name, see default_stages
+        - targets (list, optional): stages whose artifacts are returned. Defaults to all stages.
+        - cache_path (str, optional): folder of the cached artifacts. Defaults to CACHE_PATH.
+        - force (list, optional): stages to rerun even if they are up to date (the stages after them are rerun too)
+
+    Returns:
+        dict[str, object]: the artifact of each target
+    """
+    targets = list(stages) if targets is None else list(targets)
+    check_pipeline(stages)
+    hashes = {}
+    os.makedirs(cache_path, exist_ok=True)
+    artifacts = {}
+
+    def artifact(name):
+        if name not in artifacts:
+            artifacts[name] = _load_artifact(_artifact_path(cache_path, name, hashes[name]))
+        return artifacts[name]
+
+    rerun = set()
+    for name in _upstream(stages, targets):
+        stage = stages[name]
+        hashes[name] = stage_hash(name, stage, [hashes[dep] for dep in tuple(stage.deps) + tuple(stage.after)])
+        path = _artifact_path(cache_path, name, hashes[name])
+        # a forced stage has the same hash, so the stages after it are rerun explicitly
+        upstream_rerun = any(dep in rerun for dep in tuple(stage.deps) + tuple(stage.after))
+        if name not in force and not upstream_rerun and _is_fresh(stage, path):
+            continue
+        rerun.add(name)
+        logger.info("Running stage %s", name)
+        artifacts[name] = stage.func(*[artifact(dep) for dep in stage.deps], **stage.params)
+        prefix = os.path.basename(path).rsplit(".", 1)[0] + "."
+        for old in os.listdir(cache_path):
+            if old.startswith(prefix) and old.endswith((".pkl", ".parquet")):
+                os.remove(os.path.join(cache_path, old))
+        _save_artifact(artifacts[name], path)
+
+    return {name: artifact(name) for name in targets}
+
+
+# ----- Stages of the analysis -----
+
+def extract_stage(raw_path, clean_path):
+    tar_gz_to_csv(raw_path, clean_path, overwrite=True)
+
+
+def clean_stage(clean_path, chunksize=None):
+    clean_data(clean_path, clean_load=True, chunksize=chunksize)
+
+
+def usa_ratings_stage(clean_path):
+    return merge_reviews(get_beer_merged(os.path.join(clean_path, BEER_ADVOCATE)),
+                         get_beer_merged(os.path.join(clean_path, RATE_BEER)),
+                         load_table(os.path.join(clean_path, MATCHED, "usa_ratings"), schema="ratings"))
+
+
+def breweries_stage(clean_path):
+    return merge_breweries(*[load_breweries(os.path.join(clean_path, folder))
+                             for folder in DATASETS])
+
+
+def states_stage(clean_path):
+    users = load_table(os.path.join(clean_path, BEER_ADVOCATE, "usa_users"), columns=["location"], schema="users")
+    return sorted(get_states_from_df(users))
+
+
+def merged_stage(usa_ratings, breweries):
+    return merge_ratings_breweries(usa_ratings, breweries)
+
+
+def state_matrix_stage(merged, states):
+    return get_state_adjacency_matrix(merged, states, as_ratio=False, drop_world=False)
+
+
+def monthly_counts_stage(merged, states, cumulative=False, as_ratio=True):
+    return get_monthly_counts_usa(merged, states, cumulative=cumulative, as_ratio=as_ratio)
+
+
+def distances_stage(clean_path):
+    compute_distances(clean_folder_path=clean_path)
+
+
+def _table_inputs(clean_path, *tables):
+    """
+    Files of the cleaned tables read by a stage, given as (dataset, table) (a table is read from its .parquet or its .csv,
+    see load_table)
+    """
+    return tuple(function(os.path.join(clean_path, *table)) for table in tables for function in (parquet_path, csv_path))
+
+
+def _dataset_tables(datasets, *tables):
+    return [(dataset, table) for dataset in datasets for table in tables]
+
+
+def default_stages(raw_path="data/raw", clean_path="data/clean", chunksize=None):
+    """
+    The stage graph of the analysis, from the .tar.gz archives to the state counts and the distances.
+
+    Args:
+        - raw_path (str, optional): folder of the .tar.gz archives. Defaults to "data/raw".
+        - clean_path (str, optional): folder of the extracted and cleaned tables. Defaults to "data/clean".
+        - chunksize (int, optional): passed to clean_data. Defaults to None.
+
+    Returns:
+        dict[str, Stage]: the stages by name
+    """
+    clean = {"clean_path": clean_path}
+    return {
+        "extract": Stage(extract_stage, {"raw_path": raw_path, "clean_path": clean_path}, inputs=(raw_path,)),
+        "clean": Stage(clean_stage, {"clean_path": clean_path, "chunksize": chunksize}, after=("extract",),
+                       inputs=tuple(function(raw_table_path(clean_path, dataset, table)) for dataset in DATASETS
+                                    for table in RAW_TABLES for function in (parquet_path, csv_path)),
+                       outputs=tuple(parquet_path(os.path.join(clean_path, *table))
+                                     for table in _dataset_tables(DATASETS, *CLEAN_TABLES))),
+        "usa_ratings": Stage(usa_ratings_stage, clean, after=("clean",), inputs=_table_inputs(
+            clean_path, *_dataset_tables((BEER_ADVOCATE, RATE_BEER), "usa_ratings", "usa_users"), (MATCHED, "usa_ratings"))),
+        "breweries": Stage(breweries_stage, clean, after=("clean",),
+                           inputs=_table_inputs(clean_path, *_dataset_tables(DATASETS, "breweries"))),
+        "states": Stage(states_stage, clean, after=("clean",), inputs=_table_inputs(clean_path, (BEER_ADVOCATE, "usa_users"))),
+        "merged": Stage(merged_stage, deps=("usa_ratings", "breweries")),
+        "state_matrix": Stage(state_matrix_stage, deps=("merged", "states")),
+        "monthly_counts": Stage(monthly_counts_stage, deps=("merged", "states")),
+        "distances": Stage(distances_stage, clean, after=("clean",),
+                           inputs=_table_inputs(clean_path, *_dataset_tables((BEER_ADVOCATE, RATE_BEER), "usa_users", "breweries")),
+                           outputs=(os.path.join(clean_path, "distances.npz"),)),
+    }
@@ -3,6 +3,8 @@ from matplotlib.animation import FuncAnimation
 import numpy as np
 import pandas as pd
 from src.data.state_counts import get_counts_for_state_matrix, get_state_adjacency_matrix
+from src.data.locations import US_STATE_CODES
+from src.data.time_buckets import time_bucket
 import seaborn as sns
 import plotly.graph_objects as go
 import math
@@ -72,7 +74,7 @@ def create_yearly_heatmap_gif(ratings_breweries_merged, states, save_file):
     Creates a gif with the yearly evolution of the state reviews
     """
     def get_yearly_reviews(ratings_breweries_merged):
-        reviews_by_year = ratings_breweries_merged.groupby(pd.to_datetime(ratings_breweries_merged["date"]).dt.year)
+        reviews_by_year = ratings_breweries_merged.groupby(time_bucket(ratings_breweries_merged, "year"))
         return reviews_by_year
     
     yearly_reviews = {group: group_df for group, group_df in get_yearly_reviews(ratings_breweries_merged)}
@@ -130,57 +132,7 @@ def get_countries_code():
     """
 
     # get all locations code
-    code = {'Alabama': 'AL',
-            'Alaska': 'AK',
-            'Arizona': 'AZ',
-            'Arkansas': 'AR',
-            'California': 'CA',
-            'Colorado': 'CO',
-            'Connecticut': 'CT',
-            'Delaware': 'DE',
-            'District of Columbia': 'DC',
-            'Florida': 'FL',
-            'Georgia': 'GA',
-            'Hawaii': 'HI',
-            'Idaho': 'ID',
-            'Illinois': 'IL',
-            'Indiana': 'IN',
-            'Iowa': 'IA',
-            'Kansas': 'KS',
-            'Kentucky': 'KY',
-            'Louisiana': 'LA',
-            'Maine': 'ME',
-            'Maryland': 'MD',
-            'Massachusetts': 'MA',
-            'Michigan': 'MI',
-            'Minnesota': 'MN',
-            'Mississippi': 'MS',
-            'Missouri': 'MO',
-            'Montana': 'MT',
-            'Nebraska': 'NE',
-            'Nevada': 'NV',
-            'New Hampshire': 'NH',
-            'New Jersey': 'NJ',
-            'New Mexico': 'NM',
-            'New York': 'NY',
-            'North Carolina': 'NC',
-            'North Dakota': 'ND',
-            'Ohio': 'OH',
-            'Oklahoma': 'OK',
-            'Oregon': 'OR',
-            'Pennsylvania': 'PA',
-            'Rhode Island': 'RI',
-            'South Carolina': 'SC',
-            'South Dakota': 'SD',
-            'Tennessee': 'TN',
-            'Texas': 'TX',
-            'Utah': 'UT',
-            'Vermont': 'VT',
-            'Virginia': 'VA',
-            'Washington': 'WA',
-            'West Virginia': 'WV',
-            'Wisconsin': 'WI',
-            'Wyoming': 'WY'}
+    code = dict(US_STATE_CODES)
 
     # source of the file "all.csv" with all the country codes: https://github.com/lukes/ISO-3166-Countries-with-Regional-Codes/blob/master/all/all.csv
     countries = pd.read_csv("data/clean/all.csv")
@@ -301,8 +253,7 @@ def plot_distance_per_state(user_state_dic, new_brew_state_dic):
     plt.show()
 
 def plot_average_distance_year(usa_ratings_merged):
-    usa_ratings_merged['year'] = usa_ratings_merged['year_month'].dt.year
-    average_distance_per_year = usa_ratings_merged.groupby('year')['distance'].mean()
+    average_distance_per_year = usa_ratings_merged.groupby(time_bucket(usa_ratings_merged, 'year'))['distance'].mean()
     average_distance_per_year = average_distance_per_year[average_distance_per_year.index >= 2000] #only take data after 2000 (too few points before)
 
     plt.plot(average_distance_per_year.index, average_distance_per_year)
@@ -312,9 +263,26 @@ def plot_average_distance_year(usa_ratings_merged):
     plt.xticks(ticks=range(2000, average_distance_per_year.index.max() + 1), rotation=45)
     plt.show()
 
+def plot_distance_quantiles_year(sketches, quantiles=(0.25, 0.5, 0.75), trim=0.1):
+    """
+    Plots quantiles and the trimmed mean of the distance of the reviews per year from the distance sketches
+    (see DistanceSketches), less skewed by the few foreign reviews than the average
+    """
+    sketches = sketches.select(start_month="2000-01") #only take data after 2000 (too few points before)
+    for q in quantiles:
+        per_year = sketches.quantile(q, by='year')
+        plt.plot(per_year.index, per_year, label=f"{int(q * 100)}th percentile")
+    trimmed = sketches.trimmed_mean(trim, by='year')
+    plt.plot(trimmed.index, trimmed, linestyle='--', label=f"{int(trim * 100)}% trimmed mean")
+    plt.title('Distance traveled by rated beers')
+    plt.xlabel('Year')
+    plt.ylabel('Distance (km)')
+    plt.xticks(ticks=range(2000, trimmed.index.max() + 1), rotation=45)
+    plt.legend()
+    plt.show()
+
 def plot_distance_and_data(usa_ratings_merged, add_data, column_name, label):
-    usa_ratings_merged['year'] = usa_ratings_merged['year_month'].dt.year
-    average_distance_per_year = usa_ratings_merged.groupby('year')['distance'].mean()
+    average_distance_per_year = usa_ratings_merged.groupby(time_bucket(usa_ratings_merged, 'year'))['distance'].mean()
     average_distance_per_year = average_distance_per_year[average_distance_per_year.index >= 2000] #only take data after 2000 (too few points before)
 
     plt.plot(average_distance_per_year.index, average_distance_per_year)
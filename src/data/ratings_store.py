@@ -0,0 +1,195 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from src.data.time_buckets import time_bucket
+
+# Columns kept in the store and their fixed-width type on disk.
+# user_id and the states are stored as codes into label lists (both states share the same labels),
+# date is stored as the number of days since 1970-01-01.
+STORE_COLUMNS = {
+    "user_id": "int32",
+    "beer_id": "int32",
+    "brewery_id": "int32",
+    "user_state": "int16",
+    "brewery_state": "int16",
+    "date": "int32",
+    "rating": "float32",
+    "appearance": "float32",
+    "aroma": "float32",
+    "palate": "float32",
+    "taste": "float32",
+    "overall": "float32",
+}
+
+METADATA_FILE = "metadata.json"
+
+
+def _to_store_dtype(values, dtype, column):
+    """
+    Casts a column to its fixed-width type, raising a ValueError instead of silently wrapping or
+    truncating missing or out-of-range ids
+    """
+    values = np.asarray(values)
+    if np.issubdtype(np.dtype(dtype), np.integer) and len(values):
+        if np.issubdtype(values.dtype, np.floating):
+            if np.isnan(values).any():
+                raise ValueError(f"Column {column} has missing values, they cannot be stored as {dtype}")
+            if (values != np.round(values)).any():
+                raise ValueError(f"Column {column} has non integer values, they cannot be stored as {dtype}")
+        elif not np.issubdtype(values.dtype, np.integer):
+            raise ValueError(f"Column {column} of type {values.dtype} cannot be stored as {dtype}")
+        info = np.iinfo(dtype)
+        if values.min() < info.min or values.max() > info.max:
+            raise ValueError(f"Column {column} has values outside the range of {dtype}")
+    return np.ascontiguousarray(values, dtype=dtype)
+
+
+def build_ratings_store(ratings_breweries_merged, store_path):
+    """
+    Writes the columns of the merged US reviews needed by the analyses as raw fixed-width arrays,
+    one .bin file per column plus a metadata.json file describing them.
+
+    Args:
+        - ratings_breweries_merged (pd.DataFrame): output of merge_ratings_breweries
+        - store_path (str): folder of the store, created if needed
+    """
+    os.makedirs(store_path, exist_ok=True)
+    df = ratings_breweries_merged
+    # missing states are not a label, they get the code -1
+    states = pd.Index(df["user_state"].dropna().astype(object).unique()).union(
+        pd.Index(df["brewery_state"].dropna().astype(object).unique()))
+    metadata = {"length": len(df), "columns": {}, "labels": {"state": states.tolist()}}
+
+    for column, dtype in STORE_COLUMNS.items():
+        if column not in df.columns:
+            continue
+        if column in ("user_state", "brewery_state"):
+            values = pd.Categorical(df[column].astype(object), categories=states).codes
+        elif column == "user_id":
+            # BeerAdvocate ids are strings and RateBeer ids are ints, they are stored as codes
+            if df[column].isna().any():
+                raise ValueError("Column user_id has missing values")
+            values, labels = pd.factorize(df[column].astype(str), sort=True)
+            with open(os.path.join(store_path, "user_id.labels.json"), "w") as f:
+                json.dump(labels.tolist(), f)
+        elif column == "date":
+            values = time_bucket(df, "day")
+        else:
+            values = df[column].to_numpy()
+        _to_store_dtype(values, dtype, column).tofile(os.path.join(store_path, column + ".bin"))
+        metadata["columns"][column] = dtype
+
+    with open(os.path.join(store_path, METADATA_FILE), "w") as f:
+        json.dump(metadata, f)
+
+
+class RatingsStore:
+    """
+    Read-only view of a ratings store, every column is a np.memmap so processes opening the same store
+    share the pages of the OS cache instead of each holding a copy.
+    Pickling a store only sends its path, the worker reopens the files.
+    """
+
+    def __init__(self, store_path):
+        self.path = store_path
+        with open(os.path.join(store_path, METADATA_FILE)) as f:
+            metadata = json.load(f)
+        self.length = metadata["length"]
+        self.dtypes = metadata["columns"]
+        self.states = metadata["labels"]["state"]
+        self._columns = {}
+
+    def __reduce__(self):
+        return (RatingsStore, (self.path,))
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def columns(self):
+        return list(self.dtypes)
+
+    def __getitem__(self, column):
+        if column not in self._columns:
+            if self.length == 0:
+                self._columns[column] = np.empty(0, dtype=self.dtypes[column])
+            else:
+                self._columns[column] = np.memmap(os.path.join(self.path, column + ".bin"),
+                                                  dtype=self.dtypes[column], mode="r", shape=(self.length,))
+        return self._columns[column]
+
+    def user_ids(self):
+        with open(os.path.join(self.path, "user_id.labels.json")) as f:
+            return json.load(f)
+
+    def to_dataframe(self, columns=None, start=0, stop=None):
+        """
+        Copies a slice of the store into a dataframe, states are decoded to names and dates to datetime64.
+        """
+        columns = self.columns if columns is None else columns
+        data = {}
+        for column in columns:
+            values = np.asarray(self[column][start:stop])
+            if column in ("user_state", "brewery_state"):
+                values = pd.Categorical.from_codes(values, categories=self.states)
+            elif column == "date":
+                values = values.astype("datetime64[D]")
+            data[column] = values
+        return pd.DataFrame(data)
+
+
+def open_ratings_store(store_path):
+    return RatingsStore(store_path)
+
+
+def count_state_pairs(store, start=0, stop=None):
+    """
+    Counts the reviews for each (user_state, brewery_state) pair of a slice of the store, reviews with a missing state are not counted.
+
+    Returns:
+        np.ndarray: matrix of shape (n_states, n_states) indexed by the codes of store.states
+    """
+    n = len(store.states)
+    user_codes = np.asarray(store["user_state"][start:stop], dtype=np.int64)
+    brewery_codes = np.asarray(store["brewery_state"][start:stop], dtype=np.int64)
+    known = (user_codes >= 0) & (brewery_codes >= 0)
+    user_codes, brewery_codes = user_codes[known], brewery_codes[known]
+    return np.bincount(user_codes * n + brewery_codes, minlength=n * n).reshape(n, n)
+
+
+def parallel_store_reduce(store_path, func, n_workers=None, n_chunks=None):
+    """
+    Applies func(store, start, stop) to contiguous slices of the store in a process pool and sums the results.
+    Every worker maps the same files, so no process materializes the whole table.
+
+    Args:
+        - store_path (str): folder of the store
+        - func (callable): top level function (it has to be picklable) returning a summable result
+        - n_workers (int, optional): number of processes. Defaults to the number of cores.
+        - n_chunks (int, optional): number of slices. Defaults to 4 per worker.
+
+    Returns:
+        the sum of the results of all slices
+    """
+    store = open_ratings_store(store_path)
+    n_workers = n_workers or os.cpu_count() or 1
+    n_chunks = max(1, min(n_chunks or 4 * n_workers, len(store)))
+    bounds = np.linspace(0, len(store), n_chunks + 1).astype(int)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        results = pool.map(func, [store] * n_chunks, bounds[:-1], bounds[1:])
+        return sum(results)
+
+
+def get_state_pair_counts(store_path, n_workers=None):
+    """
+    Counts the reviews from user_state to brewery_state for the whole store, split across processes.
+
+    Returns:
+        pd.DataFrame: counts indexed by user_state with one column per brewery_state
+    """
+    counts = parallel_store_reduce(store_path, count_state_pairs, n_workers=n_workers)
+    states = open_ratings_store(store_path).states
+    return pd.DataFrame(counts, index=pd.Index(states, name="user_state"),
+                        columns=pd.Index(states, name="brewery_state"))
@@ -0,0 +1,140 @@
+import pandas as pd
+from pandas.api.types import is_integer_dtype, is_numeric_dtype
+
+# Compact dtype of the columns of each table, columns that are not listed keep their type.
+# "integer" downcasts to the smallest integer type holding the values (only if the column has no nan).
+# Matched tables use the same columns prefixed with "ba_" / "rb_", and every "<column>_nan" indicator is a bool.
+_SCORES = {
+    column: "float32" for column in ["abv", "appearance", "aroma", "palate", "taste", "overall", "rating"]
+}
+
+SCHEMAS = {
+    "ratings": {
+        "beer_id": "integer",
+        "brewery_id": "integer",
+        "user_id": "integer",
+        "date": "integer",
+        "day": "integer",
+        "month": "integer",
+        "year": "integer",
+        "beer_name": "category",
+        "brewery_name": "category",
+        "style": "category",
+        "user_name": "category",
+        "location": "category",
+        "state": "category",
+        "user_state": "category",
+        "brewery_state": "category",
+        **_SCORES,
+    },
+    "users": {
+        "user_id": "integer",
+        "nbr_ratings": "integer",
+        "nbr_reviews": "integer",
+        "location": "category",
+        "state": "category",
+    },
+    "beers": {
+        "beer_id": "integer",
+        "brewery_id": "integer",
+        "nbr_ratings": "integer",
+        "nbr_reviews": "integer",
+        "nbr_matched_valid_ratings": "integer",
+        "brewery_name": "category",
+        "style": "category",
+        "abv": "float32",
+        "avg": "float32",
+        "ba_score": "float32",
+        "bros_score": "float32",
+        "avg_computed": "float32",
+        "zscore": "float32",
+        "avg_matched_valid_ratings": "float32",
+    },
+    "breweries": {
+        "id": "integer",
+        "brewery_id": "integer",
+        "nbr_beers": "integer",
+        "location": "category",
+        "state": "category",
+    },
+}
+
+
+def column_dtype(table, column):
+    """
+    Returns the declared dtype of a column of a table, or None if the column is not in the schema
+    """
+    if column.endswith("_nan"):
+        return "bool"
+    schema = SCHEMAS[table]
+    if column in schema:
+        return schema[column]
+    if column[:3] in ("ba_", "rb_"):
+        return schema.get(column[3:])
+    return None
+
+
+def schema_for_file(file_name):
+    """
+    Returns the name of the schema of a table from its file name (e.g. "usa_ratings.csv" -> "ratings"), or None
+    """
+    for keyword, table in [("ratings", "ratings"), ("reviews", "ratings"), ("users", "users"),
+                           ("beers", "beers"), ("breweries", "breweries")]:
+        if keyword in file_name:
+            return table
+    return None
+
+
+def apply_schema(df, table):
+    """
+    Converts the columns of a dataframe to the compact dtypes declared for the table in SCHEMAS.
+
+    Args:
+        - df (pd.DataFrame): the dataframe to convert
+        - table (str): one of "ratings", "users", "beers" or "breweries"
+
+    Returns:
+        pd.DataFrame: the converted dataframe (columns not in the schema are unchanged)
+    """
+    converted = {}
+    for column in df.columns:
+        dtype = column_dtype(table, column)
+        values = df[column]
+        if dtype == "integer":
+            if is_integer_dtype(values.dtype):
+                converted[column] = pd.to_numeric(values, downcast="integer")
+        elif dtype == "bool":
+            if is_numeric_dtype(values.dtype) and values.dtype != bool and not values.isna().any():
+                converted[column] = values.astype(bool)
+        elif dtype == "float32":
+            if is_numeric_dtype(values.dtype) and values.dtype != "float32":
+                converted[column] = values.astype("float32")
+        elif dtype == "category":
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                converted[column] = values.astype("category")
+    if not converted:
+        return df
+    return df.assign(**converted)
+
+
+def union_categories(frames):
+    """
+    Gives the categorical columns shared by the frames the same categories so pd.concat keeps them categorical.
+
+    Args:
+        - frames (list[pd.DataFrame]): dataframes that will be concatenated
+
+    Returns:
+        list[pd.DataFrame]: the dataframes with unified categories
+    """
+    columns = set.intersection(*(set(df.columns) for df in frames))
+    categories = {}
+    for column in columns:
+        if all(isinstance(df[column].dtype, pd.CategoricalDtype) for df in frames):
+            categories[column] = frames[0][column].cat.categories
+            for df in frames[1:]:
+                categories[column] = categories[column].union(df[column].cat.categories)
+    return [
+        df.assign(**{column: df[column].cat.set_categories(cats) for column, cats in categories.items()})
+        for df in frames
+    ]
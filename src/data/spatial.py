@@ -0,0 +1,181 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from src.data.distances import EARTH_RADIUS
+from src.data.gazetteer import load_gazetteer
+from src.data.locations import canonical_location
+
+# Distances between many points (per review, nearest breweries) computed on unit vectors of the sphere:
+# the straight-line (chord) distance between two unit vectors gives the great-circle distance,
+# so a KD-tree on the vectors answers nearest neighbour queries for great-circle distances.
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """
+    Returns the (n, 3) unit vectors of points given in degrees
+    """
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord):
+    """
+    Great-circle distance in km of the chord between two unit vectors
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(np.asarray(chord) / 2, 1))
+
+
+def location_vectors(locations, dict_coordinates):
+    """
+    Returns the unit vectors of a column of locations (nan rows for locations without coordinates),
+    the coordinates are looked up once per distinct location.
+
+    Args:
+        - locations (pd.Series): the locations, e.g. the user_state column of the merged reviews
+        - dict_coordinates (dict): location -> place with latitude and longitude, see get_locations_coordinates
+
+    Returns:
+        np.ndarray: array of shape (len(locations), 3)
+    """
+    if isinstance(getattr(locations, "dtype", None), pd.CategoricalDtype):
+        codes, uniques = locations.cat.codes.to_numpy(), locations.cat.categories
+    else:
+        codes, uniques = pd.factorize(pd.Series(locations, dtype=object))
+    places = [dict_coordinates.get(location) for location in uniques]
+    latitudes = np.array([place.latitude if place is not None else np.nan for place in places] + [np.nan])
+    longitudes = np.array([place.longitude if place is not None else np.nan for place in places] + [np.nan])
+    # code -1 (missing location) takes the last nan row
+    return to_unit_vectors(latitudes, longitudes)[codes]
+
+
+def review_distances(ratings_breweries_merged, dict_coordinates, user_column="user_state", brewery_column="brewery_state"):
+    """
+    Distance in km between the user and the brewery of every review (nan if a location has no coordinates).
+    Works at any granularity: with state locations it gives the same distances as the distance matrix,
+    with city locations (see city_locations) the distance between the cities.
+    """
+    users = location_vectors(ratings_breweries_merged[user_column], dict_coordinates)
+    breweries = location_vectors(ratings_breweries_merged[brewery_column], dict_coordinates)
+    return chord_to_km(np.linalg.norm(users - breweries, axis=1)).astype(np.float32)
+
+
+class BreweryIndex:
+    """
+    KD-tree on the unit vectors of the breweries, to find the breweries nearest to given locations.
+
+    Args:
+        - breweries (pd.DataFrame): the breweries (see merge_breweries)
+        - dict_coordinates (dict): location -> place with latitude and longitude
+        - location_column (str, optional): column of the brewery locations. Defaults to "location".
+    """
+
+    def __init__(self, breweries, dict_coordinates, location_column="location"):
+        vectors = location_vectors(breweries[location_column], dict_coordinates)
+        found = ~np.isnan(vectors).any(axis=1)
+        self.breweries = breweries[found].reset_index(drop=True)
+        self.tree = cKDTree(vectors[found])
+
+    def __len__(self):
+        return len(self.breweries)
+
+    def nearest(self, locations, dict_coordinates, n=1):
+        """
+        Returns the distances in km (shape (len(locations), n), nan for locations without coordinates) and the
+        positions in self.breweries (len(self) where the distance is nan) of the n breweries nearest to each location.
+        Each distinct location is queried once.
+        """
+        codes, uniques = pd.factorize(pd.Series(locations, dtype=object))
+        vectors = location_vectors(pd.Series(uniques, dtype=object), dict_coordinates)
+        found = ~np.isnan(vectors).any(axis=1)
+        chords = np.full((len(uniques) + 1, n), np.inf)
+        positions = np.full((len(uniques) + 1, n), len(self))
+        if found.any():
+            query_chords, query_positions = self.tree.query(vectors[found], k=n)
+            chords[:-1][found] = np.asarray(query_chords).reshape(-1, n)
+            positions[:-1][found] = np.asarray(query_positions).reshape(-1, n)
+        distances = np.where(np.isinf(chords), np.nan, chord_to_km(np.where(np.isinf(chords), 0, chords)))
+        return distances[codes], positions[codes]
+
+
+def nearest_breweries_distances(users, breweries, dict_coordinates, n=5, user_column="location", brewery_column="location"):
+    """
+    Distance from each user to the n nearest breweries.
+
+    Args:
+        - users (pd.DataFrame): the users with their location
+        - breweries (pd.DataFrame): the breweries with their location
+        - dict_coordinates (dict): location -> place with latitude and longitude
+        - n (int, optional): number of breweries. Defaults to 5.
+
+    Returns:
+        pd.DataFrame: columns nearest_1 ... nearest_n (km), same index as users
+    """
+    index = BreweryIndex(breweries, dict_coordinates, location_column=brewery_column)
+    distances, _ = index.nearest(users[user_column], dict_coordinates, n=n)
+    return pd.DataFrame(distances, index=users.index, columns=[f"nearest_{i + 1}" for i in range(n)])
+
+
+def city_locations(df, city_column="city", location_column="location"):
+    """
+    Location strings at city granularity, e.g. "United States, California, San Diego",
+    the location is kept as it is for rows without city
+    """
+    cities = df[city_column].astype(object)
+    locations = df[location_column].astype(object)
+    has_city = cities.notna() & (cities.astype(str).str.strip() != "")
+    return locations.where(~has_city, locations + ", " + cities.astype(str).str.strip())
+
+
+def _in_region(city, region, location):
+    """
+    True if a city of the gazetteer is in the place of a location: same country, and same state, province
+    or UK country if the location has one
+    """
+    if region is None:
+        return city.country == canonical_location(location)["country"]
+    if region.kind == "country":
+        return city.country == region.country
+    # a location whose state is itself a city of the gazetteer
+    region_name = region.region if region.kind == "city" else region.name
+    return city.country == region.country and city.region == region_name
+
+
+def get_city_coordinates(df, city_column="city", location_column="location", gazetteer=None, geocoder=None):
+    """
+    Coordinates of the city locations of a dataframe (keys as in city_locations): cities of the gazetteer are matched
+    offline if they are in the state (or country) of the location, the other ones are geocoded if a geocoder is given
+    (see geocoding.py), and the remaining ones fall back to their state or country. Each distinct (location, city)
+    pair is looked up once.
+
+    Returns:
+        dict: location -> place with latitude and longitude
+    """
+    gazetteer = gazetteer or load_gazetteer()
+    keys = city_locations(df, city_column, location_column)
+    pairs = pd.DataFrame({"key": keys, "location": df[location_column].astype(object)}).dropna().drop_duplicates("key")
+
+    dict_coordinates = {}
+    for key, location in zip(pairs["key"], pairs["location"]):
+        region = gazetteer.locate(location)
+        if key == location:
+            place = region
+        else:
+            # only a city of the same country and state (e.g. not Portland, Oregon for Portland in Maine),
+            # locate would fall back to the country
+            place = gazetteer.find(key[len(location) + 2:], ["city"])
+            if place is not None and not _in_region(place, region, location):
+                place = None
+        if place is not None:
+            dict_coordinates[key] = place
+
+    missing = [key for key in pairs["key"] if key not in dict_coordinates]
+    if missing and geocoder is not None:
+        dict_coordinates.update(geocoder.geocode(missing))
+    for key, location in zip(pairs["key"], pairs["location"]):
+        if key not in dict_coordinates:
+            place = gazetteer.locate(location)
+            if place is not None:
+                dict_coordinates[key] = place
+    return dict_coordinates
@@ -1,5 +1,6 @@
 import numpy as np
 import pandas as pd
+from src.data.time_buckets import filter_time_range, time_bucket, to_periods
 
 
 def transform_to_distribution(row):
@@ -7,6 +8,44 @@ def transform_to_distribution(row):
         return row
     return row/row.sum()
 
+def encode_states(locations, states):
+    """
+    Integer codes of a column of locations for the state matrices: the position of the state in sorted(states),
+    len(states) for the other locations (the World column) and -1 for missing locations.
+    Categorical columns are encoded once per category.
+    """
+    states = pd.Index(sorted(states))
+    if isinstance(getattr(locations, "dtype", None), pd.CategoricalDtype):
+        codes, uniques = locations.cat.codes.to_numpy(), locations.cat.categories
+    else:
+        codes, uniques = pd.factorize(pd.Series(locations, dtype=object))
+    unique_codes = states.get_indexer(uniques)
+    # code -1 of missing locations takes the last element
+    unique_codes = np.append(np.where(unique_codes < 0, len(states), unique_codes), -1)
+    return unique_codes[codes]
+
+
+def state_adjacency_from_codes(user_codes, brewery_codes, states, as_ratio=True, drop_world=True):
+    """
+    Same matrix as get_state_adjacency_matrix from the codes of the user and brewery states (see encode_states),
+    the counts are computed with a single bincount.
+    """
+    states = sorted(states)
+    n = len(states)
+    user_codes = np.asarray(user_codes)
+    brewery_codes = np.asarray(brewery_codes)
+    # only users of the states and reviews with a brewery location are counted
+    keep = (user_codes >= 0) & (user_codes < n) & (brewery_codes >= 0)
+    counts = np.bincount(user_codes[keep] * (n + 1) + brewery_codes[keep], minlength=n * (n + 1)).reshape(n, n + 1)
+    if drop_world:
+        counts = counts[:, :n]
+    columns = states if drop_world else states + ["World"]
+    if as_ratio:
+        row_sums = counts.sum(axis=1, keepdims=True)
+        counts = np.divide(counts, row_sums, out=counts.astype(np.float64), where=row_sums > 0)
+    return pd.DataFrame(counts, index=pd.Index(states, name="user_state"), columns=pd.Index(columns, name="brewery_state"))
+
+
 def get_state_adjacency_matrix(ratings_breweries_merged, states, as_ratio=True, drop_world=True):
     """
     Generates a state adjacency matrix from a merged dataframe of ratings and breweries.
@@ -22,16 +61,9 @@ def get_state_adjacency_matrix(ratings_breweries_merged, states, as_ratio=True,
                   from user_state that reviewed a beer in brewery_state. If as_ratio is True, the elements are 
                   ratios instead of counts.
     """
-    state_matrix = ratings_breweries_merged.groupby(by=["user_state", "brewery_state"]).size().unstack(fill_value=0)
-    foreign_counts = state_matrix.drop(columns=states, errors='ignore').T.sum().fillna(0)
-    state_matrix = state_matrix.reindex(index=sorted(list(states)), columns=sorted(list(states)), fill_value=0)
-    state_matrix = state_matrix.loc[:, sorted(list(states))]
-    if not drop_world:
-        state_matrix["World"] = foreign_counts
-    if as_ratio:
-        state_matrix = state_matrix.apply(transform_to_distribution, axis=1)
-    
-    return state_matrix
+    user_codes = encode_states(ratings_breweries_merged["user_state"], states)
+    brewery_codes = encode_states(ratings_breweries_merged["brewery_state"], states)
+    return state_adjacency_from_codes(user_codes, brewery_codes, states, as_ratio=as_ratio, drop_world=drop_world)
 
 def get_counts_for_state_matrix(matrix, as_ratio=False):
     """
@@ -82,30 +114,80 @@ def get_reviews_by_month(ratings_breweries_merged, start_month=None, end_month=N
 
     Args:
     - ratings_breweries_merged (DataFrame): A DataFrame containing brewery reviews with a 'date' column.
-    - start_month (datetime.date, optional): The start date to filter reviews. Defaults to None.
-    - end_month (datetime.date, optional): The end date to filter reviews. Defaults to None.
+    - start_month (datetime.date or str, optional): The first month of the reviews kept. Defaults to None.
+    - end_month (datetime.date or str, optional): The last month of the reviews kept (all its days). Defaults to None.
 
     Returns:
     DataFrameGroupBy: A DataFrameGroupBy object with reviews grouped by month.
     """
-    if start_month:
-        ratings_breweries_merged = ratings_breweries_merged[pd.to_datetime(ratings_breweries_merged["date"]).dt.date >= start_month]
-    if end_month:
-        ratings_breweries_merged = ratings_breweries_merged[pd.to_datetime(ratings_breweries_merged["date"]).dt.date <= end_month]
-    reviews_by_month = ratings_breweries_merged.groupby(pd.to_datetime(ratings_breweries_merged["date"]).dt.to_period('M'))
+    ratings_breweries_merged = filter_time_range(ratings_breweries_merged, start_month or None, end_month or None, bucket="month")
+    months = to_periods(time_bucket(ratings_breweries_merged, "month")).rename("date")
+    reviews_by_month = ratings_breweries_merged.groupby(months)
     return reviews_by_month
 
+def monthly_count_cube(month_codes, user_codes, brewery_codes, n_months, n_states):
+    """
+    Counts of reviews per (month, user_state, brewery location) in a single bincount.
+
+    Args:
+        - month_codes (np.ndarray): month of each review, between 0 and n_months - 1
+        - user_codes, brewery_codes (np.ndarray): codes of the user and brewery states, see encode_states
+        - n_months (int): number of months
+        - n_states (int): number of states
+
+    Returns:
+        np.ndarray: array of shape (n_months, n_states, n_states + 1), the last column is World
+    """
+    month_codes = np.asarray(month_codes, dtype=np.int64)
+    user_codes = np.asarray(user_codes, dtype=np.int64)
+    brewery_codes = np.asarray(brewery_codes, dtype=np.int64)
+    keep = (user_codes >= 0) & (user_codes < n_states) & (brewery_codes >= 0)
+    flat = (month_codes[keep] * n_states + user_codes[keep]) * (n_states + 1) + brewery_codes[keep]
+    cube = np.bincount(flat, minlength=n_months * n_states * (n_states + 1))
+    return cube.reshape(n_months, n_states, n_states + 1)
+
+
+def cube_to_frame(cube, months, states):
+    """
+    The count cube as the table of get_state_matrix_per_month (indexed by date and user_state, columns states and World)
+    """
+    states = sorted(states)
+    index = pd.MultiIndex.from_product([months, states], names=["date", "user_state"])
+    return pd.DataFrame(cube.reshape(-1, len(states) + 1), index=index,
+                        columns=pd.Index(states + ["World"], name="brewery_state"))
+
+
+def total_counts_from_cube(cube, months, as_ratio=True):
+    """
+    local_count (diagonal), national_count (rest of the states) and foreign_count (World) of each month of a count cube
+    """
+    n = cube.shape[1]
+    local_count = np.trace(cube[:, :, :n], axis1=1, axis2=2)
+    national_count = cube[:, :, :n].sum(axis=(1, 2)) - local_count
+    foreign_count = cube[:, :, n].sum(axis=1)
+    counts = pd.DataFrame({
+        'local_count': local_count,
+        'national_count': national_count,
+        'foreign_count': foreign_count
+    }, index=pd.Index(months, name="date"))
+    if as_ratio:
+        return counts.div(counts.sum(axis=1), axis=0).fillna(0)
+    return counts
+
+
 def get_state_matrix_per_month(reviews_by_month, states, cumulative=False):
     """
     Get a table indexed by year-month and user_state with the column for different brewery location, the values are the number of reviews from user_state to brewery_state.
     If cumulative, it's the total number of reviews from user_state to brewery_state at that point in time.
     """
-    # For each month get the matrix of review count from user state to brewery locations
-    counts_by_month = reviews_by_month.apply(lambda x: get_state_adjacency_matrix(x, states, as_ratio=False, drop_world=False).fillna(0))
+    # the month of each review is its group number, the counts of all months are computed at once
+    months = reviews_by_month.size().index
+    reviews = reviews_by_month.obj
+    cube = monthly_count_cube(reviews_by_month.ngroup().to_numpy(), encode_states(reviews["user_state"], states),
+                              encode_states(reviews["brewery_state"], states), len(months), len(states))
     if cumulative:
-        counts_by_month = counts_by_month.groupby(level="user_state").cumsum()
-    return counts_by_month
-
+        cube = cube.cumsum(axis=0)
+    return cube_to_frame(cube, months, states)
 
 
 def get_total_counts_from_monthly_data(counts_by_month, as_ratio=True):
@@ -113,20 +195,17 @@ def get_total_counts_from_monthly_data(counts_by_month, as_ratio=True):
     Takes in a dataframe with the count of reviews from user state to brewery state by month and 
     outputs a df with the local_count, national_count and foreign_count by month
     """
-    
-    def total_counts_by_date(sub_df):
-        local_count = np.diagonal(sub_df.drop(columns=["user_state", "date", "World"])).sum()
-        foreign_count = sub_df['World'].sum() if 'World' in sub_df.columns else 0
-        non_world_sum = np.array(sub_df.drop(columns=["user_state", 'World', 'date'])).sum()
-        national_count = non_world_sum - local_count
-
-        return pd.Series({
-            'local_count': local_count,
-            'national_count': national_count,
-            'foreign_count': foreign_count
-        })
-
-    counts_by_month_compact = counts_by_month.reset_index().groupby("date").apply(total_counts_by_date)
+    state_counts = counts_by_month.drop(columns="World", errors="ignore")
+    values = state_counts.to_numpy()
+    # column of the state of the user of each row
+    local_columns = state_counts.columns.get_indexer(counts_by_month.index.get_level_values("user_state"))
+    local_count = np.where(local_columns >= 0, values[np.arange(len(values)), local_columns], 0)
+    counts = pd.DataFrame({
+        'local_count': local_count,
+        'national_count': values.sum(axis=1) - local_count,
+        'foreign_count': counts_by_month['World'].to_numpy() if 'World' in counts_by_month.columns else 0
+    }, index=counts_by_month.index.get_level_values("date"))
+    counts_by_month_compact = counts.groupby(level="date").sum()
     if as_ratio:
         row_sums = counts_by_month_compact.sum(axis=1)
         ratios_by_month_collapsed = counts_by_month_compact.div(row_sums, axis=0).fillna(0)
@@ -137,6 +216,7 @@ def get_total_counts_from_monthly_data(counts_by_month, as_ratio=True):
 def get_monthly_counts_usa(ratings_brewery_merged, states, start_month=None, end_month=None, cumulative=False, as_ratio=True):
     """
     Calculate the total counts (local, national and foreign) of reviews for US states within a specified date range.
+    The counts of all months are computed at once in a month x user_state x brewery_state cube (see monthly_count_cube).
 
     Args:
         - ratings_brewery_merged (pd.DataFrame): The merged DataFrame containing ratings and brewery information.
@@ -150,7 +230,10 @@ def get_monthly_counts_usa(ratings_brewery_merged, states, start_month=None, end
     Returns:
         pd.DataFrame: A DataFrame containing the total counts of reviews for each state
     """
-    rev_monthly = get_reviews_by_month(ratings_brewery_merged, start_month=start_month, end_month=end_month)
-    counts_by_month = get_state_matrix_per_month(rev_monthly, states, cumulative=cumulative)
-    us_counts = get_total_counts_from_monthly_data(counts_by_month, as_ratio=as_ratio)
-    return us_counts
\ No newline at end of file
+    ratings_brewery_merged = filter_time_range(ratings_brewery_merged, start_month or None, end_month or None, bucket="month")
+    month_codes, months = pd.factorize(time_bucket(ratings_brewery_merged, "month").to_numpy(), sort=True)
+    cube = monthly_count_cube(month_codes, encode_states(ratings_brewery_merged["user_state"], states),
+                              encode_states(ratings_brewery_merged["brewery_state"], states), len(months), len(states))
+    if cumulative:
+        cube = cube.cumsum(axis=0)
+    return total_counts_from_cube(cube, to_periods(months).rename("date"), as_ratio=as_ratio)
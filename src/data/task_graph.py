@@ -0,0 +1,100 @@
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# func(*args) is run once all the tasks named in deps are done,
+# memory is an estimate (in bytes) of the peak memory of the task used to respect the memory cap
+Task = namedtuple("Task", ["func", "args", "deps", "memory"], defaults=((), (), 0))
+
+# share of the available memory the running tasks can use when no memory cap is given
+MEMORY_SHARE = 0.5
+
+
+def available_memory():
+    """
+    Returns the available physical memory in bytes (the total physical memory where it cannot be read), None if unknown
+    """
+    for pages in ("SC_AVPHYS_PAGES", "SC_PHYS_PAGES"):
+        try:
+            return os.sysconf(pages) * os.sysconf("SC_PAGE_SIZE")
+        except (AttributeError, ValueError, OSError):
+            continue
+    return None
+
+
+def check_task_graph(tasks):
+    """
+    Raises a ValueError if a task depends on an unknown task or if the dependencies have a cycle
+    """
+    for name, task in tasks.items():
+        for dep in task.deps:
+            if dep not in tasks:
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+    visiting, visited = set(), set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through task {name}")
+        visiting.add(name)
+        for dep in tasks[name].deps:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in tasks:
+        visit(name)
+
+
+def run_task_graph(tasks, max_workers=None, memory_cap=None):
+    """
+    Runs a graph of tasks on a process pool, a task starts as soon as its dependencies are done.
+
+    Args:
+        - tasks (dict[str, Task]): the tasks by name, func has to be a top level (picklable) function
+        - max_workers (int, optional): number of processes. Defaults to the number of cores.
+        - memory_cap (int, optional): maximum sum of the memory estimates of the running tasks in bytes.
+                                      A task larger than the cap runs alone. Defaults to MEMORY_SHARE of the available
+                                      memory (no cap if it cannot be read).
+
+    Returns:
+        dict[str, object]: the result of each task
+
+    Raises:
+        RuntimeError: if a task fails, the tasks that did not start are cancelled and the running ones are waited for
+    """
+    check_task_graph(tasks)
+    max_workers = max_workers or os.cpu_count() or 1
+    if memory_cap is None:
+        memory = available_memory()
+        memory_cap = None if memory is None else MEMORY_SHARE * memory
+    remaining = dict(tasks)
+    running = {}
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while remaining or running:
+            used_memory = sum(tasks[name].memory for name in running.values())
+            for name, task in list(remaining.items()):
+                if len(running) >= max_workers:
+                    break
+                if any(dep not in results for dep in task.deps):
+                    continue
+                if memory_cap is not None and running and used_memory + task.memory > memory_cap:
+                    continue
+                running[pool.submit(task.func, *task.args)] = name
+                used_memory += task.memory
+                del remaining[name]
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    # the tasks left are not started, the running ones are waited for so no process is left behind
+                    pool.shutdown(cancel_futures=True)
+                    raise RuntimeError(f"Task {name} failed, tasks not started: {', '.join(remaining) or 'none'}") from e
+
+    return results
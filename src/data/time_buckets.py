@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+
+# Integer time buckets computed once when the ratings are loaded, so filtering and grouping by time are integer
+# operations instead of parsing the dates again. They are the ordinals of pandas periods:
+# "day" is the number of days since 1970-01-01, "month" the number of months since 1970-01 and "year" the year.
+TIME_BUCKETS = ["day", "month", "year"]
+_BUCKET_FREQ = {"day": "D", "month": "M", "year": "Y"}
+
+
+def days_from_timestamps(timestamps):
+    """
+    Converts epoch seconds (UTC) to day ordinals
+    """
+    return (np.asarray(timestamps, dtype=np.int64) // 86400).astype(np.int32)
+
+
+def buckets_from_days(days):
+    """
+    Returns the day, month and year ordinals of an array of day ordinals
+    """
+    dates = np.asarray(days).astype("datetime64[D]")
+    months = dates.astype("datetime64[M]").astype(np.int64)
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    return {"day": np.asarray(days, dtype=np.int32), "month": months.astype(np.int16), "year": years.astype(np.int16)}
+
+
+def add_time_buckets(df, column="date"):
+    """
+    Adds the day, month and year columns to a dataframe and converts its epoch seconds column to datetime64.
+
+    Args:
+        - df (pd.DataFrame): dataframe with a column of epoch seconds (as in the clean ratings)
+        - column (str, optional): the column of epoch seconds. Defaults to "date".
+
+    Returns:
+        pd.DataFrame: the dataframe with the buckets, column holds the dates (without time)
+    """
+    buckets = buckets_from_days(days_from_timestamps(df[column]))
+    return df.assign(**{column: buckets["day"].astype("datetime64[D]")}, **buckets)
+
+
+def time_bucket(df, bucket, column="date"):
+    """
+    Returns the day, month or year ordinals of the rows of a dataframe.
+    The precomputed column is used if the dataframe has it, otherwise the dates of column are parsed once.
+    """
+    if bucket in df.columns:
+        return df[bucket]
+    days = pd.to_datetime(df[column]).to_numpy().astype("datetime64[D]").astype(np.int64)
+    return pd.Series(buckets_from_days(days)[bucket], index=df.index, name=bucket)
+
+
+def to_ordinal(value, bucket):
+    """
+    Converts a date (anything pd.Period accepts, e.g. datetime.date or "2010-01") to the ordinal of its bucket
+    """
+    if bucket == "year" and isinstance(value, (int, np.integer)):
+        return int(value)
+    period = pd.Period(value, freq=_BUCKET_FREQ[bucket])
+    return period.year if bucket == "year" else period.ordinal
+
+
+def to_periods(ordinals, bucket="month"):
+    """
+    Converts day or month ordinals back to pandas periods (years are returned as they are)
+    """
+    if bucket == "year":
+        return pd.Index(ordinals, name=bucket)
+    return pd.PeriodIndex(pd.arrays.PeriodArray(np.asarray(ordinals, dtype=np.int64),
+                                                dtype=pd.PeriodDtype(_BUCKET_FREQ[bucket])))
+
+
+def filter_time_range(df, start=None, end=None, bucket="day"):
+    """
+    Keeps the rows whose bucket is between start and end (both included) with integer comparisons.
+
+    Args:
+        - df (pd.DataFrame): dataframe with time buckets (see add_time_buckets)
+        - start, end (optional): bounds, anything to_ordinal accepts. Defaults to None (no bound).
+        - bucket (str, optional): "day", "month" or "year". Defaults to "day".
+    """
+    if start is None and end is None:
+        return df
+    keep = np.ones(len(df), dtype=bool)
+    ordinals = time_bucket(df, bucket).to_numpy()
+    if start is not None:
+        keep &= ordinals >= to_ordinal(start, bucket)
+    if end is not None:
+        keep &= ordinals <= to_ordinal(end, bucket)
+    return df[keep]
@@ -0,0 +1,185 @@
+import csv
+import gzip
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import tqdm
+
+# Column order of the .csv generated from the ratings/reviews .txt.gz files.
+# Fields a dataset does not have (e.g. review for RateBeer) are left empty.
+REVIEW_COLUMNS = [
+    "beer_name", "beer_id", "brewery_name", "brewery_id", "style", "abv", "date",
+    "user_name", "user_id", "appearance", "aroma", "palate", "taste", "overall",
+    "rating", "text", "review",
+]
+
+# Type of the parsed fields, fields not listed here are kept as strings
+# (user_id stays a string since BeerAdvocate ids look like "nmann08.184925")
+FIELD_TYPES = {
+    "beer_id": int, "brewery_id": int, "date": int,
+    "abv": float, "appearance": float, "aroma": float, "palate": float,
+    "taste": float, "overall": float, "rating": float,
+}
+
+# Number of decompressed bytes sent to a worker at once
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+
+def _to_str(value):
+    # keep the escaped repr form the former parser produced ("Caf\\xc3\\xa9"), clean_ratings
+    # undoes it with decode_string so literal backslashes and utf-8 text survive the round trip
+    return repr(value.lstrip(b" "))[2:-1]
+
+
+_CONVERTERS = {int: _to_int, float: _to_float}
+
+
+def iter_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    Splits a binary stream into chunks that only contain whole reviews, reviews are separated by blank lines.
+
+    Args:
+        - f: file opened in binary mode
+        - chunk_size: approximate number of bytes per chunk
+
+    Returns:
+        generator of bytes: chunks ending on a review boundary
+    """
+    rest = b""
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n\n")
+        if end == -1:
+            rest = data
+            continue
+        yield data[:end + 1]
+        rest = data[end + 2:]
+    if rest.strip():
+        yield rest
+
+
+def parse_chunk(chunk):
+    """
+    Parses a chunk of raw reviews into typed columns.
+
+    Args:
+        - chunk: bytes containing whole reviews separated by blank lines
+
+    Returns:
+        dict[str, list]: one list per column of REVIEW_COLUMNS, missing fields are None (nan for floats)
+    """
+    converters = [
+        (name.encode(), _CONVERTERS.get(FIELD_TYPES.get(name), _to_str)) for name in REVIEW_COLUMNS
+    ]
+    columns = [[] for _ in REVIEW_COLUMNS]
+    for record in chunk.split(b"\n\n"):
+        if not record.strip():
+            continue
+        fields = {}
+        for line in record.split(b"\n"):
+            name, sep, value = line.partition(b":")
+            if sep:
+                fields[name.strip()] = value
+        for (name, convert), column in zip(converters, columns):
+            value = fields.get(name)
+            column.append(None if value is None else convert(value))
+    return dict(zip(REVIEW_COLUMNS, columns))
+
+
+def iter_review_columns(f, n_workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Parses a binary stream of reviews chunk by chunk in a process pool.
+    Only a bounded number of chunks is in flight at once so memory usage does not depend on the file size.
+
+    Args:
+        - f: file opened in binary mode
+        - n_workers: number of processes, defaults to the number of cores. If 1, parses in the current process.
+        - chunk_size: approximate number of bytes per chunk
+
+    Returns:
+        generator of dict[str, list]: the parsed columns of each chunk, in file order
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    chunks = iter_chunks(f, chunk_size)
+    if n_workers == 1:
+        for chunk in chunks:
+            yield parse_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(parse_chunk, chunk))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def write_columns_csv(column_batches, csv_path, columns=REVIEW_COLUMNS):
+    """
+    Writes batches of parsed columns to a single .csv file.
+
+    Args:
+        - column_batches: iterable of dict[str, list] (e.g. the output of iter_review_columns)
+        - csv_path: path of the .csv file to create
+        - columns: column order of the .csv
+    """
+    with open(csv_path, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for batch in column_batches:
+            writer.writerows(zip(*(batch[name] for name in columns)))
+
+
+def txt_to_csv(source, csv_path, n_workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Converts a ratings/reviews .txt.gz file to .csv while streaming it, memory usage does not depend on the file size.
+
+    Args:
+        - source: path of the .txt.gz file or binary file object with its content (e.g. from TarFile.extractfile)
+        - csv_path: path of the .csv file to create
+        - n_workers: number of processes used for parsing, defaults to the number of cores
+        - chunk_size: approximate number of bytes parsed at once by a worker
+    """
+    with gzip.open(source, 'rb') as f:
+        batches = iter_review_columns(f, n_workers=n_workers, chunk_size=chunk_size)
+        write_columns_csv(tqdm.tqdm(batches, unit="chunk"), csv_path)
+
+
+def txt_to_dataframe(source, n_workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Parses a ratings/reviews .txt.gz file into a dataframe.
+
+    Args:
+        - source: path of the .txt.gz file or binary file object with its content (e.g. from TarFile.extractfile)
+        - n_workers: number of processes used for parsing, defaults to the number of cores
+        - chunk_size: approximate number of bytes parsed at once by a worker
+
+    Returns:
+        pd.DataFrame: the reviews with the columns of REVIEW_COLUMNS
+    """
+    with gzip.open(source, 'rb') as f:
+        batches = iter_review_columns(f, n_workers=n_workers, chunk_size=chunk_size)
+        frames = [pd.DataFrame(batch, columns=REVIEW_COLUMNS) for batch in tqdm.tqdm(batches, unit="chunk")]
+    if not frames:
+        return pd.DataFrame(columns=REVIEW_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
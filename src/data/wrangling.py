@@ -1,6 +1,13 @@
 import os
+import re
 import warnings
+import numpy as np
 import pandas as pd
+from src.data.datasets import DATASETS, MATCHED, raw_table_path
+from src.data.columnar import ChunkedTableWriter, iter_table_chunks, load_table, save_table, table_columns, table_exists
+from src.data.task_graph import Task, run_task_graph
+from src.data.locations import LOCATIONS
+from src.data.nan_masks import NanMask, NanMaskBuilder, load_nan_mask
 
 common_replacements = {
     "Ã¡": "á", "Ã­": "í", "Ãº": "ú",
@@ -8,104 +15,223 @@ common_replacements = {
     "Ã€": "À", "Ã©": "é", "Ã³": "ó", "Ã": "Í", "â": "'", "Ã": "ß", "": "'",
 }
 
-def clean_data(data_path, clean_load=False):
+# extracted tables of a dataset read by the cleaning and the cleaned tables it writes in the same folder
+RAW_TABLES = ["users", "ratings", "beers", "breweries"]
+CLEAN_TABLES = ["usa_users", "usa_ratings", "beers", "breweries"]
+
+# rough ratio between the in-memory size of a table and its size on disk, used to estimate the memory of the cleaning tasks
+MEMORY_FACTOR = {".parquet": 10, ".csv": 3}
+
+
+def clean_data(data_path, clean_load=False, chunksize=None, max_workers=None, memory_cap=None):
     """
-    Clean data for BeerAdvocate, RateBeer, and Matched datasets and generates the corresponding usa restriced dataset and saves them as .
+    Clean data for BeerAdvocate, RateBeer, and Matched datasets and generates the corresponding usa restriced dataset and saves them as .parquet
+    The tables of all datasets are cleaned concurrently on a process pool, only the ratings wait for the users of their dataset.
     
     Parameters:
     - raw_data_path: The root directory containing raw data folders.
     - clean_data_path: The root directory where cleaned data will be saved.
     - clean_load: If False, skips cleaning datasets if cleaned files already exist.
+    - chunksize: If given, ratings are cleaned in chunks of chunksize rows (see clean_dataset).
+    - max_workers: Number of processes, defaults to the number of cores.
+    - memory_cap: Maximum estimated memory (in bytes) of the tasks running at the same time, defaults to a share of the
+                  available memory (see run_task_graph).
     """
-    clean_dataset(data_path, 'BeerAdvocate', clean_load=clean_load,)
-    
-    clean_dataset(data_path, 'Ratebeer', clean_load=clean_load,)
-    
-    clean_dataset(data_path, 'Matched', clean_load=clean_load)
+    run_task_graph(cleaning_tasks(data_path, DATASETS, clean_load, chunksize),
+                   max_workers=max_workers, memory_cap=memory_cap)
+
+
+def raw_table_memory(data_path, dataset_name, table):
+    """
+    Estimates the memory needed to load a raw table (e.g. "ratings") of a dataset from its size on disk
+    """
+    table_path = raw_table_path(data_path, dataset_name, table)
+    for extension, factor in MEMORY_FACTOR.items():
+        if os.path.exists(table_path + extension):
+            return os.path.getsize(table_path + extension) * factor
+    return 0
+
 
-def clean_dataset(data_path, dataset_name, clean_load=False):
+def cleaning_tasks(data_path, dataset_names, clean_load=False, chunksize=None):
+    """
+    Builds the task graph cleaning the users, ratings, beers and breweries of each dataset.
+
+    Returns:
+        dict[str, Task]: tasks named "<dataset>/<table>", the ratings depend on the users of the same dataset
+    """
+    tasks = {}
+    for dataset_name in dataset_names:
+        users_memory = raw_table_memory(data_path, dataset_name, "users")
+        ratings_memory = raw_table_memory(data_path, dataset_name, "ratings")
+        if chunksize and dataset_name != MATCHED:
+            # the users ids and one chunk (about 1kB per raw row) are in memory at a time
+            ratings_memory = min(ratings_memory, users_memory + chunksize * 1024)
+        tasks[f"{dataset_name}/users"] = Task(clean_users, (data_path, dataset_name, clean_load), (), users_memory)
+        tasks[f"{dataset_name}/ratings"] = Task(clean_ratings_table, (data_path, dataset_name, clean_load, chunksize),
+                                                (f"{dataset_name}/users",), ratings_memory)
+        tasks[f"{dataset_name}/beers"] = Task(clean_beers, (data_path, dataset_name, clean_load), (),
+                                              raw_table_memory(data_path, dataset_name, "beers"))
+        tasks[f"{dataset_name}/breweries"] = Task(clean_breweries, (data_path, dataset_name, clean_load), (),
+                                                  raw_table_memory(data_path, dataset_name, "breweries"))
+    return tasks
+
+
+def clean_dataset(data_path, dataset_name, clean_load=False, chunksize=None):
     """
     Clean the BeerAdvocate data stored at raw_data_path and save it in the clean_data_path.
+
+    If chunksize is given, the ratings are read, filtered to US users, cleaned and appended to usa_ratings
+    chunksize rows at a time so the raw ratings never have to fit in memory. The Matched ratings are always
+    cleaned in one go since their column names are in their first row.
     """
+    clean_users(data_path, dataset_name, clean_load)
+    clean_ratings_table(data_path, dataset_name, clean_load, chunksize)
+    clean_beers(data_path, dataset_name, clean_load)
+    clean_breweries(data_path, dataset_name, clean_load)
 
-    full_data_path = os.path.join(data_path, dataset_name)
 
-    # Ensure the clean data folder exists
+def clean_users(data_path, dataset_name, clean_load=False):
+    full_data_path = os.path.join(data_path, dataset_name)
     os.makedirs(full_data_path, exist_ok=True)
 
-    # Clean users
-    usa_users_path = os.path.join(full_data_path, "usa_users.csv")
-    if clean_load or not os.path.exists(usa_users_path):
-        users = pd.read_csv(os.path.join(full_data_path, dataset_name + "_users.csv"), low_memory=False)
-        if dataset_name == 'Matched': 
+    usa_users_path = os.path.join(full_data_path, "usa_users")
+    if clean_load or not table_exists(usa_users_path):
+        users = load_table(raw_table_path(data_path, dataset_name, "users"))
+        if dataset_name == MATCHED: 
             users = matched_data_common_clean(users)
         us_users = filter_only_americans(users.dropna(subset=["user_name", "location"]))
-        extract_nans_as_columns_df(us_users, numerical_columns(us_users), replace_value=0)
-        extract_nans_as_columns_df(us_users, string_columns(us_users), replace_value="")
-        us_users.to_csv(usa_users_path, index=False)
-        del users, us_users
-
-    # Clean ratings
-    usa_ratings_path = os.path.join(full_data_path, "usa_ratings.csv")
-    if clean_load or not os.path.exists(usa_ratings_path):
-        ratings = pd.read_csv(os.path.join(full_data_path, dataset_name + "_ratings.csv"), low_memory=False)
-        if dataset_name == 'Matched': 
+        is_nan = extract_nan_mask(us_users)
+        save_clean_table(us_users, usa_users_path, "users", is_nan)
+
+
+def clean_new_users(data_path, dataset_name, user_ids):
+    """
+    Cleans the raw users of user_ids that are not in the US users table yet and appends the US ones to it (with their
+    nans added to the nan mask), so new ratings do not need every user to be cleaned again (see clean_users).
+
+    Returns:
+        pd.DataFrame: the US users table
+    """
+    full_data_path = os.path.join(data_path, dataset_name)
+    usa_users_path = os.path.join(full_data_path, "usa_users")
+    if dataset_name == MATCHED or not table_exists(usa_users_path):
+        clean_users(data_path, dataset_name, clean_load=True)
+        return load_table(usa_users_path, schema="users")
+
+    us_users = load_table(usa_users_path, schema="users")
+    new_ids = pd.unique(pd.Series(user_ids)[~pd.Series(user_ids).isin(us_users["user_id"])].dropna())
+    if not len(new_ids):
+        return us_users
+    users = load_table(raw_table_path(data_path, dataset_name, "users"))
+    new_users = filter_only_americans(users[users["user_id"].isin(new_ids)].dropna(subset=["user_name", "location"]))
+    if not len(new_users):
+        return us_users
+
+    nan_mask = NanMaskBuilder()
+    old_mask = load_nan_mask(usa_users_path)
+    nan_mask.append({} if old_mask is None else {column: old_mask[column] for column in old_mask.columns}, len(us_users))
+    nan_mask.append(extract_nan_mask(new_users), len(new_users))
+    us_users = pd.concat([us_users, new_users[us_users.columns]], ignore_index=True)
+    save_table(us_users, usa_users_path, schema="users")
+    nan_mask.finish().save(usa_users_path)
+    return load_table(usa_users_path, schema="users")
+
+
+def clean_ratings_table(data_path, dataset_name, clean_load=False, chunksize=None):
+    """
+    Cleans the ratings of a dataset, the US users have to be cleaned first (see clean_dataset for chunksize).
+    """
+    full_data_path = os.path.join(data_path, dataset_name)
+    os.makedirs(full_data_path, exist_ok=True)
+
+    usa_ratings_path = os.path.join(full_data_path, "usa_ratings")
+    if clean_load or not table_exists(usa_ratings_path):
+        ratings_path = raw_table_path(data_path, dataset_name, "ratings")
+        us_users = load_table(os.path.join(full_data_path, "usa_users"), columns=["user_id"])
+        if chunksize and dataset_name != MATCHED:
+            clean_ratings_chunked(ratings_path, usa_ratings_path, us_users, chunksize)
+            return
+        ratings = load_table(ratings_path)
+        if dataset_name == MATCHED: 
             ratings = matched_data_common_clean(ratings)
-            ratings.drop(columns=["ba_text", "ba_review", "ba_text_nan", "rb_text"], inplace=True)
+            ratings.drop(columns=["ba_text", "ba_review", "rb_text"], inplace=True)
         ratings.drop(columns=["text", "review"], inplace=True)
-        ratings = ratings.dropna(subset=["user_id", "beer_id"])
-        ratings = clean_ratings(ratings)
-        us_ratings = filter_by_users(ratings, pd.read_csv(usa_users_path))
-        us_ratings.to_csv(usa_ratings_path, index=False)
-        del ratings, us_ratings
-
-    # Clean beers
-    beers_path = os.path.join(full_data_path, "beers.csv")
-    if clean_load or not os.path.exists(beers_path):
-        beer = pd.read_csv(os.path.join(full_data_path, dataset_name + "_beers.csv"), low_memory=False)
-        if dataset_name == 'Matched': 
+        # only keep US reviews first so the cleaning is not done on rows that are thrown away
+        us_ratings = filter_by_users(ratings, us_users).dropna(subset=["user_id", "beer_id"])
+        del ratings
+        us_ratings, is_nan = clean_ratings(us_ratings)
+        save_clean_table(us_ratings, usa_ratings_path, "ratings", is_nan)
+
+
+def clean_beers(data_path, dataset_name, clean_load=False):
+    full_data_path = os.path.join(data_path, dataset_name)
+    os.makedirs(full_data_path, exist_ok=True)
+
+    beers_path = os.path.join(full_data_path, "beers")
+    if clean_load or not table_exists(beers_path):
+        beer = load_table(raw_table_path(data_path, dataset_name, "beers"))
+        if dataset_name == MATCHED: 
             beer = matched_data_common_clean(beer)
-        extract_nans_as_columns_df(beer, numerical_columns(beer), replace_value=0)
-        extract_nans_as_columns_df(beer, string_columns(beer), replace_value="")
+        is_nan = extract_nan_mask(beer)
         beer = replace_common_enc_errors(beer)
-        beer.to_csv(beers_path, index=False)
-        del beer
-
-    # Clean breweries
-    breweries_path = os.path.join(full_data_path, "breweries.csv")
-    if clean_load or not os.path.exists(breweries_path):
-        brewery = pd.read_csv(os.path.join(full_data_path, dataset_name + "_breweries.csv"))
-        if dataset_name == 'Matched': 
+        save_clean_table(beer, beers_path, "beers", is_nan)
+
+
+def clean_breweries(data_path, dataset_name, clean_load=False):
+    full_data_path = os.path.join(data_path, dataset_name)
+    os.makedirs(full_data_path, exist_ok=True)
+
+    breweries_path = os.path.join(full_data_path, "breweries")
+    if clean_load or not table_exists(breweries_path):
+        brewery = load_table(raw_table_path(data_path, dataset_name, "breweries"))
+        is_nan = {}
+        if dataset_name == MATCHED: 
             brewery = matched_data_common_clean(brewery)
+            is_nan = extract_nan_mask(brewery)
         remove_links(brewery)
-        brewery.to_csv(breweries_path, index=False)
-        del brewery
+        save_clean_table(brewery, breweries_path, "breweries", is_nan)
+
+
+# single pass over a string for all the common_replacements (no key is a prefix of another)
+common_replacements_pattern = re.compile("|".join(re.escape(key) for key in common_replacements))
 
 
 def replace_common_chars(string):
-    for key, value in common_replacements.items():
-        string = string.replace(key, value)
-    return string
+    return common_replacements_pattern.sub(lambda match: common_replacements[match.group(0)], string)
+
+
+def map_unique_values(column, func):
+    """
+    Applies func once per unique value of the column instead of once per row, nans are kept as nans.
+    Most string columns (styles, names, locations) repeat the same values many times.
+    """
+    codes, uniques = pd.factorize(column)
+    # nans have the code -1, which takes the nan appended at the end
+    repaired = np.array([func(value) for value in uniques] + [np.nan], dtype=object)
+    return pd.Series(repaired.take(codes), index=column.index, name=column.name)
 
 
 def replace_common_enc_errors(df):
     for column in string_columns(df):
-        df[column] = df[column].apply(replace_common_chars)
+        df[column] = map_unique_values(df[column], replace_common_chars)
     return df
 
 
+def decode_unicode_escapes(string):
+    return replace_common_chars(string.encode().decode('unicode_escape').encode('latin1').decode('utf-8'))
+
+
 def decode_string(column):
     """
     Decodes a column with weird characters like \x92\x09, they converted
     are utf-8 equivalent for readability, it is not perfect but most common
     characters are converted
     """
-    return column[~column.isna()].apply(
-        lambda x: replace_common_chars(x.encode().decode('unicode_escape').encode('latin1').decode('utf-8')))
+    return map_unique_values(column, decode_unicode_escapes)
 
 
 def get_us_states(df):
-    return df[df["location"].str.contains(",")]["location"].unique()
+    return df["location"][LOCATIONS.is_us(LOCATIONS.encode(df["location"]))].unique()
 
 
 def filter_by_locations(df, locations):
@@ -117,44 +243,88 @@ def filter_by_state(df, state):
 
 
 def filter_only_americans(df):
-    return filter_by_locations(df, get_us_states(df))
+    return df[LOCATIONS.is_us(LOCATIONS.encode(df["location"]))]
 
 
 def filter_by_users(df, users):
     return df[df["user_id"].isin(users["user_id"])]
 
 def remove_links(df):
-    for index, column in df.iterrows():
-        if "<" in df["location"][index]:
-            df["location"][index] = df["location"][index].split("<")[0]
+    for column in df.columns:
+        if column == "location" or column.endswith("_location"):
+            df[column] = LOCATIONS.normalize(df[column], "clean")
 
 
-def extract_nan_as_column(df, column_name, replace_value=0):
+def extract_nan_as_column(df, column_name, replace_value=0, keep_empty=False):
     """
     If a column has nans it extracts them from the column and creates a new column with the same name and '_nan' appended. Nan values are replaced by the replace_value and the new column has 1 where the original column had nan.
+    If keep_empty is True the '_nan' column is created even if the column has no nans (so that chunks of a table all have the same columns).
 
     For logistic regression, this is useful to let the model decide how best to replace nan values
     """
-    if df[column_name].isna().sum() == 0:
+    is_nan = df[column_name].isna()
+    if not keep_empty and not is_nan.any():
         return
     nan_column_name = f"{column_name}_nan"
-    is_nan = df[column_name].isna()
     df.loc[is_nan, column_name] = replace_value
     # df[column_name][is_nan] = replace_value
     df[nan_column_name] = is_nan.astype(int)
 
 
+def fill_nans(df, column_names, replace_value=0):
+    """
+    Replaces the nans of the columns by replace_value.
+
+    Returns:
+        dict[str, np.ndarray]: for each column, a boolean array with True where the column had a nan
+    """
+    is_nan = {}
+    for column in column_names:
+        is_nan[column] = df[column].isna().to_numpy()
+        if is_nan[column].any():
+            df.loc[is_nan[column], column] = replace_value
+    return is_nan
+
+
+def extract_nan_mask(df):
+    """
+    Replaces the nans of the numerical columns by 0 and of the string columns by "" and returns where they were
+    (to build a NanMask), instead of adding a '_nan' column per column like extract_nans_as_columns_df.
+    """
+    is_nan = fill_nans(df, numerical_columns(df), replace_value=0)
+    is_nan.update(fill_nans(df, string_columns(df), replace_value=""))
+    return is_nan
+
+
+def save_clean_table(df, path, schema, is_nan=None):
+    """
+    Saves a cleaned table and, next to it, the bit-packed mask of the nans that were replaced (see nan_masks).
+    The mask is always written so an older mask of the table is never left behind.
+    """
+    save_table(df, path, schema=schema)
+    NanMask.from_columns(is_nan or {}, len(df)).save(path)
+
+
+def is_index_column(column):
+    """
+    True for the "Unnamed: 0" column of the row numbers written by to_csv (raw .csv tables extracted before
+    the tables were saved as .parquet have it, .parquet tables do not)
+    """
+    return str(column).lower().startswith("unnamed:")
+
+
 def numerical_columns(df):
-    return df.dtypes[df.dtypes != "object"].index[1:]
+    columns = df.dtypes[df.dtypes != "object"].index
+    return columns[~columns.str.endswith("_nan") & ~columns.map(is_index_column).to_numpy(dtype=bool)]
 
 
 def string_columns(df):
     return df.dtypes[df.dtypes == "object"].index
 
 
-def extract_nans_as_columns_df(df, column_names, replace_value=0):
+def extract_nans_as_columns_df(df, column_names, replace_value=0, keep_empty=False):
     for column in column_names:
-        extract_nan_as_column(df, column, replace_value=replace_value)
+        extract_nan_as_column(df, column, replace_value=replace_value, keep_empty=keep_empty)
 
 
 def clean_df(df, clean_nan_func, clean_chars_func):
@@ -176,13 +346,39 @@ def extract_nans(df):
 
 def clean_ratings(df):
     """
-    Cleans a dataframe by cleaning all string columns and extracting nans as columns for columns with nans
+    Cleans a dataframe by cleaning all string columns and replacing their nans.
+
+    Returns:
+        tuple: the cleaned dataframe and the dict column -> boolean array of the replaced nans (see extract_nan_mask)
     """
     for column in string_columns(df):
         df[column] = decode_string(df[column])
-    extract_nans_as_columns_df(df, string_columns(df), replace_value="")
-    extract_nans_as_columns_df(df, numerical_columns(df), replace_value=0)
-    return df
+    is_nan = fill_nans(df, string_columns(df), replace_value="")
+    is_nan.update(fill_nans(df, numerical_columns(df), replace_value=0))
+    return df, is_nan
+
+
+def clean_ratings_chunked(ratings_path, usa_ratings_path, us_users, chunksize):
+    """
+    Cleans the ratings chunksize rows at a time and appends the US ones to usa_ratings, memory usage is bounded by the chunk size.
+    The text columns are never read and every chunk is filtered to US users before being cleaned.
+
+    Args:
+        - ratings_path (str): path of the raw ratings table
+        - usa_ratings_path (str): path of the cleaned table to write
+        - us_users (pd.DataFrame): dataframe with the user_id of the US users
+        - chunksize (int): number of raw rows read at once
+    """
+    columns = [column for column in table_columns(ratings_path) if column not in ("text", "review")]
+    nan_mask = NanMaskBuilder()
+    # same dtypes and categories as the ratings saved in one go by save_clean_table
+    with ChunkedTableWriter(usa_ratings_path, schema="ratings") as writer:
+        for chunk in iter_table_chunks(ratings_path, chunksize, columns=columns):
+            chunk = filter_by_users(chunk, us_users).dropna(subset=["user_id", "beer_id"])
+            chunk, is_nan = clean_ratings(chunk)
+            writer.write(chunk)
+            nan_mask.append(is_nan, len(chunk))
+    nan_mask.finish().save(usa_ratings_path)
 
 def matched_data_common_clean(df):
     """
@@ -190,19 +386,18 @@ def matched_data_common_clean(df):
     - Replace column names with right ones (e.g. 'ba_1' -> 'ba_user_id')
     - Delete the first row as it contains the column names in the original dataset
     - Convert columns to numeric if possible
-    - Extract nans as columns for numerical columns
+
+    The nans are extracted by the caller, once the rows of the table are filtered, so the nan mask matches the saved rows.
     """
     # Since the first row is the name of the columns, we drop it and change the column names to lowercase
     df.columns = df.columns.str.lower()
     first_rows = df.iloc[0]
     # Rename columns so we can remove the first row
-    df.columns = [column if i == 0 else f"{column.split('.')[0]}_{first_rows[column]}" for i, column in
-                  enumerate(df.columns)]
+    df.columns = [column if is_index_column(column) else f"{column.split('.')[0]}_{first_rows[column]}"
+                  for column in df.columns]
     df = df.iloc[1:]
     # ignore warnings when converting to numeric
     warnings.filterwarnings("ignore")
     df = df.apply(pd.to_numeric, errors='ignore')
     warnings.resetwarnings()
-    extract_nans_as_columns_df(df, numerical_columns(df), replace_value=0)
-    extract_nans_as_columns_df(df, string_columns(df), replace_value="")
     return df
\ No newline at end of file
@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+from src.data.schemas import union_categories
 
 def remove_txt_columns(data_ba, data_rb, data_matched):
     """
@@ -40,9 +42,50 @@ def get_mutliIndex_sub_df(df, income_index,  years):
     idx = pd.IndexSlice
     return df.loc[idx[:, years], income_index]
 
+def factorize_together(*columns):
+    """
+    Factorizes columns together so that equal values get the same integer code in all of them (-1 for nan).
+    Ids stored as int in one table and float in the other get the same code, no cast to str is needed.
+
+    Returns:
+        tuple: the codes of each column (np.ndarray) followed by the number of distinct values
+    """
+    lengths = [len(column) for column in columns]
+    codes, uniques = pd.factorize(np.concatenate([np.asarray(column) for column in columns]))
+    return (*np.split(codes, np.cumsum(lengths)[:-1]), len(uniques))
+
+
+def not_in_mask(keys, excluded_keys):
+    """
+    Anti-join on integer keys: returns a boolean mask of the keys that are not in excluded_keys (missing keys, -1, are kept)
+    """
+    excluded_keys = excluded_keys[excluded_keys >= 0]
+    return ~np.isin(keys, excluded_keys) | (keys < 0)
+
+
+def pack_keys(first_codes, second_codes, n_second):
+    """
+    Packs two integer codes into a single int64 key, -1 if one of the codes is missing
+    """
+    keys = first_codes.astype(np.int64) * n_second + second_codes
+    keys[(first_codes < 0) | (second_codes < 0)] = -1
+    return keys
+
+
+def concat_rows(frames):
+    """
+    Concatenates the rows of frames (with unified categories, see union_categories). Empty frames are left out so they
+    do not change the dtypes of the result, their columns are still in it.
+    """
+    columns = list(dict.fromkeys(column for df in frames for column in df.columns))
+    non_empty = [df for df in frames if len(df)] or frames[:1]
+    merged = pd.concat(union_categories(non_empty), axis=0, ignore_index=True)
+    return merged if list(merged.columns) == columns else merged.reindex(columns=columns)
+
 def merge_reviews(data_ba, data_rb, data_matched):
     """
     Merge the BeerAdvocate and RateBeer dataframes by removing the matched data from RateBeer data so reviews do not appear twice
+    The matched reviews are removed with an anti-join on packed (beer_id, user_id) integer keys.
     Inputs:
         - data_ba: dataframe with BeerAdvocate data
         - data_rb: dataframe with RateBeer data
@@ -50,22 +93,35 @@ def merge_reviews(data_ba, data_rb, data_matched):
     Outputs:
         - beer_data: conbined dataframes without double reviews
     """
-    data_matched_renamed = data_matched[['rb_beer_id', 'rb_user_id']].rename(columns={
-    'rb_beer_id': 'beer_id',
-    'rb_user_id': 'user_id'
-    })
-    data_rb['beer_id'] = data_rb['beer_id'].astype(int)
-    data_rb['user_id'] = data_rb['user_id'].astype(str)
-    data_matched_renamed['beer_id'] = data_matched_renamed['beer_id'].astype(int)
-    data_matched_renamed['user_id'] = data_matched_renamed['user_id'].astype(str)
-    data_rb = data_rb.merge(data_matched_renamed, on=['beer_id', 'user_id'], how='left', indicator=True)
-    data_rb = data_rb[data_rb['_merge'] == 'left_only']
-    beer_data = pd.concat([data_ba, data_rb], axis=0, ignore_index=True)
+    rb_beers, matched_beers, _ = factorize_together(data_rb['beer_id'], data_matched['rb_beer_id'])
+    rb_users, matched_users, n_users = factorize_together(data_rb['user_id'], data_matched['rb_user_id'])
+    keep = not_in_mask(pack_keys(rb_beers, rb_users, n_users), pack_keys(matched_beers, matched_users, n_users))
+    beer_data = concat_rows([data_ba, data_rb[keep]])
     return beer_data
 
 def merge_breweries(breweries_ba, breweries_rb, breweries_matched):
-    breweries_matched_renamed = breweries_matched[['rb_id']].rename(columns={'rb_id': 'brewery_id'})
-    breweries_rb = breweries_rb.merge(breweries_matched_renamed, on='brewery_id', how='left', indicator=True)
-    breweries_rb = breweries_rb[breweries_rb['_merge'] == 'left_only'].drop(columns='_merge')
-    breweries = pd.concat([breweries_ba, breweries_rb], axis=0, ignore_index=True)
-    return breweries
\ No newline at end of file
+    keep = not_in_mask(*factorize_together(breweries_rb['brewery_id'], breweries_matched['rb_id'])[:2])
+    breweries = concat_rows([breweries_ba, breweries_rb[keep]])
+    return breweries
+
+
+def dense_lookup(keys, codes, query):
+    """
+    Looks up integer keys in a dense array indexed by key instead of joining, e.g. brewery_id -> state code.
+
+    Args:
+        - keys (np.ndarray): unique non-negative integer keys
+        - codes (np.ndarray): integer code of each key
+        - query (np.ndarray): keys to look up (may be float with nans)
+
+    Returns:
+        np.ndarray: the code of each queried key, -1 if the key is unknown
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    query = np.asarray(query)
+    table = np.full(keys.max() + 1 if len(keys) else 0, -1, dtype=np.int64)
+    table[keys] = codes
+    found = (query >= 0) & (query < len(table))
+    result = np.full(len(query), -1, dtype=np.int64)
+    result[found] = table[query[found].astype(np.int64)]
+    return result
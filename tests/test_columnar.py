@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from src.data.columnar import ChunkedTableWriter, load_table, save_table, table_columns
+from src.data.wrangling import matched_data_common_clean, numerical_columns
+
+
+def test_save_and_load_table_round_trip(tmp_path):
+    df = pd.DataFrame({"beer_id": [3, 1, 2], "style": ["IPA", "Stout", None], "abv": [5.0, np.nan, 7.5]})
+    save_table(df, str(tmp_path / "beers"))
+    pd.testing.assert_frame_equal(load_table(str(tmp_path / "beers")), df)
+    assert table_columns(str(tmp_path / "beers")) == ["beer_id", "style", "abv"]
+    pd.testing.assert_frame_equal(load_table(str(tmp_path / "beers"), columns=["abv"]), df[["abv"]])
+
+
+def test_csv_is_converted_once_with_its_index_column(tmp_path):
+    # raw tables extracted as .csv by the baseline have the "Unnamed: 0" row numbers
+    df = pd.DataFrame({"beer_id": [1, 2], "abv": [5.0, 6.0]})
+    df.to_csv(tmp_path / "beers.csv")
+    loaded = load_table(str(tmp_path / "beers"))
+    assert list(loaded.columns) == ["Unnamed: 0", "beer_id", "abv"]
+    assert (tmp_path / "beers.parquet").exists()
+
+
+def test_numerical_columns_with_and_without_index_column():
+    df = pd.DataFrame({"beer_id": [1, 2], "abv": [5.0, np.nan], "abv_nan": [0, 1], "style": ["a", "b"]})
+    assert list(numerical_columns(df)) == ["beer_id", "abv"]
+    # same columns as the baseline (which skipped the first column) on a table read from a baseline .csv
+    assert list(numerical_columns(df.assign(**{"Unnamed: 0": [0, 1]})[["Unnamed: 0", *df.columns]])) == ["beer_id", "abv"]
+
+
+def test_matched_data_common_clean_renames_every_data_column():
+    raw = pd.DataFrame({"ba": ["abv", "5.0"], "ba.1": ["beer_name", "x"], "rb": ["abv", "4.5"]})
+    assert list(matched_data_common_clean(raw.copy()).columns) == ["ba_abv", "ba_beer_name", "rb_abv"]
+
+    with_index = raw.copy()
+    with_index.insert(0, "Unnamed: 0", [0, 1])
+    cleaned = matched_data_common_clean(with_index)
+    assert list(cleaned.columns) == ["unnamed: 0", "ba_abv", "ba_beer_name", "rb_abv"]
+    assert cleaned["ba_abv"].tolist() == [5.0]
+
+
+def test_chunked_writer_appends_chunks(tmp_path):
+    chunks = [pd.DataFrame({"user_id": [1, 2], "style": [None, None]}), pd.DataFrame({"user_id": [3], "style": ["IPA"]})]
+    with ChunkedTableWriter(str(tmp_path / "ratings")) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    loaded = load_table(str(tmp_path / "ratings"))
+    assert loaded["user_id"].tolist() == [1, 2, 3]
+    assert loaded["style"].tolist() == [None, None, "IPA"]
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+from src.data.distance_sketches import DistanceSketches, load_distance_sketches
+from src.data.time_buckets import add_time_buckets
+
+
+def make_reviews(n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    reviews = pd.DataFrame({
+        "date": rng.integers(1_200_000_000, 1_230_000_000, n),
+        "user_state": rng.choice(["California", "Oregon", "Texas"], n),
+        "distance": np.where(rng.random(n) < 0.2, 0.0, rng.lognormal(6, 1, n)).astype(np.float32),
+    })
+    reviews.loc[::50, "distance"] = np.nan
+    return add_time_buckets(reviews)
+
+
+def test_sketches_match_exact_aggregates():
+    reviews = make_reviews()
+    sketches = DistanceSketches.from_reviews(reviews)
+    known = reviews.dropna(subset=["distance"])
+    months = pd.PeriodIndex(known["date"].dt.to_period("M"), name="month")
+    grouped = known["distance"].astype(np.float64).groupby([months, known["user_state"]])
+
+    counts = sketches.count(["month", "user_state"])
+    assert counts.tolist() == grouped.size().tolist()
+    np.testing.assert_allclose(sketches.mean(["month", "user_state"]), grouped.mean(), rtol=1e-6)
+    np.testing.assert_allclose(sketches.median("user_state"), known.groupby("user_state")["distance"].median(), rtol=0.05)
+    np.testing.assert_allclose(sketches.quantile(0.9), known["distance"].quantile(0.9), rtol=0.05)
+    assert sketches.count() == len(known)
+
+
+def test_merged_sketches_equal_the_sketches_of_all_reviews(tmp_path):
+    reviews = make_reviews()
+    first, second = reviews.iloc[:1500], reviews.iloc[1500:]
+    merged = DistanceSketches.from_reviews(first).merge(DistanceSketches.from_reviews(second))
+    whole = DistanceSketches.from_reviews(reviews)
+    pd.testing.assert_frame_equal(merged.keys, whole.keys)
+    np.testing.assert_array_equal(merged.counts, whole.counts)
+    np.testing.assert_allclose(merged.sums, whole.sums, rtol=1e-9)
+
+    merged.save(tmp_path / "sketches.npz")
+    loaded = load_distance_sketches(tmp_path / "sketches.npz")
+    np.testing.assert_array_equal(loaded.counts, merged.counts)
+    assert loaded.keys["user_state"].tolist() == merged.keys["user_state"].tolist()
+
+
+def test_reviews_without_user_state_are_ignored():
+    reviews = make_reviews(n=500)
+    reviews.loc[::7, "user_state"] = None
+    sketches = DistanceSketches.from_reviews(reviews)
+    known = reviews.dropna(subset=["distance", "user_state"])
+    assert sketches.count() == len(known)
+    assert sketches.count("user_state").tolist() == known.groupby("user_state").size().tolist()
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from src.data.distances import (DistanceMatrix, attach_distances, compute_distance, convert_dict_to_table, distance_matrix,
+                                get_locations_coordinates, load_distance_matrix)
+from src.data.gazetteer import load_gazetteer
+
+
+def test_gazetteer_coordinates_have_the_baseline_keys():
+    users = pd.DataFrame({"location": ["United States, Washington", "United States, Oregon", "United States, Oregon"]})
+    breweries = pd.DataFrame({"location": ["Canada, Ontario", "England", 'Germany<a href="x">Germany</a>', None]})
+    coordinates = get_locations_coordinates([users, breweries])
+    # the baseline also keyed the US states and Canadian provinces without their country, and added the countries
+    for key in ["United States, Oregon", "Oregon", "Canada, Ontario", "Ontario", "England", "Canada", "United Kingdom",
+                "United States", 'Germany<a href="x">Germany</a>']:
+        assert key in coordinates
+    # the baseline replaced Washington (geocoded as Washington DC) by Seattle, the state is now found directly
+    washington = coordinates["Washington"]
+    assert 46 < washington.latitude < 49 and -124 < washington.longitude < -117
+    assert coordinates['Germany<a href="x">Germany</a>'] == load_gazetteer().find("Germany", ["country"])
+
+
+def make_coordinates():
+    gazetteer = load_gazetteer()
+    return {location: gazetteer.locate(location)
+            for location in ["United States, Oregon", "United States, Maine", "Canada, Quebec", "Belgium", "Japan", "Australia"]}
+
+
+def test_distance_matrix_matches_baseline_geodesic():
+    coordinates = make_coordinates()
+    locations, matrix = distance_matrix(coordinates, ellipsoidal=True)
+    assert locations == list(coordinates)
+    # the baseline computed each pair with geopy's geodesic
+    expected = np.array([[compute_distance(coordinates[first], coordinates[second]) for second in locations]
+                         for first in locations])
+    np.testing.assert_allclose(matrix, expected, atol=0.5)
+    _, spherical = distance_matrix(coordinates)
+    np.testing.assert_allclose(spherical, expected, rtol=0.01)
+
+
+def test_matrix_lookup_matches_baseline_distances_csv(tmp_path):
+    coordinates = make_coordinates()
+    reviews = pd.DataFrame({
+        "user_state": ["United States, Oregon", "United States, Maine", "United States, Oregon", "Atlantis"],
+        "brewery_state": ["Belgium", "Canada, Quebec", "United States, Oregon", "Japan"],
+    }).astype("category")
+    # the baseline stored the distance of each pair of the reviews in distances.csv, keyed by the pair as a string
+    pairs = {}
+    for user_state, brewery_state in zip(reviews["user_state"][:3], reviews["brewery_state"][:3]):
+        pairs[user_state, brewery_state] = pairs[brewery_state, user_state] = compute_distance(
+            coordinates[user_state], coordinates[brewery_state])
+    pd.DataFrame.from_dict(pairs, orient="index").rename(columns={0: "distance"}).reset_index().to_csv(
+        tmp_path / "distances.csv", index=False)
+    baseline = pd.read_csv(tmp_path / "distances.csv").set_index("index").to_dict("index")
+    baseline_table = convert_dict_to_table(baseline)
+
+    DistanceMatrix(*distance_matrix(coordinates, ellipsoidal=True)).save(tmp_path / "distances.npz")
+    distances = load_distance_matrix(tmp_path / "distances.npz")
+    merged = attach_distances(reviews, distances)
+    expected = [baseline_table.loc[user_state, brewery_state]
+                for user_state, brewery_state in zip(reviews["user_state"][:3], reviews["brewery_state"][:3])]
+    np.testing.assert_allclose(merged["distance"][:3], expected, atol=0.5)
+    # unknown locations have no distance instead of raising a KeyError
+    assert np.isnan(merged["distance"].iloc[3])
+    assert merged["distance"].dtype == np.float32
+    # the matrix can also be read like a nested dict
+    np.testing.assert_allclose([distances[user][brewery] for user, brewery in zip(reviews["user_state"][:3], reviews["brewery_state"][:3])],
+                               expected, atol=0.5)
+    assert "Belgium" in distances and "Atlantis" not in distances
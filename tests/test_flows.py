@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from src.data.flows import flow_matrix, monthly_flow_matrix
+from src.data.state_counts import get_monthly_counts_usa, get_state_adjacency_matrix
+from src.data.time_buckets import add_time_buckets
+
+STATES = ["California", "Oregon", "Texas"]
+
+
+def make_reviews():
+    reviews = pd.DataFrame({
+        "date": pd.to_datetime(["2010-11-15 00:00:00", "2010-11-20 00:00:00", "2010-12-31 23:00:00",
+                                "2010-12-01 00:00:00", "2011-01-02 00:00:00", "2010-12-05 00:00:00"]),
+        "user_state": ["California", "California", "Oregon", "Oregon", "Texas", "Germany"],
+        "brewery_state": ["California", "Oregon", "Belgium", "Oregon", "Canada, Ontario", "California"],
+    })
+    reviews["date"] = reviews["date"].astype("int64") // 10**9
+    return add_time_buckets(reviews)
+
+
+def test_flow_matrix_matches_the_adjacency_matrix():
+    reviews = make_reviews()
+    flows = flow_matrix(reviews, STATES)
+    assert list(flows.locations) == STATES + ["Belgium", "Canada, Ontario"]
+    pd.testing.assert_frame_equal(flows.to_frame(world=True),
+                                  get_state_adjacency_matrix(reviews, STATES, as_ratio=False, drop_world=False),
+                                  check_dtype=False)
+    assert flows.foreign_by_country().to_frame().loc["Texas"].to_dict() == {"Belgium": 0, "Canada": 1}
+
+
+def test_uk_countries_are_summed_into_the_united_kingdom():
+    reviews = pd.DataFrame({
+        "user_state": ["Oregon", "Oregon", "Oregon", "Texas", "Texas"],
+        "brewery_state": ["England", "Scotland", "United Kingdom, Wales", "Northern Ireland", "Ontario"],
+    })
+    by_country = flow_matrix(reviews, STATES).foreign_by_country().to_frame()
+    assert by_country.loc["Oregon"].to_dict() == {"Canada": 0, "United Kingdom": 3}
+    assert by_country.loc["Texas"].to_dict() == {"Canada": 1, "United Kingdom": 1}
+
+
+def test_monthly_flows_keep_the_whole_last_month():
+    reviews = make_reviews()
+    flows = monthly_flow_matrix(reviews, STATES, start_month="2010-11", end_month="2010-12")
+    assert flows.index.get_level_values("date").unique().astype(str).tolist() == ["2010-11", "2010-12"]
+    assert flows.to_frame().loc[(pd.Period("2010-12", "M"), "Oregon"), "Belgium"] == 1
+    pd.testing.assert_frame_equal(flows.totals_by_date(as_ratio=False),
+                                  get_monthly_counts_usa(reviews, STATES, start_month="2010-11", end_month="2010-12",
+                                                         as_ratio=False),
+                                  check_dtype=False)
+    cumulative = monthly_flow_matrix(reviews, STATES, cumulative=True)
+    assert np.asarray(cumulative.matrix.sum(axis=1)).ravel().tolist() == [2, 0, 0, 2, 2, 0, 2, 2, 1]
@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from src.data.geocoding import Geocoder, GeocodingCache, NominatimBackend
+
+
+class StandInServer:
+    """
+    Nominatim stand-in on localhost: "Nowhere" is not found, "Boom" fails, every other query is found
+    """
+
+    def __init__(self, delay=0.1):
+        self.queries, self.starts = [], []
+        self.in_flight = self.max_in_flight = 0
+        lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)["q"][0]
+                with lock:
+                    server.queries.append(query)
+                    server.starts.append(time.monotonic())
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                time.sleep(delay)
+                with lock:
+                    server.in_flight -= 1
+                if query.startswith("Boom"):
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                results = [] if query.startswith("Nowhere") else [{"lat": "1.5", "lon": "2.5", "display_name": query}]
+                body = json.dumps(results).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/search"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+def test_geocoder_limits_requests_and_caches_results(server, tmp_path):
+    cache_path = str(tmp_path / "geocoding.sqlite")
+    locations = ["United States, Maine, Portland", "Nowhere", "Boom", "Germany", "Belgium", "England", "Nowhere", None]
+    geocoder = Geocoder(NominatimBackend(server.url), cache_path, concurrency=2, rate=20)
+
+    places = geocoder.geocode(locations)
+    assert sorted(places) == ["Belgium", "England", "Germany", "United States, Maine, Portland"]
+    assert places["United States, Maine, Portland"].name == "Portland, Maine, United States"
+    # each distinct location is queried once, at most 2 at a time and 1 / 20 s apart
+    assert len(server.queries) == 6
+    assert server.max_in_flight == 2
+    gaps = [later - earlier for earlier, later in zip(server.starts, server.starts[1:])]
+    assert min(gaps) >= 0.04
+
+    # found, not found and failed locations are all read from the cache, also by a new geocoder
+    assert Geocoder(NominatimBackend(server.url), cache_path).geocode(locations) == places
+    assert len(server.queries) == 6
+
+    retrying = Geocoder(NominatimBackend(server.url), cache_path, retry_errors=True, rate=None)
+    assert retrying.geocode(locations) == places
+    assert server.queries[6:] == ["Boom"]
+
+
+class CheckingBackend:
+    """
+    Backend checking that the locations queried before are already in the cache, "Boom" gets an invalid latitude
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.queries = []
+
+    def geocode(self, query):
+        assert sorted(GeocodingCache(self.cache_path).get(self.queries)) == sorted(self.queries)
+        self.queries.append(query)
+        return (query, 1.0, 2.0) if query != "Boom" else (query, "not a latitude", 2.0)
+
+
+def test_results_are_cached_as_they_complete(tmp_path, monkeypatch):
+    cache_path = str(tmp_path / "geocoding.sqlite")
+    backend = CheckingBackend(cache_path)
+    locations = ["Germany", "Belgium", "Boom", "France", "Spain"]
+    assert sorted(Geocoder(backend, cache_path, concurrency=1, rate=None).geocode(locations)) == ["Belgium", "France",
+                                                                                                 "Germany", "Spain"]
+
+    put = GeocodingCache.put
+
+    def failing_put(self, results):
+        if "Spain" in results:
+            raise RuntimeError("disk full")
+        put(self, results)
+
+    monkeypatch.setattr(GeocodingCache, "put", failing_put)
+    new_cache_path = str(tmp_path / "new.sqlite")
+    with pytest.raises(RuntimeError, match="disk full"):
+        Geocoder(CheckingBackend(new_cache_path), new_cache_path, concurrency=1, rate=None).geocode(locations)
+    # the other locations were cached despite the failure
+    assert sorted(GeocodingCache(new_cache_path).get(locations)) == ["Belgium", "Boom", "France", "Germany"]
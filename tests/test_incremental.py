@@ -0,0 +1,42 @@
+import os
+import pandas as pd
+from src.data.columnar import load_table
+from src.data.incremental import append_new_ratings, load_high_water_marks
+
+T = 1_200_000_000
+
+
+def write_raw(data_path, dataset_name, ratings, users):
+    folder = os.path.join(data_path, dataset_name)
+    os.makedirs(folder, exist_ok=True)
+    pd.DataFrame(ratings, columns=["beer_id", "brewery_id", "date", "user_id", "rating", "text"]).to_parquet(
+        os.path.join(folder, dataset_name + "_ratings.parquet"))
+    pd.DataFrame(users, columns=["user_id", "user_name", "nbr_ratings", "location"]).to_parquet(
+        os.path.join(folder, dataset_name + "_users.parquet"))
+
+
+def test_append_ingests_ratings_at_the_high_water_mark_once(tmp_path):
+    data_path, aggregates_path = str(tmp_path / "data"), str(tmp_path / "aggregates")
+    breweries = pd.DataFrame({"brewery_id": [0, 1], "state": ["Oregon", "Texas"]})
+    users = [("a", "na", 1, "United States, Oregon"), ("b", "nb", 1, "United States, Texas")]
+    ratings = [(1, 0, T, "a", 3.0, "t"), (2, 1, T + 100, "a", 4.0, "t")]
+    write_raw(data_path, "BeerAdvocate", ratings, users)
+    write_raw(data_path, "RateBeer", [], [])
+    os.makedirs(os.path.join(data_path, "MatchedBeerData"))
+    pd.DataFrame({"rb_beer_id": [], "rb_user_id": []}).to_parquet(os.path.join(data_path, "MatchedBeerData", "usa_ratings.parquet"))
+
+    first = append_new_ratings(data_path, breweries, aggregates_path)
+    assert first["beer_id"].tolist() == [1, 2]
+    assert load_high_water_marks(aggregates_path) == {"BeerAdvocate": T + 100}
+
+    # a rating with the same timestamp as the mark and one of a new user were added since
+    users += [("c", "nc", 1, "United States, Texas"), ("d", "nd", 1, "Germany")]
+    ratings += [(3, 1, T + 100, "b", 5.0, "t"), (4, 0, T + 200, "c", 2.0, "t"), (5, 0, T + 200, "d", 2.0, "t")]
+    write_raw(data_path, "BeerAdvocate", ratings, users)
+    second = append_new_ratings(data_path, breweries, aggregates_path)
+    assert second["beer_id"].tolist() == [3, 4]
+    assert load_table(os.path.join(data_path, "BeerAdvocate", "usa_users"))["user_id"].tolist() == ["a", "b", "c"]
+    assert len(append_new_ratings(data_path, breweries, aggregates_path)) == 0
+
+    counts = load_table(os.path.join(aggregates_path, "monthly_state_counts"))
+    assert counts["count"].sum() == 4
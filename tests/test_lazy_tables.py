@@ -0,0 +1,48 @@
+import threading
+import pandas as pd
+import pytest
+from src.data.lazy_tables import LazyTables
+
+
+class CountingLoader:
+    def __init__(self, table, error=None, release=None):
+        self.table, self.error, self.release = table, error, release
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.release is not None:
+            self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.table
+
+
+def test_tables_are_only_loaded_on_first_access():
+    ratings, users = CountingLoader(pd.DataFrame({"rating": [4.0]})), CountingLoader(pd.DataFrame({"user_id": ["a"]}))
+    tables = LazyTables({"ratings.csv": ratings, "users.csv": users})
+    assert "ratings.csv" in tables and sorted(tables) == ["ratings.csv", "users.csv"]
+    assert ratings.calls == users.calls == 0
+
+    assert tables["ratings.csv"] is tables["ratings.csv"]
+    assert ratings.calls == 1 and users.calls == 0
+    assert tables.is_loaded("ratings.csv") and not tables.is_loaded("users.csv")
+    with pytest.raises(KeyError):
+        tables["beers.csv"]
+
+
+def test_prefetch_errors_surface_on_access():
+    broken = CountingLoader(None, error=OSError("truncated file"))
+    tables = LazyTables({"broken.csv": broken, "users.csv": CountingLoader(pd.DataFrame({"user_id": ["a"]}))})
+    with pytest.raises(OSError, match="truncated file"):
+        tables.prefetch()
+    assert tables.is_loaded("users.csv") and not tables.is_loaded("broken.csv")
+
+    # in the background the error is raised by the access waiting for the load, and the next access retries
+    broken.release = threading.Event()
+    tables.prefetch(["broken.csv"], wait=False)
+    broken.release.set()
+    with pytest.raises(OSError, match="truncated file"):
+        tables["broken.csv"]
+    broken.error, calls = None, broken.calls
+    assert tables["broken.csv"] is None and broken.calls == calls + 1
@@ -0,0 +1,81 @@
+import warnings
+import numpy as np
+import pandas as pd
+from src.data.load_data import merge_ratings_breweries
+from src.utils.data_utils import merge_breweries, merge_reviews
+
+
+def baseline_merge_ratings_breweries(ratings_df, breweries_df):
+    merged_df = ratings_df.merge(breweries_df[['brewery_id', 'state']], on='brewery_id', how='left')
+    merged_df = merged_df.dropna(subset=['state_y'])
+    merged_df = merged_df.rename(columns={'state_x': 'user_state', 'state_y': 'brewery_state'})
+    return merged_df.drop(columns='_merge', errors='ignore').reset_index(drop=True)
+
+
+def baseline_merge_reviews(data_ba, data_rb, data_matched):
+    data_matched_renamed = data_matched[['rb_beer_id', 'rb_user_id']].rename(columns={'rb_beer_id': 'beer_id', 'rb_user_id': 'user_id'})
+    data_rb = data_rb.merge(data_matched_renamed, on=['beer_id', 'user_id'], how='left', indicator=True)
+    data_rb = data_rb[data_rb['_merge'] == 'left_only']
+    return pd.concat([data_ba, data_rb], axis=0, ignore_index=True)
+
+
+def baseline_merge_breweries(breweries_ba, breweries_rb, breweries_matched):
+    breweries_matched_renamed = breweries_matched[['rb_id']].rename(columns={'rb_id': 'brewery_id'})
+    breweries_rb = breweries_rb.merge(breweries_matched_renamed, on='brewery_id', how='left', indicator=True)
+    breweries_rb = breweries_rb[breweries_rb['_merge'] == 'left_only'].drop(columns='_merge')
+    return pd.concat([breweries_ba, breweries_rb], axis=0, ignore_index=True)
+
+
+def make_tables():
+    ratings_ba = pd.DataFrame({"beer_id": [1, 2, 3, 4], "user_id": ["a", "b", "a", "c"], "brewery_id": [10, 11, 10, 99],
+                               "state": ["Oregon", "Texas", "Oregon", None]})
+    ratings_rb = pd.DataFrame({"beer_id": [1, 5, 6, 7], "user_id": ["x", "y", "x", "z"], "brewery_id": [10, 20, 21, 11],
+                               "state": ["Ohio", "Ohio", "Texas", "Iowa"]})
+    matched_ratings = pd.DataFrame({"rb_beer_id": [5], "rb_user_id": ["y"]})
+    breweries_ba = pd.DataFrame({"brewery_id": [10, 11], "state": ["Oregon", "Belgium"]})
+    breweries_rb = pd.DataFrame({"brewery_id": [10, 20, 21], "state": ["California", "Texas", None]})
+    # RateBeer brewery 11 is BeerAdvocate brewery 11
+    breweries_matched = pd.DataFrame({"ba_id": [11], "rb_id": [11]})
+    return ratings_ba, ratings_rb, matched_ratings, breweries_ba, breweries_rb, breweries_matched
+
+
+def test_merge_matches_baseline_for_a_single_dataset():
+    ratings_ba, _, _, breweries_ba, _, _ = make_tables()
+    expected = baseline_merge_ratings_breweries(ratings_ba, breweries_ba)
+    merged = merge_ratings_breweries(ratings_ba, breweries_ba)
+    pd.testing.assert_frame_equal(merged.astype({"brewery_state": object}), expected)
+
+
+def test_merged_datasets_match_baseline():
+    ratings_ba, ratings_rb, matched_ratings, breweries_ba, breweries_rb, breweries_matched = make_tables()
+    ratings = merge_reviews(ratings_ba, ratings_rb, matched_ratings)
+    pd.testing.assert_frame_equal(ratings, baseline_merge_reviews(ratings_ba, ratings_rb, matched_ratings).drop(columns='_merge'))
+    breweries = merge_breweries(breweries_ba, breweries_rb, breweries_matched)
+    pd.testing.assert_frame_equal(breweries, baseline_merge_breweries(breweries_ba, breweries_rb, breweries_matched))
+
+    # brewery 10 is in both datasets, so its ratings are duplicated like in the baseline merge
+    expected = baseline_merge_ratings_breweries(baseline_merge_reviews(ratings_ba, ratings_rb, matched_ratings),
+                                                baseline_merge_breweries(breweries_ba, breweries_rb, breweries_matched))
+    merged = merge_ratings_breweries(ratings, breweries)
+    pd.testing.assert_frame_equal(merged.reset_index(drop=True).astype({"brewery_state": object}), expected)
+
+
+def test_duplicated_brewery_keys_duplicate_their_ratings_like_a_merge():
+    ratings_ba, _, _, breweries_ba, _, _ = make_tables()
+    breweries = pd.concat([breweries_ba, pd.DataFrame({"brewery_id": [10], "state": ["Ohio"]})], ignore_index=True)
+    expected = baseline_merge_ratings_breweries(ratings_ba, breweries)
+    merged = merge_ratings_breweries(ratings_ba, breweries)
+    pd.testing.assert_frame_equal(merged.astype({"brewery_state": object}), expected)
+    assert np.array_equal(merged["beer_id"], [1, 1, 2, 3, 3])
+
+
+def test_empty_dataset_does_not_change_the_merged_dtypes():
+    ratings_ba, ratings_rb, matched_ratings, _, _, _ = make_tables()
+    ratings_ba = ratings_ba.assign(rating=np.float32(4.5), style=pd.Categorical(["IPA", "Stout", "IPA", "IPA"]))
+    # an empty table read back from a file without rows has object columns
+    empty_rb = ratings_rb.iloc[:0].assign(rating=pd.Series([], dtype=object), rb_only=pd.Series([], dtype=object))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        ratings = merge_reviews(ratings_ba, empty_rb, matched_ratings)
+    assert ratings.columns.tolist() == ratings_ba.columns.tolist() + ["rb_only"]
+    pd.testing.assert_series_equal(ratings.dtypes.iloc[:-1], ratings_ba.dtypes)
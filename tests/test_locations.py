@@ -0,0 +1,44 @@
+import pandas as pd
+from src.data.load_data import get_states_from_df
+from src.data.locations import LocationIndex, canonical_location
+from src.data.wrangling import filter_only_americans, get_us_states
+
+LOCATIONS = pd.Series([
+    "United States, California", "Germany", "United States", "United States, New York",
+    "Canada, Ontario", "England", "Belgium<a href=\"http://x\">x</a>", None, "United States, California",
+])
+
+
+def baseline_states(df):
+    # get_states_from_df of the baseline
+    return df[df["location"].str.contains("United States,", na=False)]["location"].map(
+        lambda x: x.replace("United States, ", "")).unique()
+
+
+def test_states_match_baseline():
+    df = pd.DataFrame({"location": LOCATIONS})
+    assert sorted(get_states_from_df(df)) == sorted(baseline_states(df)) == ["California", "New York"]
+
+
+def test_bare_united_states_is_not_a_state():
+    assert not canonical_location("United States")["is_us"]
+    assert canonical_location("United States, Texas")["is_us"]
+    df = pd.DataFrame({"location": LOCATIONS})
+    assert list(filter_only_americans(df)["location"]) == [
+        "United States, California", "United States, New York", "United States, California"]
+    assert list(get_us_states(df)) == ["United States, California", "United States, New York"]
+
+
+def test_canonical_records():
+    record = canonical_location("Canada, Ontario")
+    assert (record["location"], record["country"], record["state"], record["code"]) == ("Canada", "Canada", "Ontario", "ON")
+    assert canonical_location("Belgium<a href=\"http://x\">x</a>")["clean"] == "Belgium"
+    assert canonical_location("United States, New York")["location"] == "New York"
+
+
+def test_location_index_encodes_each_location_once():
+    index = LocationIndex()
+    codes = index.encode(LOCATIONS)
+    assert codes[-2] == -1 and codes[0] == codes[-1]
+    assert list(index.lookup(codes, "state"))[:3] == ["California", "Germany", "United States"]
+    assert len(index.table) == LOCATIONS.nunique()
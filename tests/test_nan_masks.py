@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.nan_masks import NanMask, NanMaskBuilder, add_nan_columns, load_nan_mask
+
+
+def make_is_nan(length, seed=0):
+    rng = np.random.default_rng(seed)
+    is_nan = {"abv": rng.random(length) < 0.3, "style": rng.random(length) < 0.05, "rating": np.zeros(length, dtype=bool)}
+    # the last row is in the last, partially filled byte
+    is_nan["style"][-1] = True
+    return is_nan
+
+
+def test_mask_round_trips_a_length_that_is_not_a_multiple_of_8(tmp_path):
+    is_nan = make_is_nan(21)
+    mask = NanMask.from_columns(is_nan, 21)
+    assert mask.columns == ["abv", "style"] and mask.bits.shape == (2, 3)
+    np.testing.assert_array_equal(mask["abv"], is_nan["abv"])
+    np.testing.assert_array_equal(mask["style"], is_nan["style"])
+
+    mask.save(str(tmp_path / "usa_ratings.parquet"))
+    loaded = load_nan_mask(str(tmp_path / "usa_ratings"))
+    assert len(loaded) == 21 and loaded.columns == mask.columns
+    pd.testing.assert_frame_equal(loaded.to_frame(), mask.to_frame())
+    assert load_nan_mask(str(tmp_path / "usa_users")) is None
+
+
+def test_chunked_builder_matches_the_mask_of_the_whole_table():
+    is_nan = make_is_nan(45, seed=1)
+    builder = NanMaskBuilder()
+    # chunks of 13, 7 and 25 rows, the second one without the style column
+    builder.append({column: values[:13] for column, values in is_nan.items()}, 13)
+    builder.append({"abv": is_nan["abv"][13:20]}, 7)
+    builder.append({column: values[20:] for column, values in is_nan.items()}, 25)
+    expected = dict(is_nan, style=np.concatenate([is_nan["style"][:13], np.zeros(7, dtype=bool), is_nan["style"][20:]]))
+
+    mask = builder.finish()
+    assert len(mask) == 45 and mask.columns == ["abv", "style"]
+    for column in mask.columns:
+        np.testing.assert_array_equal(mask[column], expected[column])
+    assert builder.finish(keep_empty=True).columns == ["abv", "style", "rating"]
+
+
+def test_nan_columns_are_added_by_position():
+    is_nan = make_is_nan(10)
+    df = pd.DataFrame({"abv": 1.0, "style": "IPA", "rating": 3.0}, index=range(100, 110))
+    with_nans = add_nan_columns(df, NanMask.from_columns(is_nan, 10), dtype=int)
+    assert with_nans.columns.tolist() == ["abv", "style", "rating", "abv_nan", "style_nan"]
+    assert with_nans["abv_nan"].tolist() == is_nan["abv"].astype(int).tolist()
+    with pytest.raises(ValueError):
+        add_nan_columns(df.iloc[:9], NanMask.from_columns(is_nan, 10))
@@ -0,0 +1,78 @@
+import logging
+import os
+import pandas as pd
+from src.data.datasets import DATASETS
+from src.data.pipeline import Stage, default_stages, run_pipeline, stale_stages
+
+
+def read_total(path):
+    return int(pd.read_csv(path)["value"].sum())
+
+
+def double(total):
+    return 2 * total
+
+
+def make_stages(input_path):
+    return {
+        "total": Stage(read_total, {"path": input_path}, inputs=(input_path,)),
+        "double": Stage(double, deps=("total",)),
+    }
+
+
+def test_pipeline_reuses_cache_and_reruns_on_input_change(tmp_path, caplog):
+    input_path = str(tmp_path / "values.csv")
+    cache_path = str(tmp_path / "cache")
+    pd.DataFrame({"value": [1, 2, 3]}).to_csv(input_path, index=False)
+    stages = make_stages(input_path)
+
+    with caplog.at_level(logging.INFO, logger="src.data.pipeline"):
+        assert run_pipeline(stages, ["double"], cache_path=cache_path) == {"double": 12}
+    assert [record.getMessage() for record in caplog.records] == ["Running stage total", "Running stage double"]
+    assert stale_stages(stages, ["double"], cache_path=cache_path) == []
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger="src.data.pipeline"):
+        assert run_pipeline(stages, ["double"], cache_path=cache_path) == {"double": 12}
+    assert caplog.records == []
+
+    # rewriting the declared input invalidates the stage and the ones after it
+    pd.DataFrame({"value": [1, 2, 3, 4]}).to_csv(input_path, index=False)
+    assert stale_stages(stages, ["double"], cache_path=cache_path) == ["total", "double"]
+    assert run_pipeline(stages, ["double"], cache_path=cache_path) == {"double": 20}
+    assert len(os.listdir(cache_path)) == 2
+
+
+def test_stages_read_the_dataset_folders_written_by_the_cleaning(tmp_path):
+    stages = default_stages(str(tmp_path / "raw"), str(tmp_path / "clean"))
+    folders = {os.path.relpath(path, tmp_path / "clean").split(os.sep)[0]
+               for name in ("usa_ratings", "breweries", "states", "distances") for path in stages[name].inputs}
+    assert folders == set(DATASETS)
+
+
+def test_clean_stage_writes_the_tables_read_after_it(tmp_path):
+    stages = default_stages(str(tmp_path / "raw"), str(tmp_path / "clean"))
+    read = {path for name in ("usa_ratings", "breweries", "states", "distances") for path in stages[name].inputs
+            if path.endswith(".parquet")}
+    assert read <= set(stages["clean"].outputs)
+    assert str(tmp_path / "clean" / "MatchedBeerData" / "matched_beer_data_ratings.parquet") in stages["clean"].inputs
+
+
+def state_table(path):
+    return pd.read_csv(path).groupby("state")[["value"]].sum()
+
+
+def test_dataframe_artifacts_are_cached_as_parquet(tmp_path, caplog):
+    input_path = str(tmp_path / "values.csv")
+    cache_path = str(tmp_path / "cache")
+    pd.DataFrame({"state": ["Texas", "Ohio", "Texas"], "value": [1, 2, 3]}).to_csv(input_path, index=False)
+    stages = {"table": Stage(state_table, {"path": input_path}, inputs=(input_path,)),
+              "total": Stage(lambda table: int(table["value"].sum()), deps=("table",))}
+
+    first = run_pipeline(stages, cache_path=cache_path)
+    assert sorted(os.path.splitext(name)[1] for name in os.listdir(cache_path)) == [".parquet", ".pkl"]
+    with caplog.at_level(logging.INFO, logger="src.data.pipeline"):
+        second = run_pipeline(stages, cache_path=cache_path)
+    assert not caplog.records
+    pd.testing.assert_frame_equal(second["table"], first["table"])
+    assert second["total"] == 6
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.ratings_store import build_ratings_store, count_state_pairs, get_state_pair_counts, open_ratings_store
+
+
+def merged_reviews():
+    return pd.DataFrame({
+        "user_id": ["a", "b", "a", "c"],
+        "beer_id": [1, 2, 3, 4],
+        "brewery_id": [10, 20, 10, 30],
+        "user_state": pd.Categorical(["Texas", "Oregon", None, "Texas"]),
+        "brewery_state": pd.Categorical(["Texas", "Germany", "Oregon", None]),
+        "date": pd.to_datetime(["2010-01-05", "2011-03-01", "2012-07-04", "2013-12-31"]),
+        "rating": [3.5, 4.0, 2.5, 5.0],
+    })
+
+
+def test_missing_states_are_not_a_label(tmp_path):
+    build_ratings_store(merged_reviews(), str(tmp_path))
+    store = open_ratings_store(str(tmp_path))
+    assert store.states == ["Germany", "Oregon", "Texas"]
+    assert store["user_state"].tolist() == [2, 1, -1, 2]
+    assert store["brewery_state"].tolist() == [2, 0, 1, -1]
+
+    df = store.to_dataframe()
+    assert df["user_state"].isna().tolist() == [False, False, True, False]
+    assert df["date"].tolist() == merged_reviews()["date"].tolist()
+    assert store.user_ids() == ["a", "b", "c"]
+
+
+def test_pair_counts_skip_missing_states(tmp_path):
+    reviews = merged_reviews()
+    build_ratings_store(reviews, str(tmp_path))
+    store = open_ratings_store(str(tmp_path))
+    counts = count_state_pairs(store)
+    assert counts.sum() == 2
+    assert counts[2, 2] == 1 and counts[1, 0] == 1
+
+    expected = reviews.groupby(["user_state", "brewery_state"], observed=True).size()
+    table = get_state_pair_counts(str(tmp_path), n_workers=1)
+    assert table.stack()[table.stack() > 0].to_dict() == expected.to_dict()
+
+
+def test_ids_are_checked_before_downcasting(tmp_path):
+    with pytest.raises(ValueError, match="outside the range"):
+        build_ratings_store(merged_reviews().assign(beer_id=[1, 2, 3, 2 ** 40]), str(tmp_path))
+    with pytest.raises(ValueError, match="missing values"):
+        build_ratings_store(merged_reviews().assign(brewery_id=[10.0, np.nan, 10.0, 30.0]), str(tmp_path))
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+from src.data.schemas import apply_schema, column_dtype, union_categories
+
+
+def test_nan_indicators_and_matched_prefixes_get_the_declared_dtypes():
+    assert column_dtype("ratings", "abv_nan") == "bool"
+    assert column_dtype("ratings", "ba_abv_nan") == "bool"
+    assert column_dtype("ratings", "ba_rating") == column_dtype("ratings", "rb_rating") == "float32"
+    assert column_dtype("users", "rb_location") == "category"
+    assert column_dtype("ratings", "xx_rating") is None
+    assert column_dtype("ratings", "text") is None
+
+    df = pd.DataFrame({"ba_beer_id": [1, 2], "rb_rating": [3.5, 4.0], "rb_style": ["IPA", "IPA"],
+                       "abv_nan": [0, 1], "ba_abv_nan": [1, 0], "text": ["a", "b"]})
+    converted = apply_schema(df, "ratings")
+    assert converted.dtypes.astype(str).to_dict() == {"ba_beer_id": "int8", "rb_rating": "float32", "rb_style": "category",
+                                                      "abv_nan": "bool", "ba_abv_nan": "bool", "text": "object"}
+    assert converted["abv_nan"].tolist() == [False, True]
+
+
+def test_union_categories_keeps_concatenated_columns_categorical():
+    first = pd.DataFrame({"state": pd.Categorical(["Oregon", "Texas"]), "rating": [1.0, 2.0]})
+    second = pd.DataFrame({"state": pd.Categorical(["Maine"]), "rating": [3.0]})
+    merged = pd.concat(union_categories([first, second]), ignore_index=True)
+    assert isinstance(merged["state"].dtype, pd.CategoricalDtype)
+    assert merged["state"].tolist() == ["Oregon", "Texas", "Maine"]
+    assert merged["state"].cat.categories.tolist() == ["Maine", "Oregon", "Texas"]
+    np.testing.assert_array_equal(merged["rating"], [1.0, 2.0, 3.0])
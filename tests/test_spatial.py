@@ -0,0 +1,18 @@
+import pandas as pd
+from src.data.gazetteer import load_gazetteer
+from src.data.spatial import get_city_coordinates
+
+
+def test_gazetteer_cities_must_be_in_the_state_of_the_location():
+    gazetteer = load_gazetteer()
+    users = pd.DataFrame({
+        "location": ["United States, Oregon", "United States, Maine", "England", "Germany", "United States, Texas"],
+        "city": ["Portland", "Portland", "London", "Munich", None],
+    })
+    coordinates = get_city_coordinates(users, gazetteer=gazetteer)
+    assert coordinates["United States, Oregon, Portland"] == gazetteer.find("Portland", ["city"])
+    # Portland, Maine is not the Portland of the gazetteer, the centroid of Maine is used
+    assert coordinates["United States, Maine, Portland"] == gazetteer.locate("United States, Maine")
+    assert coordinates["England, London"].kind == "city"
+    assert coordinates["Germany, Munich"].kind == "city"
+    assert coordinates["United States, Texas"] == gazetteer.locate("United States, Texas")
@@ -0,0 +1,111 @@
+import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from src.data.state_counts import (get_monthly_counts_usa, get_reviews_by_month, get_state_adjacency_matrix,
+                                   get_state_matrix_per_month)
+from src.data.time_buckets import add_time_buckets
+
+STATES = ["California", "Oregon", "Texas"]
+
+
+def make_reviews():
+    reviews = pd.DataFrame({
+        "date": pd.to_datetime(["2010-11-15 00:00:00", "2010-11-20 00:00:00", "2010-12-31 23:00:00",
+                                "2010-12-01 00:00:00", "2011-01-02 00:00:00", "2010-12-05 00:00:00"]),
+        "user_state": ["California", "California", "Oregon", "Oregon", "Texas", "Germany"],
+        "brewery_state": ["California", "Oregon", "Belgium", "Oregon", "California", "California"],
+    })
+    reviews["date"] = reviews["date"].astype("int64") // 10**9
+    return add_time_buckets(reviews)
+
+
+def test_end_month_keeps_the_whole_last_month():
+    reviews = make_reviews()
+    by_month = get_reviews_by_month(reviews, start_month="2010-11", end_month="2010-12")
+    assert by_month.size().to_dict() == {pd.Period("2010-11", "M"): 2, pd.Period("2010-12", "M"): 3}
+
+    counts = get_monthly_counts_usa(reviews, STATES, start_month="2010-11", end_month="2010-12", as_ratio=False)
+    expected = pd.DataFrame({"local_count": [1, 1], "national_count": [1, 0], "foreign_count": [0, 1]},
+                            index=pd.PeriodIndex(["2010-11", "2010-12"], freq="M", name="date"))
+    pd.testing.assert_frame_equal(counts, expected, check_dtype=False)
+
+
+def baseline_get_state_adjacency_matrix(ratings_breweries_merged, states, as_ratio=True, drop_world=True):
+    state_matrix = ratings_breweries_merged.groupby(by=["user_state", "brewery_state"], observed=False).size().unstack(fill_value=0)
+    foreign_counts = state_matrix.drop(columns=states, errors='ignore').T.sum().fillna(0)
+    state_matrix = state_matrix.reindex(index=sorted(list(states)), columns=sorted(list(states)), fill_value=0)
+    if not drop_world:
+        state_matrix["World"] = foreign_counts
+    if as_ratio:
+        state_matrix = state_matrix.apply(lambda row: row / row.sum() if row.sum() > 0 else row, axis=1)
+    return state_matrix
+
+
+def make_random_reviews(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    locations = STATES + ["Maine", "Germany", "Belgium"]
+    reviews = pd.DataFrame({
+        "date": rng.integers(1_200_000_000, 1_260_000_000, n),
+        "user_state": rng.choice(STATES + ["Germany"], n),
+        "brewery_state": rng.choice(locations + [None], n),
+    })
+    return add_time_buckets(reviews)
+
+
+@pytest.mark.parametrize("as_ratio", [True, False])
+@pytest.mark.parametrize("drop_world", [True, False])
+@pytest.mark.parametrize("categorical", [True, False])
+def test_adjacency_matrix_matches_baseline(as_ratio, drop_world, categorical):
+    reviews = make_random_reviews()
+    if categorical:
+        reviews = reviews.astype({"user_state": "category", "brewery_state": "category"})
+    expected = baseline_get_state_adjacency_matrix(reviews, STATES, as_ratio=as_ratio, drop_world=drop_world)
+    matrix = get_state_adjacency_matrix(reviews, STATES, as_ratio=as_ratio, drop_world=drop_world)
+    pd.testing.assert_frame_equal(matrix, expected, check_dtype=False, check_names=False)
+
+
+def baseline_get_state_matrix_per_month(ratings_breweries_merged, states, start_month=None, end_month=None,
+                                        cumulative=False):
+    dates = pd.to_datetime(ratings_breweries_merged["date"]).dt.date
+    if start_month:
+        ratings_breweries_merged = ratings_breweries_merged[dates >= start_month]
+        dates = dates[dates >= start_month]
+    if end_month:
+        ratings_breweries_merged = ratings_breweries_merged[dates <= end_month]
+    by_month = ratings_breweries_merged.groupby(pd.to_datetime(ratings_breweries_merged["date"]).dt.to_period('M'))
+    counts_by_month = by_month[["user_state", "brewery_state"]].apply(
+        lambda x: baseline_get_state_adjacency_matrix(x, states, as_ratio=False, drop_world=False).fillna(0))
+    if cumulative:
+        counts_by_month = counts_by_month.groupby(level="user_state").cumsum()
+    return counts_by_month
+
+
+def baseline_get_total_counts_from_monthly_data(counts_by_month, as_ratio=True):
+    def total_counts_by_date(sub_df):
+        local_count = np.diagonal(sub_df.drop(columns=["user_state", "World"])).sum()
+        foreign_count = sub_df['World'].sum()
+        national_count = np.array(sub_df.drop(columns=["user_state", 'World'])).sum() - local_count
+        return pd.Series({'local_count': local_count, 'national_count': national_count, 'foreign_count': foreign_count})
+
+    counts = counts_by_month.reset_index().groupby("date")[list(counts_by_month.columns) + ["user_state"]].apply(
+        total_counts_by_date)
+    if as_ratio:
+        return counts.div(counts.sum(axis=1), axis=0).fillna(0)
+    return counts
+
+
+@pytest.mark.parametrize("cumulative", [True, False])
+def test_monthly_counts_match_baseline(cumulative):
+    reviews = make_random_reviews()
+    expected_matrices = baseline_get_state_matrix_per_month(reviews, STATES, cumulative=cumulative)
+    pd.testing.assert_frame_equal(get_monthly_counts_usa(reviews, STATES, cumulative=cumulative),
+                                  baseline_get_total_counts_from_monthly_data(expected_matrices), check_dtype=False)
+
+    expected_matrices = baseline_get_state_matrix_per_month(reviews, STATES, datetime.date(2008, 3, 1),
+                                                            datetime.date(2009, 6, 30), cumulative=cumulative)
+    counts = get_monthly_counts_usa(reviews, STATES, "2008-03", "2009-06", cumulative=cumulative, as_ratio=False)
+    pd.testing.assert_frame_equal(counts, baseline_get_total_counts_from_monthly_data(expected_matrices, as_ratio=False),
+                                  check_dtype=False)
+    matrices = get_state_matrix_per_month(get_reviews_by_month(reviews, "2008-03", "2009-06"), STATES, cumulative)
+    pd.testing.assert_frame_equal(matrices, expected_matrices, check_dtype=False, check_names=False)
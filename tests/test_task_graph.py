@@ -0,0 +1,72 @@
+import os
+import time
+import pytest
+from src.data import task_graph
+from src.data.task_graph import Task, check_task_graph, run_task_graph
+
+
+def record(folder, name, required=(), duration=0.0):
+    # fails if a required task did not finish before, then writes the start and end time of the task
+    missing = [dep for dep in required if not os.path.exists(os.path.join(folder, dep))]
+    if missing:
+        raise AssertionError(f"{name} started before {missing}")
+    start = time.monotonic()
+    time.sleep(duration)
+    with open(os.path.join(folder, name), "w") as f:
+        f.write(f"{start} {time.monotonic()}")
+    return name
+
+
+def fail(name):
+    raise ValueError(f"{name} is broken")
+
+
+def intervals(folder, names):
+    spans = {}
+    for name in names:
+        with open(os.path.join(folder, name)) as f:
+            spans[name] = tuple(map(float, f.read().split()))
+    return spans
+
+
+def test_tasks_start_after_their_dependencies(tmp_path):
+    folder = str(tmp_path)
+    tasks = {
+        "ratings": Task(record, (folder, "ratings", ("users",)), ("users",)),
+        "users": Task(record, (folder, "users", (), 0.2)),
+        "beers": Task(record, (folder, "beers")),
+        "stats": Task(record, (folder, "stats", ("ratings", "beers")), ("ratings", "beers")),
+    }
+    assert run_task_graph(tasks, max_workers=3) == {name: name for name in tasks}
+
+
+def test_unknown_dependencies_and_cycles_are_rejected():
+    with pytest.raises(ValueError, match="unknown task users"):
+        check_task_graph({"ratings": Task(fail, ("ratings",), ("users",))})
+    with pytest.raises(ValueError, match="cycle"):
+        run_task_graph({"a": Task(fail, ("a",), ("b",)), "b": Task(fail, ("b",), ("a",))})
+
+
+def test_default_memory_cap_keeps_large_tasks_apart(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    # the default cap is half of the 200 bytes "available", two of these tasks do not fit together
+    monkeypatch.setattr(task_graph, "available_memory", lambda: 200)
+    tasks = {name: Task(record, (folder, name, (), 0.2), memory=60) for name in ("a", "b", "c")}
+    tasks["small"] = Task(record, (folder, "small", (), 0.2), memory=30)
+    run_task_graph(tasks, max_workers=4)
+    spans = sorted(intervals(folder, ["a", "b", "c"]).values())
+    assert all(earlier[1] <= later[0] for earlier, later in zip(spans, spans[1:]))
+
+
+def test_failed_task_cancels_the_tasks_after_it(tmp_path):
+    folder = str(tmp_path)
+    tasks = {
+        "users": Task(fail, ("users",)),
+        "ratings": Task(record, (folder, "ratings"), ("users",)),
+        "beers": Task(record, (folder, "beers", (), 0.2)),
+    }
+    with pytest.raises(RuntimeError, match="Task users failed, tasks not started: ratings") as error:
+        run_task_graph(tasks, max_workers=2)
+    assert isinstance(error.value.__cause__, ValueError)
+    # the task depending on the failed one never starts
+    assert "ratings" not in os.listdir(folder)
@@ -0,0 +1,95 @@
+import csv
+import gzip
+import os
+import tarfile
+import pandas as pd
+from src.data.load_data import load_data
+from src.data.txt_reviews import iter_chunks, txt_to_csv, txt_to_dataframe
+from src.data.wrangling import clean_ratings
+
+
+def make_review(i):
+    return (f"beer_name: Beer {i}\nbeer_id: {100 + i}\nbrewery_name: Brewery: {i % 3}\nbrewery_id: {i % 3}\nstyle: IPA\n"
+            f"abv: {'nan' if i % 4 == 0 else 5.5}\ndate: {1200000000 + i}\nuser_name: user{i}\nuser_id: user{i}.{i}\n"
+            f"appearance: 4.0\naroma: 3.5\npalate: 4.0\ntaste: 4.5\noverall: 4.0\nrating: 4.1\n"
+            f"text: Great: head, {i}\nreview: {i % 2 == 0}\n\n")
+
+
+def write_reviews(path, n=25):
+    with open(path, "wb") as f:
+        f.write(gzip.compress("".join(make_review(i) for i in range(n)).encode()))
+
+
+def baseline_load_txt(file_path):
+    # load_txt before the streaming parser
+    with gzip.open(file_path, 'rb') as f:
+        reviews = []
+        review = {}
+        for line in f:
+            line = str(line)
+            if len(line.strip()) <= 5:
+                reviews.append(review)
+                review = {}
+            else:
+                field_name, field_value = line.split(':', 1)
+                review[field_name.strip()[2:]] = field_value.strip()[:-3]
+    with open(file_path[:-7] + ".csv", 'w') as out:
+        file = csv.writer(out)
+        file.writerow(reviews[0].keys())
+        for review in reviews:
+            file.writerow(review.values())
+    return pd.read_csv(file_path[:-7] + ".csv")
+
+
+def test_streamed_csv_matches_baseline(tmp_path):
+    write_reviews(str(tmp_path / "ratings.txt.gz"))
+    expected = baseline_load_txt(str(tmp_path / "ratings.txt.gz"))
+    # small chunks so the reviews are split across many batches
+    txt_to_csv(str(tmp_path / "ratings.txt.gz"), str(tmp_path / "streamed.csv"), n_workers=1, chunk_size=300)
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / "streamed.csv"), expected)
+
+
+def test_parallel_parsing_matches_baseline(tmp_path):
+    write_reviews(str(tmp_path / "ratings.txt.gz"), n=60)
+    expected = baseline_load_txt(str(tmp_path / "ratings.txt.gz"))
+    parsed = txt_to_dataframe(str(tmp_path / "ratings.txt.gz"), n_workers=2, chunk_size=500)
+    # the baseline read review back from its csv as a bool, the parser keeps the raw text
+    assert parsed["review"].tolist() == expected["review"].astype(str).tolist()
+    pd.testing.assert_frame_equal(parsed.drop(columns="review"), expected.drop(columns="review"))
+
+
+def test_backslashes_and_utf8_survive_parsing_and_cleaning(tmp_path):
+    review = make_review(1).replace("Beer 1", "Caf\u00e9 Cr\u00e8me").replace("Brewery: 1", "C:\\x Brewing\\nCo")
+    review = review.replace("user_name: user1", "user_name: J\u00fcrgen")
+    with open(tmp_path / "ratings.txt.gz", "wb") as f:
+        f.write(gzip.compress(review.encode("utf-8")))
+    parsed = txt_to_dataframe(str(tmp_path / "ratings.txt.gz"), n_workers=1)
+    cleaned, _ = clean_ratings(parsed.drop(columns=["text", "review"]))
+    assert cleaned.loc[0, "beer_name"] == "Caf\u00e9 Cr\u00e8me"
+    assert cleaned.loc[0, "brewery_name"] == "C:\\x Brewing\\nCo"
+    assert cleaned.loc[0, "user_name"] == "J\u00fcrgen"
+
+
+def test_chunks_only_hold_whole_reviews(tmp_path):
+    write_reviews(str(tmp_path / "ratings.txt.gz"), n=10)
+    with gzip.open(tmp_path / "ratings.txt.gz", "rb") as f:
+        chunks = list(iter_chunks(f, chunk_size=100))
+    assert sum(chunk.count(b"beer_name:") for chunk in chunks) == 10
+    assert all(chunk.startswith(b"beer_name:") for chunk in chunks)
+
+
+def test_archive_members_are_parsed_without_extraction(tmp_path, monkeypatch):
+    write_reviews(str(tmp_path / "ratings.txt.gz"))
+    pd.DataFrame({"beer_id": [100, 101], "abv": [5.5, 6.0]}).to_csv(tmp_path / "beers.csv", index=False)
+    os.makedirs(tmp_path / "archives")
+    with tarfile.open(tmp_path / "archives" / "BeerAdvocate.tar.gz", "w:gz") as archive:
+        archive.add(tmp_path / "ratings.txt.gz", arcname="ratings.txt.gz")
+        archive.add(tmp_path / "beers.csv", arcname="beers.csv")
+    expected = baseline_load_txt(str(tmp_path / "ratings.txt.gz"))
+
+    monkeypatch.chdir(tmp_path)
+    data = load_data(str(tmp_path / "archives") + "/", bool_load_txt=True)
+    assert sorted(data) == ["BeerAdvocate_beers.csv", "BeerAdvocate_ratings.csv"]
+    pd.testing.assert_frame_equal(data["BeerAdvocate_ratings.csv"].drop(columns="review"), expected.drop(columns="review"))
+    pd.testing.assert_frame_equal(data["BeerAdvocate_beers.csv"], pd.read_csv(tmp_path / "beers.csv"))
+    assert not os.path.exists(tmp_path / "temp")
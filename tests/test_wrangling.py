@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+from src.data.columnar import load_table
+from src.data.nan_masks import load_nan_mask
+from src.data.wrangling import (clean_ratings_table, clean_users, decode_string, decode_unicode_escapes, map_unique_values,
+                                 replace_common_enc_errors, replace_common_chars)
+
+
+def write_raw_dataset(path, n=600):
+    rng = np.random.default_rng(0)
+    dataset = path / "BeerAdvocate"
+    dataset.mkdir()
+    users = pd.DataFrame({
+        "nbr_ratings": 1,
+        "user_id": [f"u{i}" for i in range(20)],
+        "user_name": [f"name{i}" for i in range(20)],
+        "location": ["United States, Ohio" if i % 3 else "Germany" for i in range(20)],
+    })
+    users.to_csv(dataset / "BeerAdvocate_users.csv", index=False)
+    ratings = pd.DataFrame({
+        # ids grow past the int8 range and styles differ between the first and the last chunks
+        "beer_id": np.arange(n),
+        "beer_name": [f"beer {i % 7}" for i in range(n)],
+        "brewery_id": rng.integers(0, 5, n),
+        "style": np.where(np.arange(n) < n // 2, "IPA", rng.choice(["Stout", None], n)),
+        "abv": np.where(rng.random(n) < 0.1, np.nan, 5.0),
+        "date": rng.integers(1_000_000_000, 1_400_000_000, n),
+        "user_id": [f"u{i}" for i in rng.integers(0, 25, n)],
+        "rating": 3.5,
+        "text": "t",
+        "review": True,
+    })
+    ratings.to_csv(dataset / "BeerAdvocate_ratings.csv", index=False)
+
+
+def test_chunked_ratings_match_ratings_cleaned_in_one_go(tmp_path):
+    write_raw_dataset(tmp_path)
+    clean_users(str(tmp_path), "BeerAdvocate", clean_load=True)
+    usa_ratings = str(tmp_path / "BeerAdvocate" / "usa_ratings")
+
+    clean_ratings_table(str(tmp_path), "BeerAdvocate", clean_load=True)
+    in_one_go = pd.read_parquet(usa_ratings + ".parquet")
+    mask = load_nan_mask(usa_ratings)
+
+    clean_ratings_table(str(tmp_path), "BeerAdvocate", clean_load=True, chunksize=50)
+    chunked = pd.read_parquet(usa_ratings + ".parquet")
+
+    pd.testing.assert_frame_equal(chunked, in_one_go)
+    assert chunked["beer_id"].dtype == np.int16
+    assert list(chunked["style"].cat.categories) == ["", "IPA", "Stout"]
+    chunked_mask = load_nan_mask(usa_ratings)
+    assert chunked_mask.columns == mask.columns
+    assert (chunked_mask.bits == mask.bits).all()
+    assert not (tmp_path / "BeerAdvocate" / "usa_ratings.parquet.chunks").exists()
+
+
+def test_only_us_users_are_kept(tmp_path):
+    write_raw_dataset(tmp_path)
+    clean_users(str(tmp_path), "BeerAdvocate", clean_load=True)
+    users = load_table(str(tmp_path / "BeerAdvocate" / "usa_users"))
+    assert len(users) == 13
+    assert set(users["location"]) == {"United States, Ohio"}
+
+
+def test_unique_value_decoding_matches_elementwise_apply():
+    names = pd.Series(["Caf\\xc3\\xa9", None, "Brasserie d\\'Achouffe", "Caf\\xc3\\xa9", np.nan, "C:\\\\x", "Caf\\xc3\\xa9"],
+                      index=[10, 11, 12, 13, 14, 15, 16], name="brewery_name")
+    # the former decode_string applied the decoding to every non missing value, the missing ones became nan
+    expected = names[names.notna()].apply(decode_unicode_escapes).reindex(names.index)
+    decoded = decode_string(names)
+    pd.testing.assert_series_equal(decoded, expected)
+    assert decoded[10] == "Caf\u00e9" and decoded[15] == "C:\\x"
+
+    df = pd.DataFrame({"location": ["Caf\u00c3\u00a9", "Ohio", "Caf\u00c3\u00a9"], "nbr_ratings": [1, 2, 3]})
+    expected = df["location"].apply(replace_common_chars)
+    pd.testing.assert_series_equal(replace_common_enc_errors(df.copy())["location"], expected)
+    pd.testing.assert_series_equal(map_unique_values(df["location"], str.upper), df["location"].str.upper())